@@ -1,3 +1,5 @@
+from fastapi.concurrency import run_in_threadpool
+
 from src.dependencies.auth import get_current_user
 from src.usecases.manage_chat_message_usecase import ManageChatMessageUsecase
 
@@ -10,10 +12,9 @@ class ChatMessageController:
         user = get_current_user(request)
         return user["user_id"]
 
-    def create_chat_message(self, request, data):
-        print("\033[31m" + "コントローラ実行" + "\033[0m")
-        user_id = self.get_current_user_id(request)
-        return self.manage_chat_message_usecase.create_chat_message(
+    async def acreate_chat_message(self, request, data):
+        user_id = await run_in_threadpool(self.get_current_user_id, request)
+        return await self.manage_chat_message_usecase.acreate_chat_message(
             user_id,
             data.chat_room_id,
             data.message,
@@ -23,6 +24,17 @@ class ChatMessageController:
             data.model,
             data.index_type,
             data.chat_history,
+            data.stream_format,
+        )
+
+    async def aregenerate_chat_message(self, request, message_id, data):
+        user_id = await run_in_threadpool(self.get_current_user_id, request)
+        return await self.manage_chat_message_usecase.aregenerate_chat_message(
+            user_id,
+            message_id,
+            data.model,
+            data.chat_history,
+            data.stream_format,
         )
 
     def get_chat_messages(self, request, chat_room_id):
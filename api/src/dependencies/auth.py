@@ -1,7 +1,9 @@
+import inspect
 import os
 from functools import wraps
 
 from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from itsdangerous import URLSafeTimedSerializer
 
 from src.repositories import UserRepository
@@ -42,31 +44,49 @@ def get_current_user(request: Request):
     return user_data
 
 
+def _find_request(args, kwargs) -> Request:
+    # `request`を`kwargs`から取得
+    request = kwargs.get("request")
+    if not request:
+        # 位置引数からrequestを探す
+        for arg in args:
+            if isinstance(arg, Request):
+                request = arg
+                break
+
+    if not request:
+        raise HTTPException(status_code=400, detail="Request is required")
+    return request
+
+
+def _check_role(user_data: dict, allowed_roles):
+    # ユーザーのロールが許可されたロールのいずれかに一致するかチェック
+    if user_data.get("role") not in allowed_roles:
+        # 必要なロールを持っていない場合
+        raise HTTPException(status_code=403, detail="Insufficient permissions")
+
+
 def requires_role(*allowed_roles):
     def decorator(func):
+        # 非同期のルートの場合は、ユーザー情報の取得（DBアクセス）をスレッドプールで実行する
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                request = _find_request(args, kwargs)
+                user_data = await run_in_threadpool(get_current_user, request)
+                _check_role(user_data, allowed_roles)
+                return await func(*args, **kwargs)
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # `request`を`kwargs`から取得
-            request = kwargs.get("request")
-            if not request:
-                # 位置引数からrequestを探す
-                for arg in args:
-                    if isinstance(arg, Request):
-                        request = arg
-                        break
-
-            if not request:
-                raise HTTPException(status_code=400, detail="Request is required")
-
+            request = _find_request(args, kwargs)
             # `get_current_user`関数を用いてユーザー情報を取得
             user_data = get_current_user(request)
-
-            # ユーザーのロールが許可されたロールのいずれかに一致するかチェック
-            if user_data.get("role") in allowed_roles:
-                return func(*args, **kwargs)
-
-            # 必要なロールを持っていない場合
-            raise HTTPException(status_code=403, detail="Insufficient permissions")
+            _check_role(user_data, allowed_roles)
+            return func(*args, **kwargs)
 
         return wrapper
 
@@ -0,0 +1,227 @@
+"""
+埋め込みAPIのバッチ呼び出し
+
+インデックス作成時に、多数のチャンクのテキストを1回の埋め込みリクエストにまとめて送信する。
+バッチは入力件数と合計トークン数の上限で区切る。リクエストのサイズ・入力の誤りで失敗したバッチは
+分割して再試行し、レート制限（429）や一時的なエラー（5xx・タイムアウト・接続エラー）の場合は
+待機してから同じバッチを再試行する。
+"""
+
+import os
+import random
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from openai import APIConnectionError
+
+from src.internal.token_counter import get_token_accountant
+
+
+class BatchEmbedder:
+    """
+    テキストを入力件数・合計トークン数の上限ごとのバッチに分けて埋め込むクラス
+
+    ベクトルは入力と同じ順序で返す。リクエストのサイズ・入力の誤り（400・413）で失敗したバッチは
+    半分に分割して再試行し、1件でも失敗する場合は例外を送出する。レート制限（429）や一時的なエラーの
+    場合は分割せずに待機して再試行する（リクエスト数を増やさない）。その他のエラーはそのまま送出する。
+    再試行はこのクラスで行うため、embed_fn のクライアントでは再試行を無効にする。
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[list[str]], list[list[float]]],
+        max_inputs: int = 128,
+        max_tokens: int = 50000,
+        max_workers: int = 2,
+        count_tokens: Callable[[str], int] | None = None,
+        max_retries: int = 5,
+        backoff_seconds: float = 1.0,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Args:
+            embed_fn: テキストのリストを受け取り、同じ順序でベクトルを返す関数（1回の埋め込みリクエスト）
+            max_inputs (int): 1リクエストあたりの入力件数の上限
+            max_tokens (int): 1リクエストあたりの合計トークン数の上限
+            max_workers (int): 同時に送信するリクエスト数
+            count_tokens: トークン数を数える関数（省略時はTokenAccountantで数える）
+            max_retries (int): レート制限・一時的なエラーの場合に再試行する回数の上限
+            backoff_seconds (float): レート制限・一時的なエラーの場合の最初の待機時間（再試行ごとに2倍にする。Retry-After がある場合はその時間）
+            sleep: 待機する関数
+        """
+        if max_inputs <= 0 or max_tokens <= 0:
+            raise ValueError("max_inputs と max_tokens は1以上を指定してください")
+        self.embed_fn = embed_fn
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
+        self.max_workers = max_workers
+        self.count_tokens = count_tokens or get_token_accountant().count
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failed_requests = 0
+        self.splits = 0
+        self.rate_limited = 0
+
+    @property
+    def group_size(self) -> int:
+        """1回の embed() で同時に送信できるバッチ分の入力件数（呼び出し側でまとめる件数の目安）"""
+        return self.max_inputs * max(self.max_workers, 1)
+
+    def plan_batches(self, texts: list[str]) -> list[list[int]]:
+        """
+        テキストの位置をバッチごとに分ける（入力の順序を維持する）。
+
+        上限を超えるテキストは単独のバッチとする。
+        """
+        batches: list[list[int]] = []
+        batch: list[int] = []
+        batch_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = self.count_tokens(text)
+            if batch and (
+                len(batch) >= self.max_inputs or batch_tokens + tokens > self.max_tokens
+            ):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        """テキストを埋め込み、texts と同じ順序のベクトルを返す"""
+        batches = self.plan_batches(texts)
+        vectors: list[list[float] | None] = [None] * len(texts)
+
+        def _embed(batch: list[int]):
+            for i, vector in zip(
+                batch, self._embed_with_split([texts[i] for i in batch]), strict=True
+            ):
+                vectors[i] = vector
+
+        if self.max_workers <= 1 or len(batches) <= 1:
+            for batch in batches:
+                _embed(batch)
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # result() で例外を呼び出し元に伝える
+                for future in [executor.submit(_embed, batch) for batch in batches]:
+                    future.result()
+        print(
+            f"埋め込み: {len(texts)}件を{len(batches)}バッチで作成しました "
+            f"(リクエスト: {self.requests}, 分割: {self.splits}, "
+            f"レート制限: {self.rate_limited})"
+        )
+        return vectors
+
+    def stats(self) -> dict[str, Any]:
+        """統計情報を取得する"""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "failed_requests": self.failed_requests,
+                "splits": self.splits,
+                "rate_limited": self.rate_limited,
+                "max_inputs": self.max_inputs,
+                "max_tokens": self.max_tokens,
+            }
+
+    def _embed_with_split(self, texts: list[str]) -> list[list[float]]:
+        try:
+            vectors = self._embed_with_retry(texts)
+        except Exception as e:
+            if len(texts) == 1 or not _is_request_error(e):
+                raise
+            with self._lock:
+                self.splits += 1
+            print(f"{len(texts)}件の埋め込みに失敗したため、分割して再試行します: {e}")
+            middle = len(texts) // 2
+            return self._embed_with_split(texts[:middle]) + self._embed_with_split(
+                texts[middle:]
+            )
+        return vectors
+
+    def _embed_with_retry(self, texts: list[str]) -> list[list[float]]:
+        """1回の埋め込みリクエストを送信する。レート制限・一時的なエラーの場合は待機して再試行する"""
+        attempt = 0
+        while True:
+            try:
+                vectors = self.embed_fn(texts)
+                if len(vectors) != len(texts):
+                    raise ValueError(
+                        f"埋め込みの件数が一致しません: {len(vectors)}/{len(texts)}"
+                    )
+            except Exception as e:
+                with self._lock:
+                    self.requests += 1
+                    self.failed_requests += 1
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                rate_limited = _status_code(e) == 429
+                if rate_limited:
+                    with self._lock:
+                        self.rate_limited += 1
+                wait = _retry_after(e)
+                if wait is None:
+                    wait = self.backoff_seconds * 2**attempt * random.uniform(1.0, 1.5)
+                reason = "レート制限された" if rate_limited else f"失敗した（{e}）"
+                print(f"埋め込みが{reason}ため、{wait:.1f}秒後に再試行します")
+                self.sleep(wait)
+                attempt += 1
+                continue
+            with self._lock:
+                self.requests += 1
+            return vectors
+
+
+def _status_code(error: Exception) -> int | None:
+    return getattr(error, "status_code", None)
+
+
+def _is_request_error(error: Exception) -> bool:
+    """バッチを分割すると成功する可能性のあるエラー（リクエストのサイズ・入力の誤り）かどうか"""
+    return isinstance(error, ValueError) or _status_code(error) in (400, 413)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """待機して同じリクエストを再試行すると成功する可能性のあるエラーかどうか"""
+    if isinstance(error, APIConnectionError):
+        return True
+    status_code = _status_code(error)
+    return status_code is not None and (
+        status_code in (408, 409, 429) or status_code >= 500
+    )
+
+
+def _retry_after(error: Exception) -> float | None:
+    """レート制限のレスポンスの Retry-After（秒）を取得する"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after") is not None:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def create_batch_embedder(
+    embed_fn: Callable[[list[str]], list[list[float]]],
+) -> BatchEmbedder:
+    """環境変数の設定でBatchEmbedderを作成する"""
+    return BatchEmbedder(
+        embed_fn,
+        max_inputs=int(os.environ.get("EMBEDDING_BATCH_MAX_INPUTS", 128)),
+        max_tokens=int(os.environ.get("EMBEDDING_BATCH_MAX_TOKENS", 50000)),
+        max_workers=int(os.environ.get("EMBEDDING_BATCH_WORKERS", 2)),
+        max_retries=int(os.environ.get("EMBEDDING_BATCH_MAX_RETRIES", 5)),
+    )
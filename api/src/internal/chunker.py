@@ -0,0 +1,296 @@
+"""
+マークダウンのテキストの見出しごとのチャンク分割
+
+ページのイテレータを1行ずつ1回だけ走査し、見出し（H1〜H3）ごとのチャンクを順に作成する。
+見出しの判定・コードブロックの扱い・同じ見出しの本文の結合は MarkdownHeaderTextSplitter と同じ規則で行う。
+
+チャンクには各行の開始位置（文字数）とその行のページ番号の索引を持たせ、長いチャンクを分割したときの
+ページ番号は分割後の開始位置から二分探索で求める。ページの区切りは行の区切りとして扱う。
+
+長いチャンクの分割方法は環境変数 CHUNK_SPLIT_MODE で切り替える。
+- characters: CHUNK_SIZE 文字ごとに分割する（CHUNK_OVERLAP 文字重ねる）
+- tokens: 埋め込みモデルのトークナイザーで数えたトークン数を上限に、日本語の区切り文字の位置で分割する
+"""
+
+import bisect
+import os
+import re
+from collections.abc import Callable, Iterable, Iterator
+
+from src.internal.token_counter import get_encoding
+
+CHUNK_SIZE = 512
+CHUNK_OVERLAP = 100
+# 優先して区切る文字（段落・改行を含む行・文の終わり）
+JAPANESE_SEPARATORS = ["\n\n", "  \n", "。"]
+
+# 前後の空白を除いて「#」〜「###」と空白で始まる行（または「#」〜「###」のみの行）を見出しとする
+_HEADER_PATTERN = re.compile(r"(#{1,3})(?: |$)")
+# Document Intelligence が出力するページ番号のコメントは検索のノイズとなるため削除する
+_PAGE_NUMBER_COMMENT_PATTERN = re.compile(r"<!-- PageNumber=(.*?) -->")
+
+
+class _Section:
+    """同じ見出しに属する本文（MarkdownHeaderTextSplitter の1つのチャンクに相当する）"""
+
+    def __init__(self, headers: tuple[tuple[int, str], ...]):
+        self.headers = headers
+        self.parts: list[str] = []
+        self.length = 0
+        self.line_offsets: list[int] = []
+        self.line_pages: list[int] = []
+
+    def add_line(self, line: str, page_number: int, separator: str):
+        if self.parts:
+            self.parts.append(separator)
+            self.length += len(separator)
+        self.line_offsets.append(self.length)
+        self.line_pages.append(page_number)
+        self.parts.append(line)
+        self.length += len(line)
+
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    def keywords(self) -> str:
+        return "".join(
+            title if level == 1 else " " + title for level, title in self.headers
+        )
+
+    def page_number_at(self, offset: int) -> int:
+        """本文の offset 文字目を含む行のページ番号を返す"""
+        return self.line_pages[bisect.bisect_right(self.line_offsets, offset) - 1]
+
+
+def iter_semantic_chunks(
+    pages: Iterable[dict],
+    split_ranges: Callable[[str], Iterable[tuple[int, int]]] | None = None,
+) -> Iterator[dict]:
+    """
+    ページのイテレータから、見出しごとのページ番号付きのチャンクを順に作成する
+
+    Args:
+        pages: page_content（マークダウンのテキスト）と metadata.page（ページ番号）を持つ辞書のイテレータ
+        split_ranges: 本文を分割する範囲（開始位置・終了位置）を返す関数。未指定の場合は環境変数の設定で作成する
+
+    Yields:
+        dict: content・page_number・keywords を持つチャンク
+    """
+    split_ranges = split_ranges or create_section_splitter()
+    for section in _iter_sections(pages):
+        content = section.content()
+        keywords = section.keywords()
+        # 長すぎる場合は、分割する
+        for start, end in split_ranges(content):
+            # 空白のみのチャンクは埋め込みAPIで拒否されるため、作成しない
+            if not content[start:end].strip():
+                continue
+            yield {
+                "content": content[start:end],
+                "page_number": section.page_number_at(start),
+                "keywords": keywords,
+            }
+
+
+def create_section_splitter() -> Callable[[str], Iterable[tuple[int, int]]]:
+    """環境変数の設定で、本文を分割する範囲を返す関数を作成する"""
+    if os.environ.get("CHUNK_SPLIT_MODE", "characters").lower() != "tokens":
+        return split_by_characters
+    encoding = get_encoding(
+        os.environ.get("EMBEDDING_MODEL_NAME", "text-embedding-3-small")
+    )
+    splitter = TokenSplitter(
+        lambda text: len(encoding.encode(text, disallowed_special=())),
+        max_tokens=int(os.environ.get("CHUNK_MAX_TOKENS", 400)),
+        overlap_tokens=int(os.environ.get("CHUNK_OVERLAP_TOKENS", 80)),
+    )
+    return splitter.split_ranges
+
+
+def split_by_characters(text: str) -> Iterator[tuple[int, int]]:
+    """CHUNK_SIZE 文字ごとに、前のチャンクと CHUNK_OVERLAP 文字重ねた範囲を返す"""
+    length = len(text)
+    if length <= CHUNK_SIZE:
+        yield 0, length
+        return
+    for i in range(0, length, CHUNK_SIZE):
+        yield max(i - CHUNK_OVERLAP, 0), min(i + CHUNK_SIZE, length)
+
+
+class TokenSplitter:
+    """
+    トークン数を上限として、区切り文字の位置で本文を分割する
+
+    本文を最初の区切り文字で区切った単位に分け、上限を超える単位は次の区切り文字で、
+    区切り文字がなくなった場合は上限に収まる位置の文字で区切る。単位を上限まで順に詰めてチャンクとし、
+    次のチャンクは前のチャンクの末尾の overlap_tokens 以内の単位から始める。
+    チャンクのトークン数は単位ごとのトークン数の合計で見積もる。
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        max_tokens: int = 400,
+        overlap_tokens: int = 80,
+        separators: list[str] | None = None,
+    ):
+        if max_tokens <= 0 or not 0 <= overlap_tokens < max_tokens:
+            raise ValueError(
+                "max_tokens は1以上、overlap_tokens は0以上 max_tokens 未満を指定してください"
+            )
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        # 区切り文字で区切れない場合は、最後に改行で区切る
+        self.separators = [*(separators or JAPANESE_SEPARATORS), "\n"]
+
+    def split_ranges(self, text: str) -> Iterator[tuple[int, int]]:
+        """本文を分割する範囲（開始位置・終了位置）を返す"""
+        if self.count_tokens(text) <= self.max_tokens:
+            yield 0, len(text)
+            return
+
+        units = self._merge_whitespace(text, self._units(text, 0, len(text), 0))
+        i = 0
+        while i < len(units):
+            # 上限まで単位を詰める（1つの単位は必ず上限以内）
+            j = i
+            tokens = 0
+            while j < len(units) and (
+                j == i or tokens + units[j][2] <= self.max_tokens
+            ):
+                tokens += units[j][2]
+                j += 1
+            start, end = self._strip(text, units[i][0], units[j - 1][1])
+            if start < end:
+                yield start, end
+            if j == len(units):
+                return
+
+            # 末尾の overlap_tokens 以内の単位を次のチャンクの先頭に含める
+            k = j
+            overlap = 0
+            while k - 1 > i and overlap + units[k - 1][2] <= self.overlap_tokens:
+                k -= 1
+                overlap += units[k][2]
+            # 次の単位が収まらない場合は、重ねる単位を減らす
+            while k < j and overlap + units[j][2] > self.max_tokens:
+                overlap -= units[k][2]
+                k += 1
+            i = k
+
+    @staticmethod
+    def _merge_whitespace(
+        text: str, units: Iterable[tuple[int, int, int]]
+    ) -> list[tuple[int, int, int]]:
+        """
+        空白・改行のみの単位を前の単位に結合する
+
+        上限の位置で区切った末尾の改行などが単独のチャンクにならないようにする
+        （結合した単位は空白の分だけ上限を超えることがある）。
+        """
+        merged: list[tuple[int, int, int]] = []
+        for start, end, tokens in units:
+            if merged and text[start:end].isspace():
+                previous_start, _, previous_tokens = merged[-1]
+                merged[-1] = (previous_start, end, previous_tokens + tokens)
+            else:
+                merged.append((start, end, tokens))
+        return merged
+
+    @staticmethod
+    def _strip(text: str, start: int, end: int) -> tuple[int, int]:
+        """範囲の先頭の改行・空白（前の文との区切り）を除く"""
+        while start < end and text[start].isspace():
+            start += 1
+        return start, end
+
+    def _units(
+        self, text: str, start: int, end: int, level: int
+    ) -> Iterator[tuple[int, int, int]]:
+        """text[start:end] を、上限以内のトークン数の単位（開始位置・終了位置・トークン数）に分ける"""
+        separator = self.separators[level]
+        position = start
+        while position < end:
+            found = text.find(separator, position, end)
+            # 区切り文字は前の単位に含める
+            unit_end = end if found == -1 else found + len(separator)
+            tokens = self.count_tokens(text[position:unit_end])
+            if tokens <= self.max_tokens:
+                yield position, unit_end, tokens
+            elif level + 1 < len(self.separators):
+                yield from self._units(text, position, unit_end, level + 1)
+            else:
+                yield from self._split_by_tokens(text, position, unit_end)
+            position = unit_end
+
+    def _split_by_tokens(
+        self, text: str, start: int, end: int
+    ) -> Iterator[tuple[int, int, int]]:
+        """区切り文字がない場合は、上限に収まる最も後ろの文字の位置で区切る"""
+        while start < end:
+            low, high = start + 1, end
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self.count_tokens(text[start:middle]) <= self.max_tokens:
+                    low = middle
+                else:
+                    high = middle - 1
+            yield start, low, self.count_tokens(text[start:low])
+            start = low
+
+
+def _iter_sections(pages: Iterable[dict]) -> Iterator[_Section]:
+    """ページの各行を走査し、見出しが変わるごとにそれまでの本文を返す"""
+    header_stack: list[tuple[int, str]] = []
+    section = None
+    # 空行・見出しで区切られていない本文の続きかどうか（続きの行は改行、区切られた行は「  \n」で結合する）
+    continues = False
+    in_code_block = False
+    opening_fence = ""
+
+    for page in pages:
+        page_number = page.get("metadata", {}).get("page", 1)
+        for line in page["page_content"].split("\n"):
+            stripped_line = line.strip()
+            if not stripped_line.isprintable():
+                stripped_line = "".join(filter(str.isprintable, stripped_line))
+
+            if not in_code_block:
+                if stripped_line.startswith("```") and stripped_line.count("```") == 1:
+                    in_code_block = True
+                    opening_fence = "```"
+                elif stripped_line.startswith("~~~"):
+                    in_code_block = True
+                    opening_fence = "~~~"
+            elif stripped_line.startswith(opening_fence):
+                in_code_block = False
+                opening_fence = ""
+
+            header = None if in_code_block else _HEADER_PATTERN.match(stripped_line)
+            if header:
+                level = len(header.group(1))
+                while header_stack and header_stack[-1][0] >= level:
+                    header_stack.pop()
+                header_stack.append((level, stripped_line[level:].strip()))
+                continues = False
+                continue
+
+            if in_code_block or stripped_line:
+                stripped_line = _PAGE_NUMBER_COMMENT_PATTERN.sub("", stripped_line)
+                if not stripped_line and not in_code_block:
+                    continue
+                headers = tuple(header_stack)
+                if section is None or section.headers != headers:
+                    if section is not None:
+                        yield section
+                    section = _Section(headers)
+                section.add_line(
+                    stripped_line, page_number, "\n" if continues else "  \n"
+                )
+                continues = True
+            else:
+                continues = False
+
+    if section is not None:
+        yield section
@@ -0,0 +1,73 @@
+"""
+回答中の出典タグの展開
+
+"compact" モードでは情報源を [S1]…[Sn] のラベルで渡し、モデルには短いタグのみを出力させる。
+ストリーミング中にタグを従来の <source-doc:blobUrl(p.ページ番号)---ファイル名> の形式に展開することで、
+フロントエンドや保存される回答の形式は変えずに、回答生成のトークン数を削減する。
+"""
+
+import re
+from typing import Any
+
+# [S1] または [S1, S2] のような出典タグ
+CITATION_TAG_PATTERN = re.compile(r"\[(S\d+(?:\s*[,、，]\s*S\d+)*)\]")
+# チャンクの末尾で途中まで出力された出典タグ（[ / [S / [S1 / [S1, など）
+PARTIAL_CITATION_TAG_PATTERN = re.compile(r"\[(?:S\d*(?:\s*[,、，]\s*S?\d*)*)?\Z")
+# 展開を保留する文字数の上限（これより長いものはタグではないとみなして出力する）
+MAX_PENDING_CHARS = 64
+
+
+def format_source_doc(result: dict[str, Any]) -> str:
+    """検索結果を <source-doc:blobUrl(p.ページ番号)---ファイル名> の形式に変換する"""
+    return (
+        f"<source-doc:{result['blobUrl']}(p.{result['pageNumber']})"
+        f"---{result['sourceFileName']}>"
+    )
+
+
+def build_citation_map(results: list[dict[str, Any]]) -> dict[str, str]:
+    """情報源のラベル（S1, S2, ...）と展開後の出典タグの対応を作成する"""
+    return {f"S{i + 1}": format_source_doc(r) for i, r in enumerate(results)}
+
+
+def expand_citations(text: str, citations: dict[str, str]) -> str:
+    """テキスト中の出典タグを展開する（未知のラベルを含むタグはそのまま残す）"""
+
+    def _replace(match: re.Match) -> str:
+        labels = re.split(r"\s*[,、，]\s*", match.group(1))
+        if not all(label in citations for label in labels):
+            return match.group(0)
+        return "".join(citations[label] for label in labels)
+
+    return CITATION_TAG_PATTERN.sub(_replace, text)
+
+
+class CitationExpander:
+    """
+    ストリーミング中の回答の出典タグを展開するクラス
+
+    チャンクの境界で分割されたタグ（"[S" と "1]" など）を展開できるよう、
+    タグの可能性がある末尾の文字列は次のチャンクまで保留する。
+    """
+
+    def __init__(self, citations: dict[str, str]):
+        self.citations = citations
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        """チャンクを受け取り、展開が確定した部分を返す"""
+        text = self._pending + text
+        self._pending = ""
+        start = text.rfind("[")
+        if (
+            start != -1
+            and len(text) - start <= MAX_PENDING_CHARS
+            and PARTIAL_CITATION_TAG_PATTERN.match(text, start)
+        ):
+            text, self._pending = text[:start], text[start:]
+        return expand_citations(text, self.citations)
+
+    def flush(self) -> str:
+        """保留している文字列を返す（ストリームの終了時に呼び出す）"""
+        text, self._pending = self._pending, ""
+        return expand_citations(text, self.citations)
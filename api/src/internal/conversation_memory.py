@@ -0,0 +1,115 @@
+"""
+サーバー側で読み込む会話履歴と、チャットルームごとの会話の要約（ローリングサマリー）
+
+会話履歴はクライアントから受け取らず、DBから直近のメッセージのみを読み込む。
+要約が有効な場合、古い会話は要約としてチャットルームに保存し、回答生成には「要約 + 直近のメッセージ」を渡す。
+要約は回答の保存後に非同期で更新し、直近のメッセージより古く、まだ要約されていない
+メッセージを既存の要約に取り込む。
+"""
+
+from typing import Any
+
+# 会話履歴のうち、要約を表す項目の type
+SUMMARY = "summary"
+
+summary_prompt_template = """
+以下の「これまでの会話の要約」と「新しい会話」をもとに、会話全体の要約を作成してください。
+・ユーザーの目的や関心事、質問の内容、回答の要点を残してください。
+・製品名、ファイル名、数値、手順などの固有の情報は省略せずに残してください。
+・今後の質問に回答する際の文脈として使用するため、簡潔な箇条書きで記載してください。
+・要約以外の内容は出力しないでください。
+
+# これまでの会話の要約
+{summary}
+
+# 新しい会話
+{conversation}
+"""
+
+
+class ConversationMemory:
+    """
+    サーバー側で読み込む会話履歴と、ローリングサマリーの管理クラス
+
+    メッセージは作成日時の順に数え、summarized_count は要約に取り込み済みの先頭からのメッセージ数。
+    読み込む範囲は (offset, limit) で返し、必要なメッセージのみをDBから取得する。
+    """
+
+    def __init__(
+        self,
+        recent_messages: int = 6,
+        min_fold_messages: int = 2,
+        max_history_messages: int = 20,
+    ):
+        # 要約せずにそのまま渡す直近のメッセージ数
+        self.recent_messages = recent_messages
+        # 要約を更新する最小のメッセージ数（1往復ごとに更新する）
+        self.min_fold_messages = min_fold_messages
+        # 会話履歴として読み込むメッセージ数の上限
+        self.max_history_messages = max_history_messages
+
+    def history_window(
+        self, summarized_count: int | None, message_count: int
+    ) -> tuple[int, int]:
+        """
+        会話履歴として読み込むメッセージの範囲 (offset, limit) を返す。
+
+        要約の更新が遅れている場合も会話が欠けないよう、直近のメッセージ数に関わらず
+        要約に取り込まれていないメッセージを max_history_messages 件まで含める
+        （トークン数の上限はトリミングで調整する）。
+        """
+        offset = max(summarized_count or 0, message_count - self.max_history_messages)
+        return offset, message_count - offset
+
+    def pending_window(
+        self, summarized_count: int | None, message_count: int
+    ) -> tuple[int, int] | None:
+        """要約に取り込むメッセージの範囲 (offset, limit) を返す（更新が不要な場合は None）"""
+        offset = summarized_count or 0
+        limit = message_count - self.recent_messages - offset
+        if limit < self.min_fold_messages:
+            return None
+        return offset, limit
+
+    def history(self, summary: str | None, messages: list[Any]) -> list[dict[str, Any]]:
+        """
+        回答生成に渡す会話履歴（要約 + 読み込んだメッセージ）を返す。
+
+        messages は role, message, token_count を持つオブジェクト（作成日時の順）。
+        """
+        history = []
+        if summary:
+            history.append({"type": SUMMARY, "content": summary})
+        for message in messages:
+            history.append(
+                {
+                    "type": message.role,
+                    "content": message.message,
+                    "token_count": message.token_count,
+                }
+            )
+        return history
+
+    def summary_messages(
+        self, summary: str | None, history: list[dict[str, Any]]
+    ) -> list[dict[str, str]]:
+        """
+        要約を更新するためのメッセージを返す。
+
+        Args:
+            summary (str | None): これまでの要約
+            history (list[dict]): 要約に取り込むメッセージ（history() と同じ形式）
+        """
+        conversation = "\n".join(
+            f"{'ユーザー' if item['type'] == 'user' else 'アシスタント'}: {item['content']}"
+            for item in history
+            if item["type"] != SUMMARY
+        )
+        return [
+            {
+                "role": "user",
+                "content": summary_prompt_template.format(
+                    summary=summary or "（なし）", conversation=conversation
+                ),
+            }
+        ]
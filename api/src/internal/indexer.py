@@ -1,26 +1,33 @@
 import base64
+import hashlib
 import json
 import os
-import re
 import traceback
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from collections.abc import Iterable
 
+from azure.core.exceptions import HttpResponseError
 from azure.search.documents.indexes.models import *
 from langchain.text_splitter import MarkdownHeaderTextSplitter
 
+from src.internal.batch_embedder import create_batch_embedder
+from src.internal.chunker import iter_semantic_chunks
+from src.internal.ingestion_pipeline import batched, create_ingestion_pipeline
+from src.internal.token_counter import get_token_accountant
+from src.services.answer_cache import get_answer_cache
 from src.services.azure_ai_search import AzureAISearch
 from src.services.azure_blob_storage import AzureBlobStorage
 from src.services.azure_openai import AzureOpenAI
+from src.services.search_result_cache import get_search_result_cache
 from src.utils.extract_markdown_text_from_file import (
     extract_markdown_text_from_docx,
     extract_markdown_text_from_excel,
     extract_markdown_text_from_html,
     extract_markdown_text_from_image,
-    extract_markdown_text_from_pdf,
     extract_markdown_text_from_pptx,
+    iter_markdown_text_from_pdf,
 )
 
-japanese_separators = ["\n\n", "  \n", "。"]
 embedding_deploy = os.environ["EMBEDDING_MODEL_NAME"]
 
 
@@ -29,101 +36,7 @@ def _semantic_chunk(contents: list):
     """テキストを指定したサイズで分割する"""
     print(f"🔍 _semantic_chunk: Processing {len(contents)} content items")
 
-    chunks = []
-
-    content_text = ""
-    text_count_array = []
-    for i, content in enumerate(contents):
-        print(f"🔍 Content {i}: {content.keys()}")
-        content_text += content["page_content"]
-        text_count_array.append(len(content_text))
-
-    print(f"🔍 Total content_text length: {len(content_text)}")
-    print(f"🔍 Content preview: {content_text[:500]}...")
-
-    # Split the document into chunks base on markdown headers.
-    headers_to_split_on = [
-        ("#", "Header 1"),
-        ("##", "Header 2"),
-        ("###", "Header 3"),
-    ]
-    text_splitter = MarkdownHeaderTextSplitter(headers_to_split_on=headers_to_split_on)
-
-    print(f"🔍 Using MarkdownHeaderTextSplitter with headers: {headers_to_split_on}")
-    chunks = text_splitter.split_text(content_text)
-    print(f"🔍 MarkdownHeaderTextSplitter result: {len(chunks)} chunks")
-
-    chunks_with_page_number = []
-    page_number = 1
-    for chunk in chunks:
-        keywords = ""
-        if "Header 1" in chunk.metadata:
-            keywords += chunk.metadata["Header 1"]
-        if "Header 2" in chunk.metadata:
-            keywords += " " + chunk.metadata["Header 2"]
-        if "Header 3" in chunk.metadata:
-            keywords += " " + chunk.metadata["Header 3"]
-
-        current_page_number = page_number
-
-        # 文字数が多すぎる場合は、分割する
-        if len(chunk.page_content) > 512:
-            splitted_chunks = []
-            chunk_size = 512
-            chunk_overlap = 100
-            for i in range(0, len(chunk.page_content), chunk_size):
-                start_index = i
-                if i > 0:
-                    start_index = i - chunk_overlap
-                end_index = i + chunk_size
-                if end_index > len(chunk.page_content):
-                    end_index = len(chunk.page_content)
-                splitted_chunks.append(chunk.page_content[start_index:end_index])
-
-            for splitted_chunk in splitted_chunks:
-                # テキストに埋め込まれたページ番号を取得する
-                matches = re.findall(
-                    r"<PAGE_NUMBER>(.*?)</PAGE_NUMBER>", splitted_chunk
-                )
-                if len(matches) > 0:
-                    page_number = int(matches[-1]) + 1
-                    splitted_chunk = re.sub(
-                        r"<PAGE_NUMBER>(.*?)</PAGE_NUMBER>", "", splitted_chunk
-                    )
-                # デフォルトのページ番号もノイズとなるので削除する
-                splitted_chunk = re.sub(
-                    r"<!-- PageNumber=(.*?) -->", "", splitted_chunk
-                )
-
-                chunks_with_page_number.append(
-                    {
-                        "content": splitted_chunk,
-                        "page_number": current_page_number,
-                        "keywords": keywords,
-                    }
-                )
-        else:
-            # テキストに埋め込まれたページ番号を取得する
-            matches = re.findall(
-                r"<PAGE_NUMBER>(.*?)</PAGE_NUMBER>", chunk.page_content
-            )
-            if len(matches) > 0:
-                page_number = int(matches[-1]) + 1
-                chunk.page_content = re.sub(
-                    r"<PAGE_NUMBER>(.*?)</PAGE_NUMBER>", "", chunk.page_content
-                )
-            # デフォルトのページ番号もノイズとなるので削除する
-            chunk.page_content = re.sub(
-                r"<!-- PageNumber=(.*?) -->", "", chunk.page_content
-            )
-
-            chunks_with_page_number.append(
-                {
-                    "content": chunk.page_content,
-                    "page_number": current_page_number,
-                    "keywords": keywords,
-                }
-            )
+    chunks_with_page_number = list(iter_semantic_chunks(contents))
 
     print(f"🔍 Final result: {len(chunks_with_page_number)} chunks with page numbers")
     if chunks_with_page_number:
@@ -178,58 +91,216 @@ def _index_docs_to_azure_ai_search(
     batch_size=10,
 ):
     """ドキュメントをAzure AI Searchにインデックスし、データベースにも記録する"""
+    _, changed = _run_indexing_pipeline(
+        chunks, "chunk", [], source_file_name, index_type, batch_size
+    )
+    _finish_indexing(source_file_name, index_type, actual_blob_name, changed=changed)
+
+
+def _index_pages_to_azure_ai_search(
+    pages: Iterable[dict],
+    source_file_name: str,
+    index_type: str,
+    actual_blob_name: str = None,
+    batch_size=10,
+) -> dict:
+    """
+    ページのテキストをチャンクに分割してAzure AI Searchにインデックスし、データベースにも記録する
+
+    ページの抽出・チャンク分割・埋め込み・アップロードを並行に実行する。
+    チャンクが作成されなかった場合はインデックス・データベースを更新しない。
+
+    Returns:
+        dict: ステージごとの統計情報
+    """
+    stats, changed = _run_indexing_pipeline(
+        pages,
+        "extract",
+        [("chunk", iter_semantic_chunks)],
+        source_file_name,
+        index_type,
+        batch_size,
+    )
+    if stats["chunk"]["items_out"]:
+        _finish_indexing(
+            source_file_name, index_type, actual_blob_name, changed=changed
+        )
+    return stats
+
+
+def _run_indexing_pipeline(
+    source: Iterable,
+    source_name: str,
+    stages: list,
+    source_file_name: str,
+    index_type: str,
+    batch_size: int,
+) -> tuple[dict, bool]:
+    """
+    stages の後に差分の判定・埋め込み・アップロードのステージを追加したパイプラインを実行する
+
+    チャンクのIDはチャンクの内容（本文とキーワード）のハッシュのため、インデックスに登録済みのチャンクと比較し、
+    変更されていないチャンクは埋め込み・アップロードを省略する。ページ番号のみが変わったチャンクは
+    埋め込み直さずにページ番号のみを更新する。インデックスに登録済みで今回なくなったチャンクは削除する。
+    登録済みのチャンクはインデックス自体から取得するため、処理が途中で終了した場合も次回の再インデックスで続きから処理できる。
+
+    sourceFileName でフィルタできないインデックス（filterable にする前に作成したインデックス）では差分を判定できないため、
+    従来どおり連番のIDで全てのチャンクをアップロードする。
+
+    Returns:
+        tuple[dict, bool]: ステージごとの統計情報と、インデックスの内容を変更したかどうか
+    """
     index_name = AzureAISearch().get_index_name(index_type)
     search_client = AzureAISearch().init_search_client(index_name)
-    open_ai_client = AzureOpenAI().init_client()
+    # レート制限（429）・一時的なエラーの再試行は BatchEmbedder が Retry-After に従って行うため、
+    # SDKの再試行は無効にする（両方で再試行すると試行回数が掛け算で増える）
+    open_ai_client = AzureOpenAI().init_client().with_options(max_retries=0)
+
+    # チャンクのテキストを入力件数・トークン数の上限ごとにまとめて埋め込む。
+    # 変更されていないチャンクは差分の判定で省略されるため、検索用の埋め込みキャッシュは経由しない
+    # （チャンクのベクトルで質問のベクトルが追い出されないようにする）
+    def embed_texts(texts: list[str]) -> list[list[float]]:
+        response = open_ai_client.embeddings.create(input=texts, model=embedding_deploy)
+        return [item.embedding for item in response.data]
+
+    embedder = create_batch_embedder(embed_texts)
+    blob_url = AzureBlobStorage().get_blob_url(source_file_name)
+
+    existing_pages = _find_indexed_chunk_ids(search_client, source_file_name)
+    if existing_pages is None:
+        print(
+            f"⚠️ インデックス {index_name} の sourceFileName がフィルタできないため、"
+            "全てのチャンクをアップロードします（差分のインデックスにはインデックスの再作成が必要です）"
+        )
+    chunk_ids = []
+    page_updates = []
 
-    def _embed_and_prepare_document(open_ai_client, chunk, source_file_name, i):
-        try:
-            response = open_ai_client.embeddings.create(
-                input=chunk["content"], model=embedding_deploy
-            )
-            document = {
-                "id": _encode_data(source_file_name + "_" + str(i)),
-                "keywords": chunk["keywords"],
-                "content": chunk["content"],
-                "contentVector": response.data[0].embedding,
-                "pageNumber": chunk["page_number"],
-                "sourceFileName": source_file_name,
-                "blobUrl": AzureBlobStorage().get_blob_url(source_file_name),
-            }
-            print(document)
-            return document
-        except Exception as e:
-            raise Exception(f"Error embedding chunk {i}: {e}")
-
-    batch = []
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        futures = []
-        for i, chunk in enumerate(chunks):
-            futures.append(
-                executor.submit(
-                    _embed_and_prepare_document,
-                    open_ai_client,
-                    chunk,
-                    source_file_name,
-                    i,
+    def diff(chunks):
+        occurrences = Counter()
+        for chunk in chunks:
+            if existing_pages is None:
+                chunk_id = _encode_data(f"{source_file_name}_{len(chunk_ids)}")
+            else:
+                digest = _chunk_digest(chunk)
+                chunk_id = _chunk_id(source_file_name, digest, occurrences[digest])
+                occurrences[digest] += 1
+            chunk_ids.append(chunk_id)
+            if existing_pages is None or chunk_id not in existing_pages:
+                yield {**chunk, "id": chunk_id}
+            elif existing_pages[chunk_id] != chunk["page_number"]:
+                page_updates.append(
+                    {"id": chunk_id, "pageNumber": chunk["page_number"]}
                 )
-            )
-            if len(futures) >= batch_size:
-                for future in as_completed(futures):
-                    document = future.result()
-                    batch.append(document)
-                    del future
-                search_client.upload_documents(documents=batch)
-                batch.clear()
-                futures.clear()
-        # 残りのドキュメントをアップロード
-        if futures:
-            for future in as_completed(futures):
-                document = future.result()
-                batch.append(document)
-                del future
+
+    def embed(chunks):
+        # 1回の embed() で EMBEDDING_BATCH_WORKERS 件のリクエストを同時に送信できるようにまとめる
+        for batch in batched(chunks, embedder.group_size):
+            try:
+                content_vectors = embedder.embed([chunk["content"] for chunk in batch])
+            except Exception as e:
+                raise Exception(f"Error embedding chunks: {e}")
+            for chunk, content_vector in zip(batch, content_vectors, strict=True):
+                yield {
+                    "id": chunk["id"],
+                    "keywords": chunk["keywords"],
+                    "content": chunk["content"],
+                    "contentVector": content_vector,
+                    "tokenCount": get_token_accountant().count(chunk["content"]),
+                    "pageNumber": chunk["page_number"],
+                    "sourceFileName": source_file_name,
+                    "blobUrl": blob_url,
+                }
+
+    def upload(documents):
+        for batch in batched(documents, batch_size):
             search_client.upload_documents(documents=batch)
-            batch.clear()
+            yield from batch
+
+    pipeline = create_ingestion_pipeline()
+    for name, transform in stages:
+        pipeline.add_stage(name, transform)
+    pipeline.add_stage("diff", diff).add_stage("embed", embed).add_stage(
+        "upload", upload
+    )
+    stats = pipeline.run(source, source_name=source_name)
+    print(f"📊 Indexing pipeline stats: {json.dumps(stats, ensure_ascii=False)}")
+
+    uploaded = stats["upload"]["items_out"]
+    # チャンクが作成されなかった場合は抽出の失敗の可能性があるため、既存のチャンクを削除しない
+    if not chunk_ids or existing_pages is None:
+        return stats, bool(uploaded)
+
+    # 内容が変わらずページ番号のみが変わったチャンクは、ページ番号のみを更新する
+    for batch in batched(page_updates, 1000):
+        search_client.merge_documents(documents=batch)
+
+    # 新しいチャンクのアップロード後に、なくなったチャンクを削除する
+    stale_ids = sorted(existing_pages.keys() - set(chunk_ids))
+    for batch in batched(stale_ids, 1000):
+        search_client.delete_documents(documents=[{"id": i} for i in batch])
+    print(
+        f"♻️ Chunks: {len(chunk_ids) - uploaded - len(page_updates)} unchanged, "
+        f"{uploaded} uploaded, {len(page_updates)} page numbers updated, "
+        f"{len(stale_ids)} deleted"
+    )
+    return stats, bool(uploaded or page_updates or stale_ids)
+
+
+def _chunk_digest(chunk: dict) -> str:
+    """
+    チャンクの埋め込みに影響する内容（本文とキーワード）のハッシュを作成する
+
+    ページ番号は含めない（前のページの追加・削除でページ番号のみが変わったチャンクを埋め込み直さない）。
+    """
+    payload = json.dumps([chunk["content"], chunk["keywords"]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _chunk_id(source_file_name: str, digest: str, occurrence: int = 0) -> str:
+    """チャンクのIDを作成する。同じファイルに同じ内容のチャンクがある場合は出現順の番号を付ける"""
+    suffix = f"_{occurrence}" if occurrence else ""
+    return _encode_data(f"{source_file_name}_{digest}{suffix}")
+
+
+def _find_indexed_chunk_ids(
+    search_client, source_file_name: str
+) -> dict[str, int | None] | None:
+    """
+    インデックスに登録済みのファイルのチャンクのIDとページ番号を1回のフィルタ検索で取得する
+
+    以前の連番のIDのチャンクも含む。sourceFileName でフィルタできないインデックスの場合は None を返す。
+
+    Returns:
+        dict[str, int | None] | None: チャンクのIDとページ番号
+    """
+    escaped_name = source_file_name.replace("'", "''")
+    try:
+        results = search_client.search(
+            search_text="*",
+            filter=f"sourceFileName eq '{escaped_name}'",
+            select=["id", "pageNumber"],
+        )
+        return {result["id"]: result.get("pageNumber") for result in results}
+    except HttpResponseError as e:
+        if e.status_code != 400:
+            raise
+        print(f"sourceFileName でのフィルタ検索に失敗しました: {e.message}")
+        return None
+
+
+def _finish_indexing(
+    source_file_name: str,
+    index_type: str,
+    actual_blob_name: str = None,
+    changed: bool = True,
+):
+    """インデックスの更新後の処理（キャッシュの破棄とデータベースへの記録）"""
+    index_name = AzureAISearch().get_index_name(index_type)
+
+    # インデックスの内容が変わった場合は、このインデックスを含む回答キャッシュ・検索結果キャッシュを破棄する
+    if changed:
+        get_answer_cache().invalidate_index(index_type)
+        get_search_result_cache().bump_version(index_name)
 
     # インデックス処理が完了したらデータベースに記録
     # actual_blob_nameには実際にBlob Storageに保存されたファイル名（タイムスタンプ付き）が含まれる
@@ -315,24 +386,19 @@ async def index_pdf_docs(fileBytes: bytes, fileName: str, index_type: str):
         )
         print(f"✅ Blob uploaded: {upload_result}")
 
-        # PDFからテキスト抽出
+        # PDFからテキスト抽出（ページごとに抽出した時点で後続のチャンク生成に渡す）
         print("🔄 Extracting text from PDF...")
-        content = extract_markdown_text_from_pdf(fileBytes)
-        print(f"📄 Extracted {len(content)} pages of content")
-        if content:
-            print(f"📝 Sample content: {content[0]['page_content'][:200]}...")
+        content = iter_markdown_text_from_pdf(fileBytes)
 
-        # チャンク生成
-        print("🔄 Creating semantic chunks...")
-        chunks = _semantic_chunk(content)
-        print(f"📦 Generated {len(chunks)} chunks")
-
-        # AI Searchにインデックス
-        if chunks:
-            print("🔄 Indexing to AI Search...")
-            _index_docs_to_azure_ai_search(
-                chunks, fileName, index_type, upload_result["blob_name"]
-            )
+        # チャンク生成・AI Searchへのインデックスを並行に実行する
+        print("🔄 Creating semantic chunks and indexing to AI Search...")
+        stats = _index_pages_to_azure_ai_search(
+            content, fileName, index_type, upload_result["blob_name"]
+        )
+        processed_chunks = stats["chunk"]["items_out"]
+        print(f"📄 Extracted {stats['extract']['items_out']} pages of content")
+        print(f"📦 Generated {processed_chunks} chunks")
+        if processed_chunks:
             print("✅ AI Search indexing completed")
         else:
             print("⚠️ No chunks generated, skipping AI Search indexing")
@@ -340,11 +406,12 @@ async def index_pdf_docs(fileBytes: bytes, fileName: str, index_type: str):
         return {
             "status": "success",
             "message": "PDFファイルのインデックス化が完了しました",
-            "processed_chunks": len(chunks),
+            "processed_chunks": processed_chunks,
             "filename": fileName,
             "index_type": index_type,
             "blob_uploaded": True,
-            "content_pages": len(content) if content else 0,
+            "stage_stats": stats,
+            "content_pages": stats["extract"]["items_out"],
         }
     except Exception as e:
         print("❌ index_pdf_docs error:")
@@ -376,17 +443,14 @@ async def index_docx_docs(fileBytes: bytes, fileName: str, index_type: str):
         content = extract_markdown_text_from_docx(fileBytes)
         print("📄 Extracted content from DOCX")
 
-        # チャンク生成
-        print("🔄 Creating semantic chunks...")
-        chunks = _semantic_chunk(content)
-        print(f"📦 Generated {len(chunks)} chunks")
-
-        # AI Searchにインデックス
-        if chunks:
-            print("🔄 Indexing to AI Search...")
-            _index_docs_to_azure_ai_search(
-                chunks, fileName, index_type, upload_result["blob_name"]
-            )
+        # チャンク生成・AI Searchへのインデックスを並行に実行する
+        print("🔄 Creating semantic chunks and indexing to AI Search...")
+        stats = _index_pages_to_azure_ai_search(
+            content, fileName, index_type, upload_result["blob_name"]
+        )
+        processed_chunks = stats["chunk"]["items_out"]
+        print(f"📦 Generated {processed_chunks} chunks")
+        if processed_chunks:
             print("✅ AI Search indexing completed")
         else:
             print("⚠️ No chunks generated, skipping AI Search indexing")
@@ -394,10 +458,11 @@ async def index_docx_docs(fileBytes: bytes, fileName: str, index_type: str):
         return {
             "status": "success",
             "message": "Wordファイルのインデックス化が完了しました",
-            "processed_chunks": len(chunks),
+            "processed_chunks": processed_chunks,
             "filename": fileName,
             "index_type": index_type,
             "blob_uploaded": True,
+            "stage_stats": stats,
         }
     except Exception as e:
         print("❌ index_docx_docs error:")
@@ -431,17 +496,14 @@ async def index_pptx_docs(fileBytes: bytes, fileName: str, index_type: str):
         content = extract_markdown_text_from_pptx(fileBytes)
         print("📄 Extracted content from PPTX")
 
-        # チャンク生成
-        print("🔄 Creating semantic chunks...")
-        chunks = _semantic_chunk(content)
-        print(f"📦 Generated {len(chunks)} chunks")
-
-        # AI Searchにインデックス
-        if chunks:
-            print("🔄 Indexing to AI Search...")
-            _index_docs_to_azure_ai_search(
-                chunks, fileName, index_type, upload_result["blob_name"]
-            )
+        # チャンク生成・AI Searchへのインデックスを並行に実行する
+        print("🔄 Creating semantic chunks and indexing to AI Search...")
+        stats = _index_pages_to_azure_ai_search(
+            content, fileName, index_type, upload_result["blob_name"]
+        )
+        processed_chunks = stats["chunk"]["items_out"]
+        print(f"📦 Generated {processed_chunks} chunks")
+        if processed_chunks:
             print("✅ AI Search indexing completed")
         else:
             print("⚠️ No chunks generated, skipping AI Search indexing")
@@ -449,10 +511,11 @@ async def index_pptx_docs(fileBytes: bytes, fileName: str, index_type: str):
         return {
             "status": "success",
             "message": "PowerPointファイルのインデックス化が完了しました",
-            "processed_chunks": len(chunks),
+            "processed_chunks": processed_chunks,
             "filename": fileName,
             "index_type": index_type,
             "blob_uploaded": True,
+            "stage_stats": stats,
         }
     except Exception as e:
         print("❌ index_pptx_docs error:")
@@ -484,17 +547,14 @@ async def index_html_docs(fileBytes: bytes, fileName: str, index_type: str):
         content = extract_markdown_text_from_html(fileBytes)
         print("📄 Extracted content from HTML")
 
-        # チャンク生成
-        print("🔄 Creating semantic chunks...")
-        chunks = _semantic_chunk(content)
-        print(f"📦 Generated {len(chunks)} chunks")
-
-        # AI Searchにインデックス
-        if chunks:
-            print("🔄 Indexing to AI Search...")
-            _index_docs_to_azure_ai_search(
-                chunks, fileName, index_type, upload_result["blob_name"]
-            )
+        # チャンク生成・AI Searchへのインデックスを並行に実行する
+        print("🔄 Creating semantic chunks and indexing to AI Search...")
+        stats = _index_pages_to_azure_ai_search(
+            content, fileName, index_type, upload_result["blob_name"]
+        )
+        processed_chunks = stats["chunk"]["items_out"]
+        print(f"📦 Generated {processed_chunks} chunks")
+        if processed_chunks:
             print("✅ AI Search indexing completed")
         else:
             print("⚠️ No chunks generated, skipping AI Search indexing")
@@ -502,10 +562,11 @@ async def index_html_docs(fileBytes: bytes, fileName: str, index_type: str):
         return {
             "status": "success",
             "message": "HTMLファイルのインデックス化が完了しました",
-            "processed_chunks": len(chunks),
+            "processed_chunks": processed_chunks,
             "filename": fileName,
             "index_type": index_type,
             "blob_uploaded": True,
+            "stage_stats": stats,
         }
     except Exception as e:
         print("❌ index_html_docs error:")
@@ -540,17 +601,14 @@ async def index_image_docs(fileBytes: bytes, fileName: str, index_type: str):
         content = extract_markdown_text_from_image(fileBytes)
         print("📄 Extracted content from image")
 
-        # チャンク生成
-        print("🔄 Creating semantic chunks...")
-        chunks = _semantic_chunk(content)
-        print(f"📦 Generated {len(chunks)} chunks")
-
-        # AI Searchにインデックス
-        if chunks:
-            print("🔄 Indexing to AI Search...")
-            _index_docs_to_azure_ai_search(
-                chunks, fileName, index_type, upload_result["blob_name"]
-            )
+        # チャンク生成・AI Searchへのインデックスを並行に実行する
+        print("🔄 Creating semantic chunks and indexing to AI Search...")
+        stats = _index_pages_to_azure_ai_search(
+            content, fileName, index_type, upload_result["blob_name"]
+        )
+        processed_chunks = stats["chunk"]["items_out"]
+        print(f"📦 Generated {processed_chunks} chunks")
+        if processed_chunks:
             print("✅ AI Search indexing completed")
         else:
             print("⚠️ No chunks generated, skipping AI Search indexing")
@@ -558,10 +616,11 @@ async def index_image_docs(fileBytes: bytes, fileName: str, index_type: str):
         return {
             "status": "success",
             "message": "画像ファイルのインデックス化が完了しました",
-            "processed_chunks": len(chunks),
+            "processed_chunks": processed_chunks,
             "filename": fileName,
             "index_type": index_type,
             "blob_uploaded": True,
+            "stage_stats": stats,
         }
     except Exception as e:
         print("❌ index_image_docs error:")
@@ -595,17 +654,14 @@ async def index_excel_docs(fileBytes: bytes, fileName: str, index_type: str):
         content = extract_markdown_text_from_excel(fileBytes)
         print("📄 Extracted content from Excel")
 
-        # チャンク生成
-        print("🔄 Creating semantic chunks...")
-        chunks = _semantic_chunk(content)
-        print(f"📦 Generated {len(chunks)} chunks")
-
-        # AI Searchにインデックス
-        if chunks:
-            print("🔄 Indexing to AI Search...")
-            _index_docs_to_azure_ai_search(
-                chunks, fileName, index_type, upload_result["blob_name"]
-            )
+        # チャンク生成・AI Searchへのインデックスを並行に実行する
+        print("🔄 Creating semantic chunks and indexing to AI Search...")
+        stats = _index_pages_to_azure_ai_search(
+            content, fileName, index_type, upload_result["blob_name"]
+        )
+        processed_chunks = stats["chunk"]["items_out"]
+        print(f"📦 Generated {processed_chunks} chunks")
+        if processed_chunks:
             print("✅ AI Search indexing completed")
         else:
             print("⚠️ No chunks generated, skipping AI Search indexing")
@@ -613,10 +669,11 @@ async def index_excel_docs(fileBytes: bytes, fileName: str, index_type: str):
         return {
             "status": "success",
             "message": "Excelファイルのインデックス化が完了しました",
-            "processed_chunks": len(chunks),
+            "processed_chunks": processed_chunks,
             "filename": fileName,
             "index_type": index_type,
             "blob_uploaded": True,
+            "stage_stats": stats,
         }
     except Exception as e:
         print("❌ index_excel_docs error:")
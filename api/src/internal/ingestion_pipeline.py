@@ -0,0 +1,180 @@
+"""
+インデックス作成のストリーミングパイプライン
+
+テキスト抽出 → チャンク分割 → 埋め込み → アップロードの各ステージを別々のスレッドで実行し、
+ステージ間をサイズの上限付きのキューでつなぐ。後段のステージが遅い場合は前段のステージが
+キューへの追加で待機するため（バックプレッシャー）、メモリ上に保持する件数はキューのサイズまでに抑えられる。
+全体の処理時間は各ステージの合計ではなく、最も遅いステージの処理時間に近くなる。
+"""
+
+import os
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any
+
+# ステージの終了を表すキューの要素
+_END = object()
+
+
+class _StageStats:
+    """ステージごとの処理件数と時間の記録"""
+
+    def __init__(self):
+        self.items_in = 0
+        self.items_out = 0
+        self.input_wait_ms = 0.0
+        self.output_wait_ms = 0.0
+        self.elapsed_ms = 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        # 入力の待機とキューへの追加の待機を除いた時間を、ステージの処理時間とする
+        busy_ms = max(self.elapsed_ms - self.input_wait_ms - self.output_wait_ms, 0.0)
+        return {
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "busy_ms": round(busy_ms, 1),
+            "input_wait_ms": round(self.input_wait_ms, 1),
+            "output_wait_ms": round(self.output_wait_ms, 1),
+            "elapsed_ms": round(self.elapsed_ms, 1),
+            "items_per_second": round(self.items_out / (self.elapsed_ms / 1000), 2)
+            if self.elapsed_ms
+            else 0.0,
+            "avg_ms_per_item": round(busy_ms / self.items_out, 1)
+            if self.items_out
+            else 0.0,
+        }
+
+
+class IngestionPipeline:
+    """
+    ステージをサイズの上限付きのキューでつなぎ、並行に実行するパイプライン
+
+    各ステージは「前段の出力のイテレータを受け取り、出力のイテレータを返す関数」で、
+    最初のステージ（source）は入力のイテレータそのもの。いずれかのステージで例外が発生した場合は
+    全ステージを停止し、run() で最初の例外を送出する。
+    """
+
+    def __init__(self, queue_size: int = 64, poll_interval: float = 0.1):
+        if queue_size <= 0:
+            raise ValueError("queue_size は1以上を指定してください")
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self._stages: list[tuple[str, Callable[[Iterator[Any]], Iterable[Any]]]] = []
+        self._stats: dict[str, _StageStats] = {}
+
+    def add_stage(
+        self, name: str, transform: Callable[[Iterator[Any]], Iterable[Any]]
+    ) -> "IngestionPipeline":
+        """ステージを追加する（追加した順に実行する）"""
+        self._stages.append((name, transform))
+        return self
+
+    def run(self, source: Iterable[Any], source_name: str = "extract") -> dict:
+        """
+        パイプラインを実行し、ステージごとの統計情報を返す。
+
+        Args:
+            source: 最初のステージの出力（ページなど）のイテレータ。別スレッドで読み出す。
+            source_name (str): 最初のステージの名前
+        """
+        stages = [(source_name, lambda _: source), *self._stages]
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in stages[1:]]
+        self._stats = {name: _StageStats() for name, _ in stages}
+        cancelled = threading.Event()
+        errors: list[BaseException] = []
+
+        threads = [
+            threading.Thread(
+                target=self._run_stage,
+                args=(
+                    name,
+                    transform,
+                    queues[i - 1] if i > 0 else None,
+                    queues[i] if i < len(queues) else None,
+                    cancelled,
+                    errors,
+                ),
+                name=f"ingestion-{name}",
+                daemon=True,
+            )
+            for i, (name, transform) in enumerate(stages)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return self.stats()
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """直近の実行のステージごとの統計情報を取得する"""
+        return {name: stats.to_dict() for name, stats in self._stats.items()}
+
+    def _run_stage(self, name, transform, inbox, outbox, cancelled, errors):
+        stats = self._stats[name]
+        start = time.perf_counter()
+        try:
+            inputs = self._drain(inbox, stats, cancelled) if inbox is not None else None
+            for item in transform(inputs):
+                if cancelled.is_set():
+                    break
+                stats.items_out += 1
+                if outbox is not None:
+                    self._put(outbox, item, stats, cancelled)
+        except BaseException as e:
+            print(f"インデックス作成のステージ {name} でエラーが発生しました: {e}")
+            errors.append(e)
+            cancelled.set()
+        finally:
+            if outbox is not None:
+                self._put(outbox, _END, stats, cancelled)
+            stats.elapsed_ms = (time.perf_counter() - start) * 1000
+
+    def _drain(self, inbox: queue.Queue, stats: _StageStats, cancelled) -> Iterator:
+        """前段のステージの出力を、終了するまで順に読み出す"""
+        while not cancelled.is_set():
+            start = time.perf_counter()
+            try:
+                item = inbox.get(timeout=self.poll_interval)
+            except queue.Empty:
+                continue
+            finally:
+                stats.input_wait_ms += (time.perf_counter() - start) * 1000
+            if item is _END:
+                return
+            stats.items_in += 1
+            yield item
+
+    def _put(self, outbox: queue.Queue, item, stats: _StageStats, cancelled):
+        """キューに空きができるまで待機して追加する（停止した場合は追加しない）"""
+        start = time.perf_counter()
+        try:
+            while not cancelled.is_set():
+                try:
+                    outbox.put(item, timeout=self.poll_interval)
+                    return
+                except queue.Full:
+                    continue
+        finally:
+            stats.output_wait_ms += (time.perf_counter() - start) * 1000
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    """イテレータを size 件ずつのリストに分ける"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def create_ingestion_pipeline() -> IngestionPipeline:
+    """環境変数の設定でIngestionPipelineを作成する"""
+    return IngestionPipeline(queue_size=int(os.environ.get("INGESTION_QUEUE_SIZE", 64)))
@@ -0,0 +1,105 @@
+from typing import Any
+
+import numpy as np
+
+# Azure AI Searchのセマンティックランカーのスコアの最大値
+MAX_RERANKER_SCORE = 4.0
+
+
+class LocalReranker:
+    """
+    検索結果をプロセス内で再ランキングするクラス
+
+    質問ベクトルと各チャンクの contentVector のコサイン類似度と、
+    Azure AI Searchの "@search.reranker_score" を加重平均した関連度で並べ替え、
+    MMR（Maximal Marginal Relevance）で内容の重複するチャンクを除外した上位 top_k 件を返す。
+    """
+
+    def __init__(
+        self,
+        top_k: int = 8,
+        vector_weight: float = 0.5,
+        mmr_lambda: float = 0.7,
+        duplicate_threshold: float = 0.95,
+    ):
+        self.top_k = top_k
+        self.vector_weight = vector_weight
+        self.mmr_lambda = mmr_lambda
+        self.duplicate_threshold = duplicate_threshold
+
+    def rerank(
+        self, query_vector: list[float], results: list[dict[str, Any]]
+    ) -> list[dict[str, Any]]:
+        """
+        検索結果を再ランキングする。
+
+        Args:
+            query_vector (list[float]): 質問の埋め込みベクトル
+            results (list[dict]): contentVector を含む検索結果（検索順位の順）
+
+        Returns:
+            list[dict]: 再ランキング後の上位 top_k 件。
+                関連度は "@search.local_score" に格納される。
+        """
+        if not results:
+            return []
+
+        vectors = _normalize_rows(
+            np.array(
+                [
+                    _vector_or_zeros(r.get("contentVector"), query_vector)
+                    for r in results
+                ],
+                dtype=np.float32,
+            )
+        )
+        query = _normalize_rows(np.asarray([query_vector], dtype=np.float32))[0]
+        relevance = self._relevance(vectors @ query, results)
+        similarity = vectors @ vectors.T
+
+        selected: list[int] = []
+        candidates = list(range(len(results)))
+        # 選択済みチャンクとの最大類似度（未選択の間は0）
+        max_similarity = np.zeros(len(results), dtype=np.float32)
+        while candidates and len(selected) < self.top_k:
+            scores = (
+                self.mmr_lambda * relevance[candidates]
+                - (1 - self.mmr_lambda) * max_similarity[candidates]
+            )
+            best = candidates.pop(int(np.argmax(scores)))
+            selected.append(best)
+            max_similarity = np.maximum(max_similarity, similarity[best])
+            # ほぼ同じ内容のチャンク（重なりのあるチャンクなど）は候補から除外する
+            candidates = [
+                i for i in candidates if max_similarity[i] < self.duplicate_threshold
+            ]
+
+        reranked = []
+        for i in selected:
+            result = dict(results[i])
+            result["@search.local_score"] = float(relevance[i])
+            reranked.append(result)
+        return reranked
+
+    def _relevance(
+        self, cosine: np.ndarray, results: list[dict[str, Any]]
+    ) -> np.ndarray:
+        reranker_scores = [r.get("@search.reranker_score") for r in results]
+        if all(score is None for score in reranker_scores):
+            return cosine
+        semantic = np.array(
+            [(score or 0.0) / MAX_RERANKER_SCORE for score in reranker_scores],
+            dtype=np.float32,
+        )
+        return self.vector_weight * cosine + (1 - self.vector_weight) * semantic
+
+
+def _vector_or_zeros(vector: list[float] | None, query_vector: list[float]):
+    # contentVector を持たない結果は類似度0として扱う
+    return vector if vector is not None else [0.0] * len(query_vector)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
@@ -0,0 +1,168 @@
+import asyncio
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from src.services.azure_ai_search import AzureAISearch
+from src.services.hedging import (
+    HedgingPolicy,
+    get_hedging_policy,
+    is_hedging_enabled,
+)
+from src.services.search_result_cache import (
+    SearchResultCache,
+    get_search_result_cache,
+    is_search_result_cache_enabled,
+)
+
+
+def reciprocal_rank_fusion(
+    result_lists: list[list[dict[str, Any]]], k: int = 60
+) -> list[dict[str, Any]]:
+    """
+    複数の検索結果リストをReciprocal Rank Fusion（RRF）で統合する。
+
+    ドキュメントは id で重複排除され、各リストでの順位 r に対して 1 / (k + r) を
+    合算したスコアの降順に並べられる。スコアは "@search.fused_score" に格納される。
+    """
+    fused: dict[str, dict[str, Any]] = {}
+    scores: dict[str, float] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            doc_id = result["id"]
+            if doc_id not in fused:
+                fused[doc_id] = dict(result)
+                scores[doc_id] = 0.0
+            scores[doc_id] += 1.0 / (k + rank)
+
+    # 同スコアの場合は最初に出現した順を維持する（sortedは安定ソート）
+    ranked_ids = sorted(fused, key=lambda doc_id: scores[doc_id], reverse=True)
+    ranked = []
+    for doc_id in ranked_ids:
+        fused[doc_id]["@search.fused_score"] = scores[doc_id]
+        ranked.append(fused[doc_id])
+    return ranked
+
+
+class FanOutRetriever:
+    """
+    複数のインデックスに対して並行に検索を行い、結果をRRFで統合するクラス。
+
+    同じインデックス名が複数指定された場合は1回だけ検索する。
+    同期版の retrieve と、非同期クライアントを使用する aretrieve を提供する。
+    result_cache を指定した場合（省略時は SEARCH_RESULT_CACHE_ENABLED が有効な場合）は、
+    インデックスごとの検索結果をキャッシュする。
+    hedging_policy を指定した場合（省略時は HEDGING_ENABLED が有効な場合）は、
+    応答が遅いインデックスにヘッジリクエストを送信する。
+    """
+
+    def __init__(
+        self,
+        search_client_factory: Callable[[str], Any] | None = None,
+        rrf_k: int = 60,
+        max_workers: int = 4,
+        async_search_client_factory: Callable[[str], Any] | None = None,
+        result_cache: SearchResultCache | None = None,
+        hedging_policy: HedgingPolicy | None = None,
+    ):
+        self._search_client_factory = search_client_factory
+        self._async_search_client_factory = async_search_client_factory
+        if result_cache is None and is_search_result_cache_enabled():
+            result_cache = get_search_result_cache()
+        self.result_cache = result_cache
+        if hedging_policy is None and is_hedging_enabled():
+            hedging_policy = get_hedging_policy()
+        self.hedging_policy = hedging_policy
+        self.rrf_k = rrf_k
+        self.max_workers = max_workers
+
+    @property
+    def search_client_factory(self) -> Callable[[str], Any]:
+        if self._search_client_factory is None:
+            self._search_client_factory = AzureAISearch().init_search_client
+        return self._search_client_factory
+
+    @property
+    def async_search_client_factory(self) -> Callable[[str], Any]:
+        if self._async_search_client_factory is None:
+            self._async_search_client_factory = AzureAISearch().init_async_search_client
+        return self._async_search_client_factory
+
+    def retrieve(
+        self, index_names: list[str], top: int = 20, **search_kwargs
+    ) -> list[dict[str, Any]]:
+        """
+        全インデックスを並行に検索し、重複排除・RRF統合した上位 top 件を返す。
+
+        Args:
+            index_names (list[str]): 検索対象のインデックス名
+            top (int): 各インデックスからの取得件数、および統合後の件数
+            **search_kwargs: SearchClient.search に渡す検索パラメータ
+        """
+        # 順序を保ったまま重複を除く
+        unique_index_names = list(dict.fromkeys(index_names))
+        if not unique_index_names:
+            return []
+
+        def _search(index_name: str) -> list[dict[str, Any]]:
+            search_client = self.search_client_factory(index_name)
+            return [
+                dict(result)
+                for result in search_client.search(top=top, **search_kwargs)
+            ]
+
+        def _hedged_search(index_name: str) -> list[dict[str, Any]]:
+            if self.hedging_policy is None:
+                return _search(index_name)
+            return self.hedging_policy.call(
+                f"search:{index_name}", lambda: _search(index_name)
+            )
+
+        def _cached_search(index_name: str) -> list[dict[str, Any]]:
+            if self.result_cache is None:
+                return _hedged_search(index_name)
+            return self.result_cache.get_or_search(
+                index_name,
+                {"top": top, **search_kwargs},
+                lambda: _hedged_search(index_name),
+            )
+
+        max_workers = min(self.max_workers, len(unique_index_names))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            result_lists = list(executor.map(_cached_search, unique_index_names))
+
+        return reciprocal_rank_fusion(result_lists, k=self.rrf_k)[:top]
+
+    async def aretrieve(
+        self, index_names: list[str], top: int = 20, **search_kwargs
+    ) -> list[dict[str, Any]]:
+        """
+        retrieve の非同期版。azure.search.documents.aio のクライアントで全インデックスを並行に検索する。
+        """
+        unique_index_names = list(dict.fromkeys(index_names))
+        if not unique_index_names:
+            return []
+
+        async def _search(index_name: str) -> list[dict[str, Any]]:
+            async with self.async_search_client_factory(index_name) as search_client:
+                results = await search_client.search(top=top, **search_kwargs)
+                return [dict(result) async for result in results]
+
+        async def _hedged_search(index_name: str) -> list[dict[str, Any]]:
+            if self.hedging_policy is None:
+                return await _search(index_name)
+            return await self.hedging_policy.acall(
+                f"search:{index_name}", lambda: _search(index_name)
+            )
+
+        async def _cached_search(index_name: str) -> list[dict[str, Any]]:
+            if self.result_cache is None:
+                return await _hedged_search(index_name)
+            return await self.result_cache.aget_or_search(
+                index_name,
+                {"top": top, **search_kwargs},
+                lambda: _hedged_search(index_name),
+            )
+
+        result_lists = await asyncio.gather(*map(_cached_search, unique_index_names))
+        return reciprocal_rank_fusion(list(result_lists), k=self.rrf_k)[:top]
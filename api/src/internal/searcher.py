@@ -1,31 +1,113 @@
+import asyncio
 import json
 import os
+import time
 from typing import Any
 
-import tiktoken
 import toml
 from azure.search.documents.indexes.models import *
 from azure.search.documents.models import VectorizedQuery
 from pydantic import BaseModel
 
-from src.services.azure_ai_search import AzureAISearch
+from src.internal.citation import (
+    CitationExpander,
+    build_citation_map,
+    expand_citations,
+)
+from src.internal.conversation_memory import SUMMARY, ConversationMemory
+from src.internal.reranker import LocalReranker
+from src.internal.retriever import FanOutRetriever
+from src.internal.stage_graph import StageGraph
+from src.internal.stream_protocol import DELTA, REFERENCES, USAGE, StreamEvent
+from src.internal.token_counter import get_token_accountant
+from src.services.answer_cache import get_answer_cache, is_answer_cache_enabled
+from src.services.aux_call_cache import (
+    get_aux_call_cache,
+    is_aux_call_cache_enabled,
+    prompt_version,
+)
 from src.services.azure_openai import AzureOpenAI
+from src.services.embedding_cache import (
+    acreate_embeddings_with_cache,
+    create_embeddings_with_cache,
+)
+from src.services.model_routing import ModelRoute, get_model_routing_policy
 
 CONFIG_PATH = "/app/config.toml"
 CONFIG = toml.load(CONFIG_PATH)
 PROMPT_CONFIG = CONFIG.get("prompt", {})
 SYSTEM_PROMPT = PROMPT_CONFIG.get("SYSTEM_PROMPT", "")
 HYPOTHETICAL_ANSWER_PROMPT = PROMPT_CONFIG.get("HYPOTHETICAL_ANSWER_PROMPT", "")
+SEARCH_CONFIG = CONFIG.get("search", {})
+# 回答生成のプロンプトに含める情報源の合計トークン数の上限
+SOURCE_TOKEN_BUDGET = int(SEARCH_CONFIG.get("SOURCE_TOKEN_BUDGET", 6000))
+# 情報源1件あたりのファイル名・URLなどのトークン数の見積もり
+SOURCE_OVERHEAD_TOKENS = 64
+# 回答の再生成のためにメッセージに保存する情報源の項目
+RETRIEVAL_CONTEXT_FIELDS = ("id", "content", "sourceFileName", "pageNumber", "blobUrl")
+# ローカル再ランキング（コサイン類似度 + セマンティックランカーのスコア + MMR）の設定
+RERANK_ENABLED = bool(SEARCH_CONFIG.get("RERANK_ENABLED", False))
+RERANK_TOP_K = int(SEARCH_CONFIG.get("RERANK_TOP_K", 8))
+RERANK_VECTOR_WEIGHT = float(SEARCH_CONFIG.get("RERANK_VECTOR_WEIGHT", 0.5))
+RERANK_MMR_LAMBDA = float(SEARCH_CONFIG.get("RERANK_MMR_LAMBDA", 0.7))
+# 仮説回答と検索クエリの生成方法
+# "separate": 2回のLLM呼び出しで個別に生成する / "combined": 1回の呼び出しでJSONとしてまとめて生成する
+QUERY_GENERATION_MODE = SEARCH_CONFIG.get("QUERY_GENERATION_MODE", "separate")
+# 回答中の出典の出力方法
+# "full": モデルが <source-doc:...> を出力する / "compact": モデルは [S1] のみを出力し、サーバー側で展開する
+CITATION_MODE = SEARCH_CONFIG.get("CITATION_MODE", "full")
+# 回答生成のメッセージの順序
+# "legacy": 会話履歴の後にsystemメッセージを置く / "cache_friendly": 共通の指示を先頭に置き、プロンプトキャッシュを利用する
+PROMPT_LAYOUT = SEARCH_CONFIG.get("PROMPT_LAYOUT", "legacy")
+# 会話履歴の読み込み方法
+# "client": リクエストの chat_history を使用する / "server": DBから直近のメッセージを読み込む
+HISTORY_SOURCE = SEARCH_CONFIG.get("HISTORY_SOURCE", "client")
+# 会話の要約（ローリングサマリー）の設定
+# 有効な場合、会話履歴はチャットルームの要約と、まだ要約されていない直近のメッセージから組み立てる
+CONVERSATION_SUMMARY_ENABLED = bool(
+    SEARCH_CONFIG.get("CONVERSATION_SUMMARY_ENABLED", False)
+)
+# 要約を使用する場合は、常にサーバー側で会話履歴を読み込む
+SERVER_HISTORY_ENABLED = HISTORY_SOURCE == "server" or CONVERSATION_SUMMARY_ENABLED
+conversation_memory = ConversationMemory(
+    recent_messages=int(SEARCH_CONFIG.get("SUMMARY_RECENT_MESSAGES", 6)),
+    max_history_messages=int(SEARCH_CONFIG.get("HISTORY_WINDOW_MESSAGES", 20)),
+)
 
 
 class ChatHistoryItem(BaseModel):
     type: str
     content: str
+    token_count: int | None = None  # 計算済みのトークン数（保存済みの値がある場合）
 
 
 embedding_deploy = os.environ["EMBEDDING_MODEL_NAME"]
 gpt_deploy = os.environ["SEARCH_MODEL_NAME"]
 
+# 補助的なLLM呼び出し（仮説回答・検索クエリの生成）のルーティング設定
+# AUX_MODEL_NAME が未設定の場合は SEARCH_MODEL_NAME のデプロイを使用する
+aux_deploy = SEARCH_CONFIG.get("AUX_MODEL_NAME") or gpt_deploy
+routing_policy = get_model_routing_policy()
+routing_policy.default_deployment = gpt_deploy
+routing_policy.register_route(
+    "hypothetical_answer",
+    ModelRoute(
+        aux_deploy, int(SEARCH_CONFIG.get("HYPOTHETICAL_ANSWER_MAX_TOKENS", 600))
+    ),
+)
+routing_policy.register_route(
+    "search_query",
+    ModelRoute(aux_deploy, int(SEARCH_CONFIG.get("SEARCH_QUERY_MAX_TOKENS", 100))),
+)
+routing_policy.register_route(
+    "query_plan",
+    ModelRoute(aux_deploy, int(SEARCH_CONFIG.get("QUERY_PLAN_MAX_TOKENS", 700))),
+)
+routing_policy.register_route(
+    "conversation_summary",
+    ModelRoute(aux_deploy, int(SEARCH_CONFIG.get("SUMMARY_MAX_TOKENS", 800))),
+)
+
 
 # AIのキャラクターを決めるためのシステムメッセージを定義する。
 system_message_chat_conversation = """
@@ -33,25 +115,41 @@ system_message_chat_conversation = """
 
 # 条件
 ・マークダウン形式で回答してください。積極的に箇条書きにするなど、わかりやすい回答を心掛けてください。
-・回答については、「Sources:」以下に記載されているテキスト情報に基づいて回答してください。情報が複数ある場合は「Sources:」のあとに[Source1]、[Source2]、[Source3]のように記載されますので、それに基づいて回答してください。
-・回答に際して、文ごとにその文の最後の終わりに、<source-doc:<<blobUrl>>(p.ページ番号)---<<sourceFileName>>>を追記してください。ファイル名、ページ番号は各[Source]の文末に存在している、[Reference]の中に入っているファイル名、ページ番号を使用してください。「「「「Referenceを使用してください。カッコなどの記号を含めて必ず原文のまま使用してください。ファイル名は省略しないでください。ファイル名に空白が含まれている場合はそれも出力しなさい。」」」」
-・sourceFileNameとblobUrlはドキュメント検索結果の内容をそのまま使用してください。
-・ユーザーの質問に対して、「Sources:」以下に記載されている内容に基づいて適切な回答ができない場合は、「すみません。わかりません。」と回答して、どのような追加情報があれば回答できるかをユーザーに伝えてください。
+{citation_rule}・ユーザーの質問に対して、「Sources:」以下に記載されている内容に基づいて適切な回答ができない場合は、「すみません。わかりません。」と回答して、どのような追加情報があれば回答できるかをユーザーに伝えてください。
 ・以下に「# 追加の指示」がある場合は、「# 条件」や「# 制約」や「# 回答例」よりも優先的に従って回答してください。
 
 # 制約
 ・「Sources:」以下に記載されている情報以外の回答はしないでください。
-・回答の中に[Source]や[Reference]という文言は入れないでください。
-・videostepの情報は後述のvideostepタグを使用して回答の中に挿入してください。
+{citation_constraint}・videostepの情報は後述のvideostepタグを使用して回答の中に挿入してください。
 
 # 回答例
-「構成には居住区域を考慮する必要があります。<source-doc:https://〇〇.pdf(p.1)---△△.pdf>さらに、生産を使用する目的は、安全性を確保しながら設計することが求められます。<source-doc:〇〇.pdf(p.2)---△△.pdf>」
+「{citation_example}」
 
 {custom_prompt}
 
 {videostep_custom_prompt}
 """
 
+# 出典の出力方法ごとの、システムメッセージの出典に関する指示
+citation_prompts = {
+    "full": {
+        "citation_rule": """・回答については、「Sources:」以下に記載されているテキスト情報に基づいて回答してください。情報が複数ある場合は「Sources:」のあとに[Source1]、[Source2]、[Source3]のように記載されますので、それに基づいて回答してください。
+・回答に際して、文ごとにその文の最後の終わりに、<source-doc:<<blobUrl>>(p.ページ番号)---<<sourceFileName>>>を追記してください。ファイル名、ページ番号は各[Source]の文末に存在している、[Reference]の中に入っているファイル名、ページ番号を使用してください。「「「「Referenceを使用してください。カッコなどの記号を含めて必ず原文のまま使用してください。ファイル名は省略しないでください。ファイル名に空白が含まれている場合はそれも出力しなさい。」」」」
+・sourceFileNameとblobUrlはドキュメント検索結果の内容をそのまま使用してください。
+""",
+        "citation_constraint": "・回答の中に[Source]や[Reference]という文言は入れないでください。\n",
+        "citation_example": "構成には居住区域を考慮する必要があります。<source-doc:https://〇〇.pdf(p.1)---△△.pdf>さらに、生産を使用する目的は、安全性を確保しながら設計することが求められます。<source-doc:〇〇.pdf(p.2)---△△.pdf>",
+    },
+    "compact": {
+        "citation_rule": """・回答については、「Sources:」以下に記載されているテキスト情報に基づいて回答してください。情報が複数ある場合は「Sources:」のあとに[S1]、[S2]、[S3]のようなラベルを付けて記載されますので、それに基づいて回答してください。
+・回答に際して、文ごとにその文の最後の終わりに、根拠とした情報源のラベルを[S1]のように追記してください。複数の情報源を根拠とする場合は[S1][S2]のように並べてください。
+・ファイル名やURLは出力しないでください。
+""",
+        "citation_constraint": "・回答の中に[S1]のような情報源のラベル以外の[Source]や[Reference]という文言は入れないでください。\n",
+        "citation_example": "構成には居住区域を考慮する必要があります。[S1]さらに、生産を使用する目的は、安全性を確保しながら設計することが求められます。[S2]",
+    },
+}
+
 # ユーザからの質問を元に、Azure AI Searchに投げる検索クエリを生成するためのテンプレートを定義する。
 query_prompt_template = """
 これまでの会話履歴と、以下のユーザーからの質問に基づいて、検索クエリを生成してください。
@@ -62,6 +160,9 @@ query_prompt_template = """
 {query}
 """
 
+# 補助的なLLM呼び出しのメモ化キーに含めるプロンプトのバージョン（プロンプトを変更するとキャッシュが無効になる）
+AUX_PROMPT_VERSION = prompt_version(HYPOTHETICAL_ANSWER_PROMPT, query_prompt_template)
+
 
 def semantic_hybrid_search(
     query: str,
@@ -77,79 +178,527 @@ def semantic_hybrid_search(
     production_client = AzureOpenAI()
     openai_client = production_client.init_client()
 
-    # Hypothetical Answer
-    user_message_for_hypothetical_answer = f"""
-{HYPOTHETICAL_ANSWER_PROMPT}
+    chat_histories, history_token_counts = _to_chat_histories(history)
 
+    # 回答キャッシュを参照する。会話の文脈に依存しない、履歴のない質問のみを対象とする。
+    use_answer_cache = is_answer_cache_enabled() and not from_job and not chat_histories
+    cache_custom_prompt = custom_prompt if is_active_custom_prompt else ""
+    query_vector = None
+    cache_versions = None
+    if use_answer_cache:
+        try:
+            query_vector = create_embeddings_with_cache(
+                openai_client, [query], embedding_deploy
+            )[0]
+            # 検索の前のインデックスのバージョンで参照・保存する
+            cache_versions = get_answer_cache().index_versions(index_type_list)
+            cached_answer = get_answer_cache().lookup(
+                query_vector,
+                index_type_list,
+                cache_custom_prompt,
+                model,
+                versions=cache_versions,
+            )
+        except Exception as e:
+            print(f"回答キャッシュの参照に失敗しました: {str(e)}")
+            use_answer_cache = False
+            cached_answer = None
+        if cached_answer:
+            print(f"回答キャッシュにヒットしました: {cached_answer.query}")
+            return _replay_cached_answer(cached_answer)
 
-回答する際は、参考にした情報源を該当する文言の後に載せてください。
+    # セマンティックハイブリッド検索に必要な「ベクトル化されたクエリ」「キーワード検索用クエリ」を生成する。
+    stage_graph = _build_query_stages(
+        openai_client, chat_histories, query, history_token_counts
+    )
+    stage_results = stage_graph.run()
+    vector_query = stage_results["vector_query"]
+    search_query = (
+        stage_results["query_plan"]["search_query"]
+        if "query_plan" in stage_results
+        else stage_results["search_query"]
+    )
+    stage_timings = {k: round(v) for k, v in stage_graph.timings.items()}
+    print(
+        f"Pre-retrieval stages: {stage_graph.elapsed_ms:.0f}ms total, "
+        f"timings(ms)={stage_timings}"
+    )
 
-# 制約
-・簡潔に400文字以内で答えてください。
-・改行などは含まずに、文章で回答してください。
+    # 「ベクトル化されたクエリ」「キーワード検索用クエリ」を用いて、Azure AI Searchに対してセマンティックハイブリッド検索を行う。
+    try:
+        # 対象インデックスを並行に検索し、RRFで統合・重複排除する
+        results = FanOutRetriever().retrieve(
+            _get_index_names(index_type_list),
+            **_search_kwargs(search_query, vector_query),
+        )
+    except Exception as e:
+        # エラーの詳細情報をログに記録
+        print(f"ドキュメント検索エラー: {str(e)}")
+        # インデックス名とクエリ情報を含めたエラーメッセージ
+        error_message = "ドキュメント検索においてエラーが発生しました。"
+        raise RuntimeError(error_message)
+    results = _select_sources(results, vector_query)
 
-# 質問
-{query}
-"""
+    (
+        messages_for_semantic_answer,
+        source_file_names_text_list,
+        reference_docs,
+    ) = _build_answer_messages(
+        query,
+        results,
+        chat_histories,
+        history_token_counts,
+        index_type_list,
+        custom_prompt,
+        is_active_custom_prompt,
+    )
 
-    # 会話履歴の最後に、キーワード検索用クエリを生成するためのプロンプトを追加する。
-    chat_histories = []
-    for h in history:
-        if h.type == "user":
-            chat_histories.append({"role": "user", "content": h.content})
-        elif h.type == "assistant":
-            chat_histories.append({"role": "assistant", "content": h.content})
-    # try:
-    hypothetical_answer = (
-        openai_client.chat.completions.create(
-            model=gpt_deploy,
-            messages=[
-                *chat_histories,
-                {"role": "system", "content": "あなたは、AIのアシスタントです。"},
-                {
-                    "role": "user",
-                    "content": user_message_for_hypothetical_answer.format(),
-                },
-            ],
+    if from_job:
+        response = openai_client.chat.completions.create(
+            model=model,
+            messages=messages_for_semantic_answer,
+            temperature=0,
         )
-        .choices[0]
-        .message.content
+        return {
+            "query": search_query,
+            "reference_docs": reference_docs,
+            "generated": _expand_generated(
+                response.choices[0].message.content, results
+            ),
+            "stage_timings": stage_graph.timings,
+        }
+    # jobからの実行の場合これ以降は実行されない
+
+    # Azure OpenAI Serviceに回答生成を依頼する（本番環境対応版）
+    try:
+        response = production_client.create_chat_completion(
+            messages=messages_for_semantic_answer,
+            model=model,
+            temperature=0,
+            stream=True,
+            max_tokens=2000,
+        )
+    except Exception as e:
+        production_client.logger.error(
+            f"回答生成においてエラーが発生しました: {str(e)}"
+        )
+        raise RuntimeError(f"回答生成においてエラーが発生しました: {str(e)}")
+
+    answer_stream = _AnswerStream(
+        source_file_names_text_list,
+        on_complete=_answer_cache_writer(
+            query,
+            query_vector,
+            index_type_list,
+            cache_custom_prompt,
+            model,
+            cache_versions,
+        )
+        if use_answer_cache
+        else None,
+        citations=_get_citations(results),
+    )
+
+    def stream_generator():
+        yield from answer_stream.start()
+        for chunk in response:
+            yield from answer_stream.feed(chunk)
+        yield from answer_stream.finish()
+
+    return (
+        stream_generator,
+        answer_stream.get_full_content,
+        source_file_names_text_list,
+        answer_stream.get_token_usage,
+        _retrieval_context(results),
+    )
+
+
+async def asemantic_hybrid_search(
+    query: str,
+    index_type_list: list[str],
+    custom_prompt: str = "",
+    is_active_custom_prompt: bool = False,
+    model: str = gpt_deploy,
+    history: list[ChatHistoryItem] = [],
+):
+    """
+    semantic_hybrid_search の非同期版。
+
+    AsyncAzureOpenAI と azure.search.documents.aio のクライアントを使用し、
+    回答のストリームを非同期ジェネレータとして返す。待機中にスレッドを占有しないため、
+    1ワーカーで多数のストリームを同時に処理できる。
+    """
+    production_client = _get_async_production_client()
+    async_openai_client = production_client.init_async_client()
+
+    chat_histories, history_token_counts = _to_chat_histories(history)
+
+    # 回答キャッシュを参照する。会話の文脈に依存しない、履歴のない質問のみを対象とする。
+    use_answer_cache = is_answer_cache_enabled() and not chat_histories
+    cache_custom_prompt = custom_prompt if is_active_custom_prompt else ""
+    query_vector = None
+    cache_versions = None
+    if use_answer_cache:
+        try:
+            query_vector = (
+                await acreate_embeddings_with_cache(
+                    async_openai_client, [query], embedding_deploy
+                )
+            )[0]
+            # 検索の前のインデックスのバージョンで参照・保存する
+            cache_versions = await get_answer_cache().aindex_versions(index_type_list)
+            cached_answer = get_answer_cache().lookup(
+                query_vector,
+                index_type_list,
+                cache_custom_prompt,
+                model,
+                versions=cache_versions,
+            )
+        except Exception as e:
+            print(f"回答キャッシュの参照に失敗しました: {str(e)}")
+            use_answer_cache = False
+            cached_answer = None
+        if cached_answer:
+            print(f"回答キャッシュにヒットしました: {cached_answer.query}")
+            return _to_async_stream(_replay_cached_answer(cached_answer))
+
+    vector_query, search_query = await _aprepare_queries(
+        async_openai_client, chat_histories, query, history_token_counts
     )
-    # except:
-    #     raise RuntimeError("検索クエリ生成においてエラーが発生しました")
 
-    # Azure OpenAI Serviceの埋め込み用APIを用いて、ユーザーからの質問をベクトル化する。
-    # セマンティックハイブリッド検索に必要な「ベクトル化されたクエリ」「キーワード検索用クエリ」のうち、ベクトル化されたクエリを生成する。
     try:
-        response = openai_client.embeddings.create(
-            input=hypothetical_answer, model=embedding_deploy
+        results = await FanOutRetriever().aretrieve(
+            _get_index_names(index_type_list),
+            **_search_kwargs(search_query, vector_query),
         )
-        vector_query = VectorizedQuery(
-            vector=response.data[0].embedding,
-            k_nearest_neighbors=3,
-            fields="contentVector",
+    except Exception as e:
+        print(f"ドキュメント検索エラー: {str(e)}")
+        raise RuntimeError("ドキュメント検索においてエラーが発生しました。")
+    results = _select_sources(results, vector_query)
+
+    return await _astream_answer(
+        production_client,
+        query,
+        results,
+        chat_histories,
+        history_token_counts,
+        index_type_list,
+        custom_prompt,
+        is_active_custom_prompt,
+        model,
+        on_complete=_answer_cache_writer(
+            query,
+            query_vector,
+            index_type_list,
+            cache_custom_prompt,
+            model,
+            cache_versions,
         )
-    except:
-        raise RuntimeError("埋め込み取得においてエラーが発生しました")
+        if use_answer_cache
+        else None,
+    )
 
-    # ユーザーからの質問を元に、Azure AI Searchに投げる検索クエリを生成する。
-    # セマンティックハイブリッド検索に必要な「ベクトル化されたクエリ」「キーワード検索用クエリ」のうち、検索クエリを生成する。
-    messages_for_search_query = [*chat_histories]
 
-    messages_for_search_query.append(
-        {"role": "user", "content": query_prompt_template.format(query=query)}
+async def aregenerate_answer(
+    query: str,
+    retrieval_context: dict[str, Any],
+    index_type_list: list[str],
+    custom_prompt: str = "",
+    is_active_custom_prompt: bool = False,
+    model: str = gpt_deploy,
+    history: list[ChatHistoryItem] = [],
+):
+    """
+    保存済みの情報源（retrieval_context）を使用して回答を再生成する。
+
+    仮説回答・検索クエリの生成、埋め込み、検索は行わず、回答生成のみを呼び出す。
+    戻り値は asemantic_hybrid_search と同じ形式。
+    """
+    production_client = _get_async_production_client()
+    chat_histories, history_token_counts = _to_chat_histories(history)
+    return await _astream_answer(
+        production_client,
+        query,
+        retrieval_context["sources"],
+        chat_histories,
+        history_token_counts,
+        index_type_list,
+        custom_prompt,
+        is_active_custom_prompt,
+        model,
     )
-    messages_for_search_query = _trim_messages(messages_for_search_query)
 
-    response = openai_client.chat.completions.create(
-        model=gpt_deploy, messages=messages_for_search_query
+
+async def _astream_answer(
+    production_client: AzureOpenAI,
+    query: str,
+    results: list[dict[str, Any]],
+    chat_histories: list[dict[str, str]],
+    history_token_counts: list[int | None],
+    index_type_list: list[str],
+    custom_prompt: str,
+    is_active_custom_prompt: bool,
+    model: str,
+    on_complete=None,
+):
+    """選択済みの情報源から回答生成のメッセージを組み立て、回答のストリームを返す。"""
+    messages_for_semantic_answer, source_file_names_text_list, _ = (
+        _build_answer_messages(
+            query,
+            results,
+            chat_histories,
+            history_token_counts,
+            index_type_list,
+            custom_prompt,
+            is_active_custom_prompt,
+        )
     )
-    search_query = response.choices[0].message.content
 
-    # 「ベクトル化されたクエリ」「キーワード検索用クエリ」を用いて、Azure AI Searchに対してセマンティックハイブリッド検索を行う。
-    results = []
-    source_prompt = ""
-    # index_typeからAzure AI Searchの実際のインデックス名へのマッピング
+    try:
+        response = await production_client.acreate_chat_completion(
+            messages=messages_for_semantic_answer,
+            model=model,
+            temperature=0,
+            stream=True,
+            max_tokens=2000,
+        )
+    except Exception as e:
+        production_client.logger.error(
+            f"回答生成においてエラーが発生しました: {str(e)}"
+        )
+        raise RuntimeError(f"回答生成においてエラーが発生しました: {str(e)}")
+
+    answer_stream = _AnswerStream(
+        source_file_names_text_list,
+        on_complete=on_complete,
+        citations=_get_citations(results),
+    )
+
+    async def stream_generator():
+        for item in answer_stream.start():
+            yield item
+        async for chunk in response:
+            for item in answer_stream.feed(chunk):
+                yield item
+        for item in answer_stream.finish():
+            yield item
+
+    return (
+        stream_generator,
+        answer_stream.get_full_content,
+        source_file_names_text_list,
+        answer_stream.get_token_usage,
+        _retrieval_context(results),
+    )
+
+
+_async_production_client: AzureOpenAI | None = None
+
+
+def _get_async_production_client() -> AzureOpenAI:
+    """
+    非同期版で使用するクライアントを取得する。
+
+    AsyncAzureOpenAI の接続プールをリクエスト間で共有するため、プロセスで1つだけ生成する。
+    """
+    global _async_production_client
+    if _async_production_client is None:
+        _async_production_client = AzureOpenAI()
+    return _async_production_client
+
+
+class _AnswerStream:
+    """
+    回答生成のストリームのチャンクを、ストリームのイベント（StreamEvent）に変換するクラス。
+
+    同期版・非同期版のストリームで共通して使用する。検索の完了時点で確定している参照情報
+    （references）を最初に返し、回答の本文（delta）、トークン使用量（usage）の順に返す。
+    citations が指定された場合は、回答の本文の出典タグ（[S1] など）を展開して返す。
+    """
+
+    def __init__(self, references, on_complete=None, citations=None):
+        self.references = references
+        self.on_complete = on_complete
+        self.citation_expander = (
+            CitationExpander(citations) if citations is not None else None
+        )
+        self.accumulated_text = []
+        self.end_flag = False
+        self.token_usage = None
+
+    def start(self) -> list[StreamEvent]:
+        """ストリームの開始時に、参照情報を返す"""
+        return [StreamEvent(REFERENCES, self.references)]
+
+    def feed(self, chunk) -> list[StreamEvent]:
+        """チャンクを1つ処理し、クライアントに返すイベントのリストを返す"""
+        if self.end_flag:
+            if not self.token_usage:
+                self.token_usage = {
+                    "completion_tokens": chunk.usage.completion_tokens,
+                    "prompt_tokens": chunk.usage.prompt_tokens,
+                    "total_tokens": chunk.usage.total_tokens,
+                    "cached_tokens": _cached_tokens(chunk.usage),
+                }
+                return [StreamEvent(USAGE, self.token_usage)]
+        elif chunk.choices and len(chunk.choices) > 0:
+            delta_content = getattr(chunk.choices[0].delta, "content", "")
+            if delta_content:
+                if self.citation_expander:
+                    delta_content = self.citation_expander.feed(delta_content)
+                return self._delta(delta_content)
+            elif chunk.choices[0].finish_reason == "stop":
+                self.end_flag = True
+                return self._flush()
+        return []
+
+    def finish(self) -> list[StreamEvent]:
+        """ストリームの終了時の処理。正常に生成が完了した回答のみ on_complete に渡す"""
+        events = self._flush()
+        if self.on_complete and self.end_flag and self.accumulated_text:
+            self.on_complete(self.get_full_content(), self.references)
+        return events
+
+    def _delta(self, text: str) -> list[StreamEvent]:
+        if not text:
+            return []
+        self.accumulated_text.append(text)
+        return [StreamEvent(DELTA, text)]
+
+    def _flush(self) -> list[StreamEvent]:
+        # 出典タグの展開のために保留している文字列を返す
+        if not self.citation_expander:
+            return []
+        return self._delta(self.citation_expander.flush())
+
+    def get_full_content(self):
+        return "".join(self.accumulated_text)
+
+    def get_token_usage(self):
+        return self.token_usage
+
+
+def _cached_tokens(usage) -> int:
+    """トークン使用量のうち、プロンプトキャッシュにヒットしたプロンプトのトークン数を返す"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+
+def _answer_cache_writer(
+    query, query_vector, index_type_list, cache_custom_prompt, model, versions
+):
+    """生成が完了した回答を回答キャッシュに保存する関数を返す。"""
+
+    def _store(answer: str, references):
+        get_answer_cache().store(
+            query=query,
+            query_vector=query_vector,
+            index_types=index_type_list,
+            answer=answer,
+            references=references,
+            custom_prompt=cache_custom_prompt,
+            model=model,
+            versions=versions,
+        )
+
+    return _store
+
+
+def _replay_cached_answer(cached_answer):
+    """キャッシュ済みの回答を、通常の回答生成と同じ形式のストリームとして返す。"""
+    token_usage = {
+        "completion_tokens": 0,
+        "prompt_tokens": 0,
+        "total_tokens": 0,
+        "cached_tokens": 0,
+    }
+    references = cached_answer.references
+
+    def stream_generator():
+        yield StreamEvent(REFERENCES, references)
+        for i in range(0, len(cached_answer.answer), 20):
+            yield StreamEvent(DELTA, cached_answer.answer[i : i + 20])
+        yield StreamEvent(USAGE, token_usage)
+
+    def get_full_content():
+        return cached_answer.answer
+
+    def get_token_usage():
+        return token_usage
+
+    # キャッシュ済みの回答は情報源を保持しないため、再生成時は検索からやり直す
+    return (
+        stream_generator,
+        get_full_content,
+        references,
+        get_token_usage,
+        None,
+    )
+
+
+def _to_async_stream(search_result):
+    """同期版のストリームを返す検索結果を、非同期ジェネレータを返す形式に変換する。"""
+    stream_generator, get_full_content, references, get_token_usage, context = (
+        search_result
+    )
+
+    async def async_stream_generator():
+        for item in stream_generator():
+            yield item
+
+    return (
+        async_stream_generator,
+        get_full_content,
+        references,
+        get_token_usage,
+        context,
+    )
+
+
+def _to_chat_histories(
+    history: list[ChatHistoryItem],
+) -> tuple[list[dict[str, str]], list[int | None]]:
+    """
+    会話履歴をAzure OpenAIのメッセージ形式に変換する。
+
+    保存済みのトークン数がある場合は、トリミング時に再計算せずに使用する。
+    """
+    chat_histories = []
+    history_token_counts = []
+    for h in history:
+        if h.type in ("user", "assistant"):
+            chat_histories.append({"role": h.type, "content": h.content})
+            history_token_counts.append(h.token_count)
+        elif h.type == SUMMARY:
+            # 要約はsystemメッセージとして渡し、トリミングで削除されないようにする
+            chat_histories.append(
+                {"role": "system", "content": "# これまでの会話の要約\n" + h.content}
+            )
+            history_token_counts.append(None)
+    return chat_histories, history_token_counts
+
+
+def summarize_conversation(summary: str | None, history: list[dict[str, Any]]) -> str:
+    """
+    これまでの要約と新しいメッセージから、会話全体の要約を生成する。
+
+    Args:
+        summary (str | None): これまでの要約
+        history (list[dict]): 要約に取り込むメッセージ（ConversationMemory.history() の形式）
+    """
+    openai_client = AzureOpenAI().init_client()
+    response = routing_policy.complete(
+        openai_client,
+        "conversation_summary",
+        conversation_memory.summary_messages(summary, history),
+        temperature=0,
+    )
+    return response.choices[0].message.content.strip()
+
+
+def _get_index_names(index_type_list: list[str]) -> list[str]:
+    """index_typeからAzure AI Searchの実際のインデックス名を取得する。"""
     # 現在はすべて同じインデックスを使用
     index_mapping = {
         "01INDEX01TYPE001001001001": "yuyama-documents-index",
@@ -157,46 +706,72 @@ def semantic_hybrid_search(
         "01INDEX03TYPE001001001001": "yuyama-documents-index",
         "documents": "yuyama-documents-index",  # フォールバック用
     }
+    index_names = []
+    for index_type in index_type_list:
+        # マッピングを使用してAzureの正しいインデックス名を取得
+        index_name = index_mapping.get(index_type, "yuyama-documents-index")
+        print(f"Using Azure index: {index_name} for index_type: {index_type}")
+        index_names.append(index_name)
+    return index_names
 
-    try:
-        for index_type in index_type_list:
-            # マッピングを使用してAzureの正しいインデックス名を取得
-            index_name = index_mapping.get(index_type, "yuyama-documents-index")
-            print(f"Using Azure index: {index_name} for index_type: {index_type}")
-            search_client = AzureAISearch().init_search_client(index_name)
-            _results = search_client.search(
-                query_type="semantic",
-                semantic_configuration_name="default",
-                search_text=search_query,
-                vector_queries=[vector_query],
-                select=[
-                    "id",
-                    "keywords",
-                    "content",
-                    "sourceFileName",
-                    "pageNumber",
-                    "blobUrl",
-                ],
-                query_caption="extractive",
-                query_answer="extractive",
-                highlight_pre_tag="<em>",
-                highlight_post_tag="</em>",
-                top=20,
-            )
-            for result in _results:
-                results.append(result)
-            source_prompt += _get_source_prompt(results)
-    except Exception as e:
-        # エラーの詳細情報をログに記録
-        print(f"ドキュメント検索エラー: {str(e)}")
-        # インデックス名とクエリ情報を含めたエラーメッセージ
-        error_message = "ドキュメント検索においてエラーが発生しました。"
-        raise RuntimeError(error_message)
 
-    messages_for_semantic_answer = [*chat_histories]
+def _search_kwargs(search_query: str, vector_query: VectorizedQuery) -> dict[str, Any]:
+    """セマンティックハイブリッド検索のパラメータを生成する。"""
+    return {
+        "top": 20,
+        "query_type": "semantic",
+        "semantic_configuration_name": "default",
+        "search_text": search_query,
+        "vector_queries": [vector_query],
+        "select": [
+            "id",
+            "keywords",
+            "content",
+            "sourceFileName",
+            "pageNumber",
+            "blobUrl",
+            "tokenCount",
+            # 再ランキングが有効な場合のみ、ベクトルを取得する
+            *(["contentVector"] if RERANK_ENABLED else []),
+        ],
+        "query_caption": "extractive",
+        "query_answer": "extractive",
+        "highlight_pre_tag": "<em>",
+        "highlight_post_tag": "</em>",
+    }
+
+
+def _select_sources(
+    results: list[dict[str, Any]], vector_query: VectorizedQuery
+) -> list[dict[str, Any]]:
+    """検索結果から、回答生成のプロンプトに含める情報源を選択する。"""
+    if RERANK_ENABLED:
+        results = _rerank(vector_query.vector, results)
+    return _pack_sources(results, SOURCE_TOKEN_BUDGET)
+
+
+def _build_answer_messages(
+    query: str,
+    results: list[dict[str, Any]],
+    chat_histories: list[dict[str, str]],
+    history_token_counts: list[int | None],
+    index_type_list: list[str],
+    custom_prompt: str,
+    is_active_custom_prompt: bool,
+):
+    """
+    回答生成のメッセージを組み立てる。
+
+    Returns:
+        tuple: (メッセージ, 参照情報のリスト, 評価用の参照ドキュメント)
+    """
+    source_prompt = _get_source_prompt(results)
+    citation_prompt = citation_prompts[CITATION_MODE]
+
     videostep_custom_prompt = ""
     if "3d401888-1c0b-0ef4-3e46-941a799d635e" in index_type_list:
-        videostep_custom_prompt = """
+        videostep_custom_prompt = (
+            """
 # videostepタグの指示
 ・videostepの情報はJSON形式で渡されます。
 ・JSONのフォーマットは以下の通りです。
@@ -216,7 +791,9 @@ def semantic_hybrid_search(
 ・動画情報が複数ある場合は、それぞれの動画を適切な位置に配置してください。
 
 # videostepタグを含んだ回答例
-「構成には居住区域を考慮する必要があります。<source-doc:https://〇〇.pdf(p.1)---△△.pdf>さらに、生産を使用する目的は、安全性を確保しながら設計することが求められます。<source-doc:〇〇.pdf(p.2)---△△.pdf><videostep title="〇〇" desc="〇〇" url="https://example.com/video1">」
+「"""
+            + citation_prompt["citation_example"]
+            + """<videostep title="〇〇" desc="〇〇" url="https://example.com/video1">」
 
 この手順については、以下の動画で詳しく説明されています：
 <videostep title="安全な設計の基本" desc="居住区域と生産性を考慮した設計方法の解説" url="https://example.com/video1">」
@@ -224,19 +801,27 @@ def semantic_hybrid_search(
 #　必ずvideostepタグを含んだ回答を生成してください。
 videostep_test_index_xxxx.jsonというファイル名のファイルが存在する場合、必ずvideostepタグを使用してください。
 """
+        )
 
     if len(custom_prompt) > 0 and is_active_custom_prompt:
         custom_prompt = "# 追加の指示\n" + custom_prompt
-    messages_for_semantic_answer.append(
-        {
-            "role": "system",
-            "content": system_message_chat_conversation.format(
-                system_prompt=SYSTEM_PROMPT,
-                custom_prompt=custom_prompt,
-                videostep_custom_prompt=videostep_custom_prompt,
-            ),
-        }
-    )
+    if PROMPT_LAYOUT == "cache_friendly":
+        system_messages, custom_messages = _cache_friendly_system_messages(
+            custom_prompt, videostep_custom_prompt, citation_prompt
+        )
+    else:
+        system_messages = []
+        custom_messages = [
+            {
+                "role": "system",
+                "content": system_message_chat_conversation.format(
+                    system_prompt=SYSTEM_PROMPT,
+                    custom_prompt=custom_prompt,
+                    videostep_custom_prompt=videostep_custom_prompt,
+                    **citation_prompt,
+                ),
+            }
+        ]
 
     source_file_names_text_list = []
     reference_docs = []
@@ -255,8 +840,8 @@ videostep_test_index_xxxx.jsonというファイル名のファイルが存在
                 result["blobUrl"],
             )
         )
-    # source_file_names_text_list内の重複排除
-    source_file_names_text_list = list(set(source_file_names_text_list))
+    # source_file_names_text_list内の重複排除（検索順位の順序を維持する）
+    source_file_names_text_list = list(dict.fromkeys(source_file_names_text_list))
     user_message = f"""
 # ユーザーの質問
 {query}
@@ -266,109 +851,498 @@ Sources:
 {source_prompt}
 """
 
-    messages_for_semantic_answer.append({"role": "user", "content": user_message})
+    messages_for_semantic_answer = [
+        *system_messages,
+        *chat_histories,
+        *custom_messages,
+        {"role": "user", "content": user_message},
+    ]
 
-    messages_for_semantic_answer = _trim_messages(messages_for_semantic_answer)
+    messages_for_semantic_answer = _trim_messages(
+        messages_for_semantic_answer,
+        [
+            *[None] * len(system_messages),
+            *history_token_counts,
+            *[None] * len(custom_messages),
+            None,
+        ],
+    )
     if "3d401888-1c0b-0ef4-3e46-941a799d635e" in index_type_list:
         messages_for_semantic_answer.append(
             {"role": "user", "content": "videostepを使用してください"}
         )
+    return messages_for_semantic_answer, source_file_names_text_list, reference_docs
 
-    if from_job:
-        response = openai_client.chat.completions.create(
-            model=model,
-            messages=messages_for_semantic_answer,
-            temperature=0,
+
+def _cache_friendly_system_messages(
+    custom_prompt: str, videostep_custom_prompt: str, citation_prompt: dict[str, str]
+):
+    """
+    プロンプトキャッシュを利用しやすい順序のsystemメッセージを組み立てる。
+
+    Azure OpenAIのプロンプトキャッシュはメッセージの先頭から一致する部分に適用されるため、
+    リクエストによらず同じ内容の共通の指示、インデックスごとの指示（videostep）を先頭に置き、
+    カスタムプロンプトは会話履歴の後に置く。
+
+    Returns:
+        tuple: (会話履歴の前に置くsystemメッセージ, 会話履歴の後に置くsystemメッセージ)
+    """
+    static_prompt = system_message_chat_conversation.format(
+        system_prompt=SYSTEM_PROMPT,
+        custom_prompt="",
+        videostep_custom_prompt="",
+        **citation_prompt,
+    ).rstrip()
+    system_messages = [{"role": "system", "content": static_prompt}]
+    if videostep_custom_prompt:
+        system_messages.append({"role": "system", "content": videostep_custom_prompt})
+    custom_messages = (
+        [{"role": "system", "content": custom_prompt}] if custom_prompt else []
+    )
+    return system_messages, custom_messages
+
+
+def _build_query_stages(
+    openai_client, chat_histories, query: str, history_token_counts
+) -> StageGraph:
+    """
+    検索前のLLM呼び出しのステージグラフを構築する。
+
+    "separate" モードでは、ベクトル化されたクエリは仮説回答に依存するが、キーワード検索用クエリは
+    独立しているため、「仮説回答→埋め込み」と「検索クエリ生成」を並行して実行する。
+    "combined" モードでは、1回の呼び出しで仮説回答と検索クエリをまとめて生成してから埋め込む。
+    """
+    stage_graph = StageGraph()
+    if QUERY_GENERATION_MODE == "combined":
+        stage_graph.add_stage(
+            "query_plan",
+            lambda: _generate_query_plan(
+                openai_client, chat_histories, query, history_token_counts
+            ),
         )
-        return {
-            "query": search_query,
-            "reference_docs": reference_docs,
-            "generated": response.choices[0].message.content,
-        }
-    # jobからの実行の場合これ以降は実行されない
+        stage_graph.add_stage(
+            "vector_query",
+            lambda query_plan: _create_vector_query(
+                openai_client, query_plan["hypothetical_answer"]
+            ),
+            depends_on=["query_plan"],
+        )
+        return stage_graph
+
+    stage_graph.add_stage(
+        "hypothetical_answer",
+        lambda: _generate_hypothetical_answer(openai_client, chat_histories, query),
+    )
+    stage_graph.add_stage(
+        "vector_query",
+        lambda hypothetical_answer: _create_vector_query(
+            openai_client, hypothetical_answer
+        ),
+        depends_on=["hypothetical_answer"],
+    )
+    stage_graph.add_stage(
+        "search_query",
+        lambda: _generate_search_query(
+            openai_client, chat_histories, query, history_token_counts
+        ),
+    )
+    return stage_graph
+
+
+async def _aprepare_queries(
+    async_openai_client, chat_histories, query: str, history_token_counts
+) -> tuple[VectorizedQuery, str]:
+    """
+    _build_query_stages の非同期版。「ベクトル化されたクエリ」と「キーワード検索用クエリ」を返す。
+    """
+    start = time.perf_counter()
+    if QUERY_GENERATION_MODE == "combined":
+        query_plan = await _agenerate_query_plan(
+            async_openai_client, chat_histories, query, history_token_counts
+        )
+        search_query = query_plan["search_query"]
+        vector_query = await _acreate_vector_query(
+            async_openai_client, query_plan["hypothetical_answer"]
+        )
+    else:
+
+        async def _hypothetical_vector_query():
+            hypothetical_answer = await _agenerate_hypothetical_answer(
+                async_openai_client, chat_histories, query
+            )
+            return await _acreate_vector_query(async_openai_client, hypothetical_answer)
+
+        vector_query, search_query = await asyncio.gather(
+            _hypothetical_vector_query(),
+            _agenerate_search_query(
+                async_openai_client, chat_histories, query, history_token_counts
+            ),
+        )
+    print(f"Pre-retrieval stages (async): {(time.perf_counter() - start) * 1000:.0f}ms")
+    return vector_query, search_query
+
+
+def _query_plan_messages(chat_histories, query: str, history_token_counts=None):
+    user_message_for_query_plan = f"""
+以下の2つを生成し、JSON形式で出力してください。
+
+# hypothetical_answer
+{HYPOTHETICAL_ANSWER_PROMPT}
+
+・簡潔に400文字以内で答えてください。
+・改行などは含まずに、文章で回答してください。
+
+# search_query
+{query_prompt_template.format(query="（下記の質問）")}
+
+# 出力形式
+{{"hypothetical_answer": "仮説回答", "search_query": "検索クエリ"}}
+
+# 質問
+{query}
+"""
+    return _trim_messages(
+        [
+            *chat_histories,
+            {"role": "system", "content": "あなたは、AIのアシスタントです。"},
+            {"role": "user", "content": user_message_for_query_plan},
+        ],
+        [*(history_token_counts or [None] * len(chat_histories)), None, None],
+    )
+
+
+def _parse_query_plan(content: str) -> dict[str, str]:
+    """一括生成の応答（JSON）から仮説回答と検索クエリを取り出す。"""
+    query_plan = json.loads(content)
+    if not all(
+        isinstance(query_plan.get(key), str) and query_plan[key].strip()
+        for key in ("hypothetical_answer", "search_query")
+    ):
+        raise ValueError(f"必要なキーが含まれていません: {query_plan}")
+    return {
+        "hypothetical_answer": query_plan["hypothetical_answer"],
+        "search_query": query_plan["search_query"],
+    }
+
+
+def _generate_query_plan(
+    openai_client, chat_histories, query: str, history_token_counts=None
+) -> dict[str, str]:
+    """
+    仮説回答と検索クエリを1回のLLM呼び出しでJSONとしてまとめて生成する。
+
+    JSONの解析に失敗した場合やJSONモードに対応していない場合は、
+    従来の2回の呼び出しで個別に生成する。
+    """
+    messages = _query_plan_messages(chat_histories, query, history_token_counts)
+
+    def _complete() -> dict[str, str]:
+        response = routing_policy.complete(
+            openai_client,
+            "query_plan",
+            messages,
+            response_format={"type": "json_object"},
+        )
+        return _parse_query_plan(response.choices[0].message.content)
 
-    # Azure OpenAI Serviceに回答生成を依頼する（本番環境対応版）
     try:
-        response = production_client.create_chat_completion(
-            messages=messages_for_semantic_answer,
-            model=model,
-            temperature=0,
-            stream=True,
-            max_tokens=2000,
+        # JSONの解析に失敗した結果はキャッシュしない
+        return _memoized("query_plan", messages, _complete)
+    except Exception as e:
+        print(f"仮説回答・検索クエリの一括生成に失敗したため、個別に生成します: {e}")
+
+    fallback_graph = StageGraph()
+    fallback_graph.add_stage(
+        "hypothetical_answer",
+        lambda: _generate_hypothetical_answer(openai_client, chat_histories, query),
+    )
+    fallback_graph.add_stage(
+        "search_query",
+        lambda: _generate_search_query(
+            openai_client, chat_histories, query, history_token_counts
+        ),
+    )
+    return fallback_graph.run()
+
+
+async def _agenerate_query_plan(
+    async_openai_client, chat_histories, query: str, history_token_counts=None
+) -> dict[str, str]:
+    """_generate_query_plan の非同期版"""
+    messages = _query_plan_messages(chat_histories, query, history_token_counts)
+
+    async def _complete() -> dict[str, str]:
+        response = await routing_policy.acomplete(
+            async_openai_client,
+            "query_plan",
+            messages,
+            response_format={"type": "json_object"},
         )
+        return _parse_query_plan(response.choices[0].message.content)
+
+    try:
+        return await _amemoized("query_plan", messages, _complete)
     except Exception as e:
-        production_client.logger.error(
-            f"回答生成においてエラーが発生しました: {str(e)}"
+        print(f"仮説回答・検索クエリの一括生成に失敗したため、個別に生成します: {e}")
+
+    hypothetical_answer, search_query = await asyncio.gather(
+        _agenerate_hypothetical_answer(async_openai_client, chat_histories, query),
+        _agenerate_search_query(
+            async_openai_client, chat_histories, query, history_token_counts
+        ),
+    )
+    return {"hypothetical_answer": hypothetical_answer, "search_query": search_query}
+
+
+def _hypothetical_answer_messages(chat_histories, query: str):
+    user_message_for_hypothetical_answer = f"""
+{HYPOTHETICAL_ANSWER_PROMPT}
+
+
+回答する際は、参考にした情報源を該当する文言の後に載せてください。
+
+# 制約
+・簡潔に400文字以内で答えてください。
+・改行などは含まずに、文章で回答してください。
+
+# 質問
+{query}
+"""
+    return [
+        *chat_histories,
+        {"role": "system", "content": "あなたは、AIのアシスタントです。"},
+        {
+            "role": "user",
+            "content": user_message_for_hypothetical_answer,
+        },
+    ]
+
+
+def _generate_hypothetical_answer(openai_client, chat_histories, query: str) -> str:
+    """HyDE（Hypothetical Document Embeddings）用の仮説回答を生成する。"""
+    messages = _hypothetical_answer_messages(chat_histories, query)
+    return _memoized(
+        "hypothetical_answer",
+        messages,
+        lambda: (
+            routing_policy.complete(openai_client, "hypothetical_answer", messages)
+            .choices[0]
+            .message.content
+        ),
+    )
+
+
+async def _agenerate_hypothetical_answer(
+    async_openai_client, chat_histories, query: str
+) -> str:
+    """_generate_hypothetical_answer の非同期版"""
+    messages = _hypothetical_answer_messages(chat_histories, query)
+
+    async def _complete() -> str:
+        response = await routing_policy.acomplete(
+            async_openai_client, "hypothetical_answer", messages
         )
-        raise RuntimeError(f"回答生成においてエラーが発生しました: {str(e)}")
+        return response.choices[0].message.content
 
-    accumulated_text = []
-    end_flag = False
-    token_usage = None  # トークン使用量を保存する変数を追加
+    return await _amemoized("hypothetical_answer", messages, _complete)
 
-    def stream_generator():
-        nonlocal end_flag, token_usage
-        for chunk in response:
-            if end_flag:
-                if not token_usage:
-                    token_usage = {
-                        "completion_tokens": chunk.usage.completion_tokens,
-                        "prompt_tokens": chunk.usage.prompt_tokens,
-                        "total_tokens": chunk.usage.total_tokens,
-                    }
-                    token_info_json = json.dumps(token_usage)
-                    yield f"\n<<TOKEN_INFO>>{token_info_json}<<TOKEN_INFO_END>>\n"
-            else:
-                if chunk.choices and len(chunk.choices) > 0:
-                    delta_content = getattr(chunk.choices[0].delta, "content", "")
-                    if delta_content:
-                        accumulated_text.append(delta_content)
-                        yield delta_content
-                    elif chunk.choices[0].finish_reason == "stop":
-                        end_flag = True
-
-        references_json = json.dumps(source_file_names_text_list)
-        yield f"\n<<REFERENCES_START>>\n{references_json}\n"
 
-    def get_full_content():
-        return "".join(accumulated_text)
+def _to_vectorized_query(vector: list[float]) -> VectorizedQuery:
+    return VectorizedQuery(
+        vector=vector,
+        k_nearest_neighbors=3,
+        fields="contentVector",
+    )
 
-    def get_token_usage():
-        return token_usage
 
-    return (
-        stream_generator,
-        get_full_content,
-        source_file_names_text_list,
-        get_token_usage,
+def _create_vector_query(openai_client, hypothetical_answer: str) -> VectorizedQuery:
+    """Azure OpenAI Serviceの埋め込み用APIを用いて、仮説回答をベクトル化する。"""
+    try:
+        vector = create_embeddings_with_cache(
+            openai_client, [hypothetical_answer], embedding_deploy
+        )[0]
+        return _to_vectorized_query(vector)
+    except:
+        raise RuntimeError("埋め込み取得においてエラーが発生しました")
+
+
+async def _acreate_vector_query(
+    async_openai_client, hypothetical_answer: str
+) -> VectorizedQuery:
+    """_create_vector_query の非同期版"""
+    try:
+        vector = (
+            await acreate_embeddings_with_cache(
+                async_openai_client, [hypothetical_answer], embedding_deploy
+            )
+        )[0]
+        return _to_vectorized_query(vector)
+    except:
+        raise RuntimeError("埋め込み取得においてエラーが発生しました")
+
+
+def _search_query_messages(chat_histories, query: str, history_token_counts=None):
+    messages_for_search_query = [*chat_histories]
+    messages_for_search_query.append(
+        {"role": "user", "content": query_prompt_template.format(query=query)}
+    )
+    return _trim_messages(
+        messages_for_search_query,
+        [*(history_token_counts or [None] * len(chat_histories)), None],
+    )
+
+
+def _generate_search_query(
+    openai_client, chat_histories, query: str, history_token_counts=None
+) -> str:
+    """会話履歴とユーザーからの質問を元に、Azure AI Searchに投げる検索クエリを生成する。"""
+    messages = _search_query_messages(chat_histories, query, history_token_counts)
+    return _memoized(
+        "search_query",
+        messages,
+        lambda: (
+            routing_policy.complete(openai_client, "search_query", messages)
+            .choices[0]
+            .message.content
+        ),
     )
 
 
-def _trim_messages(messages):
-    """会話履歴の合計のトークン数が最大トークン数を超えないように、古いメッセージから削除する。"""
-    # 利用するモデルからエンコーディングを取得する。
-    encoding = tiktoken.encoding_for_model("gpt-4-1106-preview")
+async def _agenerate_search_query(
+    async_openai_client, chat_histories, query: str, history_token_counts=None
+) -> str:
+    """_generate_search_query の非同期版"""
+    messages = _search_query_messages(chat_histories, query, history_token_counts)
 
-    # 各メッセージのトークン数を計算
-    token_counts = [
-        (message, len(encoding.encode(message["content"]))) for message in messages
-    ]
-    total_tokens = sum(count for _, count in token_counts)
+    async def _complete() -> str:
+        response = await routing_policy.acomplete(
+            async_openai_client, "search_query", messages
+        )
+        return response.choices[0].message.content
+
+    return await _amemoized("search_query", messages, _complete)
+
+
+def _aux_call_key(route_name: str, messages) -> str:
+    route = routing_policy.route(route_name)
+    return get_aux_call_cache().make_key(
+        route_name,
+        AUX_PROMPT_VERSION,
+        messages,
+        deployment=route.deployment,
+        max_tokens=route.max_tokens,
+    )
+
+
+def _memoized(route_name: str, messages, complete):
+    """
+    補助的なLLM呼び出しの結果をメモ化する（AUX_CALL_CACHE_ENABLED が有効な場合）。
+
+    同じ会話履歴・質問・プロンプトのバージョン・ルートの設定に対しては、保存済みの結果を返す。
+    """
+    if not is_aux_call_cache_enabled():
+        return complete()
+    return get_aux_call_cache().get_or_call(
+        route_name, _aux_call_key(route_name, messages), complete
+    )
+
+
+async def _amemoized(route_name: str, messages, complete):
+    """_memoized の非同期版（complete はコルーチン関数）"""
+    if not is_aux_call_cache_enabled():
+        return await complete()
+    return await get_aux_call_cache().aget_or_call(
+        route_name, _aux_call_key(route_name, messages), complete
+    )
 
-    # トークン数が最大トークン数を超えないように、古いメッセージから削除する
-    # もし最大トークン数を超える場合は、systemメッセージ以外のメッセージを古い順から削除する。
-    # この処理をトークン数が最大トークン数を下回るまで行う。
-    max_tokens = 128000 * 0.8
-    while total_tokens > max_tokens:
-        messages.pop(1)
-        total_tokens -= token_counts.pop(1)[1]
-        if total_tokens <= max_tokens:
-            break
 
-    return messages
+def _trim_messages(messages, token_counts=None):
+    """
+    会話履歴の合計のトークン数が最大トークン数を超えないように、古いメッセージから削除する。
+
+    systemメッセージと最後のメッセージは常に残す。トークン数はメモ化されており、
+    token_counts に計算済みの値（DBに保存済みのトークン数など）を渡すと再計算しない。
+    """
+    return get_token_accountant().build_window(messages, token_counts=token_counts)
+
+
+def _rerank(query_vector: list[float], results: list[dict[str, Any]]):
+    """検索結果をローカルで再ランキングし、上位の重複しないチャンクのみに絞り込む。"""
+    start = time.perf_counter()
+    reranked = LocalReranker(
+        top_k=RERANK_TOP_K,
+        vector_weight=RERANK_VECTOR_WEIGHT,
+        mmr_lambda=RERANK_MMR_LAMBDA,
+    ).rerank(query_vector, results)
+    # ベクトルはプロンプトに不要なため、以降の処理に持ち回らない
+    for result in reranked:
+        result.pop("contentVector", None)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(f"再ランキング: {len(results)}件 → {len(reranked)}件 ({elapsed_ms:.1f}ms)")
+    return reranked
+
+
+def _pack_sources(
+    results: list[dict[str, Any]], token_budget: int
+) -> list[dict[str, Any]]:
+    """
+    検索順位の高いチャンクから順に、トークン数の上限に収まるものを選択する。
+
+    トークン数はインデックス時に保存した tokenCount を使用する（tokenCount を持たない
+    古いチャンクのみ計算する）。上限を超えるチャンクは飛ばして次のチャンクを試すが、
+    最上位のチャンクは上限に関わらず必ず含める。
+    """
+    accountant = get_token_accountant()
+    packed = []
+    used_tokens = 0
+    for result in results:
+        token_count = result.get("tokenCount")
+        if token_count is None:
+            token_count = accountant.count(result["content"])
+        token_count += SOURCE_OVERHEAD_TOKENS
+        if packed and used_tokens + token_count > token_budget:
+            continue
+        packed.append(result)
+        used_tokens += token_count
+    print(
+        f"情報源: {len(packed)}/{len(results)}件 ({used_tokens}/{token_budget}トークン)"
+    )
+    return packed
+
+
+def _retrieval_context(results: list[dict[str, Any]]) -> dict[str, Any]:
+    """
+    回答生成に使用した情報源を、メッセージに保存する形式で返す。
+
+    回答の再生成時に同じプロンプトを組み立てられるよう、プロンプトと参照情報に使用する項目のみを残す
+    （ベクトルやスコアは保存しない）。
+    """
+    return {
+        "sources": [
+            {key: result.get(key) for key in RETRIEVAL_CONTEXT_FIELDS}
+            for result in results
+        ]
+    }
+
+
+def _get_citations(results: list[dict[str, Any]]) -> dict[str, str] | None:
+    """compact モードの場合、回答中の出典タグの展開に使用する対応を返す"""
+    if CITATION_MODE != "compact":
+        return None
+    return build_citation_map(results)
+
+
+def _expand_generated(content: str, results: list[dict[str, Any]]) -> str:
+    """ストリーミングしない回答の出典タグを展開する"""
+    citations = _get_citations(results)
+    if citations is None or not content:
+        return content
+    return expand_citations(content, citations)
 
 
 def _get_source_prompt(results: Any) -> str:
+    if CITATION_MODE == "compact":
+        return _get_compact_source_prompt(results)
     sources = []
     for i, result in enumerate(results):
         sources.append(
@@ -391,3 +1365,18 @@ def _get_source_prompt(results: Any) -> str:
             + "\n"
         )
     return "\n".join(sources)
+
+
+def _get_compact_source_prompt(results: Any) -> str:
+    """
+    情報源を [S1]…[Sn] のラベルで記載する。
+
+    モデルはラベルのみを出力するため、blobUrlはプロンプトに含めない（回答のストリーム中に展開する）。
+    """
+    sources = []
+    for i, result in enumerate(results):
+        sources.append(
+            f"[S{i + 1}]: {result['content']}\n"
+            f"[SourceFileName]: {result['sourceFileName']}(p.{result['pageNumber']})\n"
+        )
+    return "\n".join(sources)
@@ -0,0 +1,76 @@
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any
+
+
+@dataclass
+class Stage:
+    """ステージグラフを構成する1つの処理"""
+
+    name: str
+    func: Callable[..., Any]
+    depends_on: list[str] = field(default_factory=list)
+
+
+class StageGraph:
+    """
+    依存関係を持つ処理をステージグラフとして並行実行するクラス。
+
+    依存関係のないステージ同士は同時に実行され、各ステージの関数には
+    依存先ステージの結果がステージ名をキーとしたキーワード引数で渡される。
+    ステージごとの処理時間（ミリ秒）は timings に記録される。
+    """
+
+    def __init__(self):
+        self.stages: dict[str, Stage] = {}
+        self.timings: dict[str, float] = {}
+        self.elapsed_ms: float = 0.0
+
+    def add_stage(
+        self,
+        name: str,
+        func: Callable[..., Any],
+        depends_on: list[str] | None = None,
+    ) -> "StageGraph":
+        """ステージを追加する。依存先のステージは先に追加しておく必要がある。"""
+        if name in self.stages:
+            raise ValueError(f"ステージ名が重複しています: {name}")
+        depends_on = depends_on or []
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"未定義のステージに依存しています: {dependency}")
+        self.stages[name] = Stage(name=name, func=func, depends_on=depends_on)
+        return self
+
+    def run(self) -> dict[str, Any]:
+        """
+        全ステージを実行し、ステージ名をキーとした結果を返す。
+
+        いずれかのステージで例外が発生した場合は、その例外をそのまま送出する。
+        """
+        futures: dict[str, Future] = {}
+        start_time = time.perf_counter()
+
+        def _run_stage(stage: Stage):
+            # 依存先の完了を待ってから処理を開始する（待ち時間は計測に含めない）
+            kwargs = {
+                dependency: futures[dependency].result()
+                for dependency in stage.depends_on
+            }
+            stage_start = time.perf_counter()
+            try:
+                return stage.func(**kwargs)
+            finally:
+                self.timings[stage.name] = (time.perf_counter() - stage_start) * 1000
+
+        # ステージは追加順（＝トポロジカル順）に投入する。
+        # ワーカー数をステージ数と同じにすることで、依存待ちによるデッドロックを防ぐ。
+        with ThreadPoolExecutor(max_workers=max(len(self.stages), 1)) as executor:
+            for name, stage in self.stages.items():
+                futures[name] = executor.submit(_run_stage, stage)
+            results = {name: future.result() for name, future in futures.items()}
+
+        self.elapsed_ms = (time.perf_counter() - start_time) * 1000
+        return results
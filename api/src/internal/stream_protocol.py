@@ -0,0 +1,95 @@
+"""
+チャットのストリーミングプロトコル
+
+回答生成のストリームは型付きのイベント（StreamEvent）として扱い、クライアントへの送信時に
+以下のいずれかの形式に変換する。
+
+- "legacy": text/plain の本文に回答を流し、参照情報を <<REFERENCES_START>> 以降に付与する従来形式
+- "sse": Server-Sent Events。イベント名が delta / references / usage / error / done の形式
+
+参照情報は検索の完了時点で確定するため、ストリームの最初のイベントとして送られる。
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Literal
+
+DELTA = "delta"
+REFERENCES = "references"
+USAGE = "usage"
+ERROR = "error"
+DONE = "done"
+
+StreamFormat = Literal["legacy", "sse"]
+
+MEDIA_TYPES: dict[str, str] = {
+    "legacy": "text/plain",
+    "sse": "text/event-stream",
+}
+
+
+@dataclass(frozen=True)
+class StreamEvent:
+    """ストリームのイベント"""
+
+    type: str
+    data: Any = None
+
+
+def default_stream_format() -> StreamFormat:
+    """リクエストで指定されない場合のストリーミング形式（環境変数 CHAT_STREAM_FORMAT）"""
+    stream_format = os.environ.get("CHAT_STREAM_FORMAT", "legacy").lower()
+    return stream_format if stream_format in MEDIA_TYPES else "legacy"
+
+
+def format_legacy(event: StreamEvent) -> str | None:
+    """
+    イベントを従来形式の文字列に変換する。
+
+    トークン使用量・エラー・完了はクライアントに送信しない（None を返す）。
+    """
+    if event.type == DELTA:
+        return event.data
+    if event.type == REFERENCES:
+        return f"\n<<REFERENCES_START>>\n{json.dumps(event.data)}\n"
+    return None
+
+
+def format_sse(event: StreamEvent) -> str:
+    """イベントをServer-Sent Eventsの1イベントに変換する"""
+    data = json.dumps(event.data, ensure_ascii=False)
+    return f"event: {event.type}\ndata: {data}\n\n"
+
+
+class StreamEncoder:
+    """
+    1つのストリームのイベントを、指定された形式の文字列に変換するクラス
+
+    SSEではイベントを受け取った順に送信する。従来形式ではフロントエンドが本文の末尾で
+    参照情報を解析するため、参照情報のイベントを保持しておき close() で送信する。
+    """
+
+    def __init__(self, stream_format: StreamFormat):
+        self.stream_format = stream_format
+        self._deferred: list[StreamEvent] = []
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.stream_format]
+
+    def encode(self, event: StreamEvent) -> list[str]:
+        if self.stream_format == "sse":
+            return [format_sse(event)]
+        if event.type == REFERENCES:
+            self._deferred.append(event)
+            return []
+        body = format_legacy(event)
+        return [body] if body is not None else []
+
+    def close(self) -> list[str]:
+        """保持しているイベントを送信する（本文の送信後に呼び出す）"""
+        deferred, self._deferred = self._deferred, []
+        return [
+            body for event in deferred if (body := format_legacy(event)) is not None
+        ]
@@ -0,0 +1,118 @@
+import hashlib
+import threading
+from functools import lru_cache
+
+import tiktoken
+
+from src.services.cache import LRUCache
+
+# 会話履歴に使用できるトークン数の上限（128kコンテキストの8割）
+MAX_PROMPT_TOKENS = int(128000 * 0.8)
+
+
+@lru_cache(maxsize=8)
+def get_encoding(model_name: str = "gpt-4-1106-preview") -> tiktoken.Encoding:
+    """モデルに対応するエンコーディングを取得する（プロセス内で1度だけ構築する）"""
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+class TokenAccountant:
+    """
+    メッセージのトークン数を管理するクラス
+
+    テキストごとのトークン数はハッシュをキーとしてメモ化し、同じ会話履歴を
+    リクエストのたびに再トークン化しないようにする。DBに保存済みのトークン数が
+    ある場合はそれを優先して使用する。
+    """
+
+    def __init__(
+        self,
+        model_name: str = "gpt-4-1106-preview",
+        cache_size: int = 8192,
+        encoding: tiktoken.Encoding | None = None,
+    ):
+        self.model_name = model_name
+        self._encoding = encoding
+        self._counts = LRUCache(max_size=cache_size)
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        if self._encoding is None:
+            self._encoding = get_encoding(self.model_name)
+        return self._encoding
+
+    def count(self, text: str | None) -> int:
+        """テキストのトークン数を取得する"""
+        if not text:
+            return 0
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        token_count = self._counts.get(key)
+        if token_count is None:
+            token_count = len(self.encoding.encode(text))
+            self._counts.set(key, token_count)
+        return token_count
+
+    def build_window(
+        self,
+        messages: list[dict[str, str]],
+        max_tokens: int = MAX_PROMPT_TOKENS,
+        token_counts: list[int | None] | None = None,
+    ) -> list[dict[str, str]]:
+        """
+        トークン予算内に収まるメッセージのウィンドウを1パスで構築する。
+
+        systemメッセージと最後のメッセージ（今回の質問）は常に残し、
+        残りの予算で新しいメッセージから順に採用する。予算に収まらない
+        メッセージが現れた時点で、それより古いメッセージは全て除外する。
+
+        Args:
+            messages: Azure OpenAIのメッセージ形式のリスト
+            max_tokens: トークン数の上限
+            token_counts: messages と同じ長さの、計算済みトークン数のリスト
+                （None の要素はその場で計算する）
+        """
+        if not messages:
+            return messages
+
+        counts = [
+            known if known is not None else self.count(message.get("content"))
+            for message, known in zip(
+                messages, token_counts or [None] * len(messages), strict=True
+            )
+        ]
+
+        last_index = len(messages) - 1
+        pinned = {
+            i
+            for i, message in enumerate(messages)
+            if message.get("role") == "system" or i == last_index
+        }
+        budget = max_tokens - sum(counts[i] for i in pinned)
+
+        keep = set(pinned)
+        for i in range(last_index - 1, -1, -1):
+            if i in pinned:
+                continue
+            if counts[i] > budget:
+                break
+            budget -= counts[i]
+            keep.add(i)
+
+        return [message for i, message in enumerate(messages) if i in keep]
+
+
+_token_accountant: TokenAccountant | None = None
+_token_accountant_lock = threading.Lock()
+
+
+def get_token_accountant() -> TokenAccountant:
+    """プロセス共通のTokenAccountantを取得する"""
+    global _token_accountant
+    if _token_accountant is None:
+        with _token_accountant_lock:
+            if _token_accountant is None:
+                _token_accountant = TokenAccountant()
+    return _token_accountant
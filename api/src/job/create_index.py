@@ -7,17 +7,19 @@ from src.services.azure_ai_search import AzureAISearch
 def create_index(index_name: str):
     """Azure AI Searchのインデックスを作成する"""
     client = AzureAISearch().init_search_index_client()
-    # すでにインデックスが作成済みである場合には何もしない
+    # すでにインデックスが作成済みである場合は、不足しているフィールドのみ追加する
     if index_name in client.list_index_names():
         print("すでにインデックスが作成済みです")
+        _add_missing_fields(client, index_name)
         return
 
     # インデックスのフィールドを定義する
     # id: ドキュメントを一意に識別するためのフィールド
     # content: ドキュメントの内容を格納するためのフィールド
     # contentVector: ドキュメントの内容をベクトル化した結果を格納するためのフィールド
-    # sourceFileName: ドキュメントのファイル名を格納するためのフィールド
+    # sourceFileName: ドキュメントのファイル名を格納するためのフィールド（再インデックス時にファイルのチャンクを取得するためフィルタ可能にする）
     # pageNumber: ドキュメントのページ番号を格納するためのフィールド
+    # tokenCount: チャンクのトークン数（検索時のプロンプト組み立てに使用する）
     fields = [
         SimpleField(name="id", type=SearchFieldDataType.String, key=True),
         SimpleField(name="keywords", type="Edm.String", analyzer_name="ja.microsoft"),
@@ -31,9 +33,12 @@ def create_index(index_name: str):
             vector_search_dimensions=1536,
             vector_search_profile_name="myHnswProfile",
         ),
-        SimpleField(name="sourceFileName", type=SearchFieldDataType.String),
+        SimpleField(
+            name="sourceFileName", type=SearchFieldDataType.String, filterable=True
+        ),
         SimpleField(name="pageNumber", type=SearchFieldDataType.Int32),
         SimpleField(name="blobUrl", type=SearchFieldDataType.String),
+        _token_count_field(),
     ]
     # セマンティック検索のための定義を行う
     semantic_settings = SemanticSearch(
@@ -67,6 +72,28 @@ def create_index(index_name: str):
     client.create_index(index)
 
 
+def _token_count_field() -> SimpleField:
+    return SimpleField(name="tokenCount", type=SearchFieldDataType.Int32)
+
+
+def _add_missing_fields(client, index_name: str):
+    """既存のインデックスに後から追加されたフィールドを追加する"""
+    index = client.get_index(index_name)
+    # 既存のフィールドの filterable は変更できないため、インデックスを作り直す必要がある
+    if not any(
+        field.name == "sourceFileName" and field.filterable for field in index.fields
+    ):
+        print(
+            "sourceFileNameフィールドがフィルタ可能ではありません。"
+            "変更されたチャンクのみを再インデックスするには、インデックスを作り直してください"
+        )
+    if any(field.name == "tokenCount" for field in index.fields):
+        return
+    index.fields.append(_token_count_field())
+    client.create_or_update_index(index)
+    print("tokenCountフィールドを追加しました")
+
+
 def prompt_user_input():
     try:
         # 対話形式の質問を定義
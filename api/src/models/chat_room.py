@@ -11,3 +11,5 @@ class ChatRoom(CustomModel):
     name: str
     custom_prompt: str | None = None
     is_active_custom_prompt: bool | None = None
+    summary: str | None = None
+    summary_message_count: int | None = None
@@ -1,3 +1,5 @@
+from typing import Literal
+
 from pydantic import BaseModel, Field
 
 from src.internal.searcher import ChatHistoryItem
@@ -26,7 +28,18 @@ class CreateChatMessageRequest(BaseModel):
     model: str = "GPT-4o-mini"
     index_type: list[str]
     temperature: float = 1.0
+    # サーバー側で会話履歴を読み込む場合（HISTORY_SOURCE="server" または会話の要約が有効な場合）は使用しない
+    chat_history: list[ChatHistoryItem] = None
+    # ストリーミング形式（未指定の場合は環境変数 CHAT_STREAM_FORMAT、既定は "legacy"）
+    stream_format: Literal["legacy", "sse"] | None = None
+
+
+class RegenerateChatMessageRequest(BaseModel):
+    # 未指定の場合は再生成するメッセージと同じモデルを使用する
+    model: str | None = None
+    # 質問より前の会話履歴（サーバー側で会話履歴を読み込む場合は使用しない）
     chat_history: list[ChatHistoryItem] = None
+    stream_format: Literal["legacy", "sse"] | None = None
 
 
 class UpdateChatEvaluation(BaseModel):
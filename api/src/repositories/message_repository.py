@@ -36,6 +36,64 @@ class MessageRepository(BaseRepository):
         # BaseRepositoryのserialize()を使ってPydanticモデル(Message)に変換し、リスト化
         return objs
 
+    def count_by_chat_room_id(
+        self, session: Session, chat_room_id: str, before: datetime | None = None
+    ) -> int:
+        """
+        chat_room_idで絞り込んだレコードの件数を取得する。
+        before を指定した場合は、それより前に作成されたレコードのみを数える。
+        """
+        query = session.query(func.count(MessageTable.id)).filter(
+            MessageTable.chat_room_id == chat_room_id,
+            MessageTable.deleted_at.is_(None),
+        )
+        if before is not None:
+            query = query.filter(MessageTable.created_at < before)
+        return query.scalar()
+
+    def find_previous_user_message(
+        self, session: Session, chat_room_id: str, before: datetime
+    ):
+        """
+        before より前に作成された、直近のユーザメッセージを取得する（回答に対応する質問）。
+        """
+        return (
+            session.query(MessageTable)
+            .filter(
+                MessageTable.chat_room_id == chat_room_id,
+                MessageTable.role == "user",
+                MessageTable.created_at <= before,
+                MessageTable.deleted_at.is_(None),
+            )
+            .order_by(MessageTable.created_at.desc(), MessageTable.id.desc())
+            .first()
+        )
+
+    def find_history_window_by_chat_room_id(
+        self, session: Session, chat_room_id: str, offset: int, limit: int
+    ) -> list:
+        """
+        会話履歴に必要なカラム（role, message, token_count）のみを、作成日時の順で
+        offset 件目から limit 件取得する。
+
+        (chat_room_id, created_at) のインデックスを使用し、会話全体は読み込まない。
+        """
+        if limit <= 0:
+            return []
+        return (
+            session.query(
+                MessageTable.role, MessageTable.message, MessageTable.token_count
+            )
+            .filter(
+                MessageTable.chat_room_id == chat_room_id,
+                MessageTable.deleted_at.is_(None),
+            )
+            .order_by(MessageTable.created_at.asc(), MessageTable.id.asc())
+            .offset(offset)
+            .limit(limit)
+            .all()
+        )
+
     def get_latest_n_days_chat_count(self, session: Session, days: int):
         last_n_days = datetime.utcnow() - timedelta(days=days)
         count = (
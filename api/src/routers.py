@@ -34,6 +34,7 @@ from src.models.request_models import (
     CreateChatMessageRequest,
     DeleteChatRoomRequest,
     GetChatRoomRequest,
+    RegenerateChatMessageRequest,
     ReorderSearchIndexTypesRequest,
     UpdateChatEvaluation,
     UpdateChatroomRequest,
@@ -270,13 +271,14 @@ def get_list(request: Request, chat_room_id: str):
 
 @router.post("/chat_messages")
 @requires_role("user", "admin")
-def create(request: Request, data: CreateChatMessageRequest):
+async def create(request: Request, data: CreateChatMessageRequest):
     # 必要であれば data.dict(exclude={'message', ...}) のようにようにメッセージ内容を除外する
     logger.debug(
         f"'/chat_messages' (POST) リクエスト受信: chat_room_id={data.chat_room_id}, model={data.model}"
     )
     try:
-        response = chat_message_controller.create_chat_message(request, data)
+        # 非同期パイプラインで回答を生成する（ストリーミング中にスレッドを占有しない）
+        response = await chat_message_controller.acreate_chat_message(request, data)
         logger.info(
             f"'/chat_messages' (POST) 処理完了 (StreamingResponse開始): chat_room_id={data.chat_room_id}"
         )
@@ -296,6 +298,38 @@ def create(request: Request, data: CreateChatMessageRequest):
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+@router.post("/chat_messages/{message_id}/regenerate")
+@requires_role("user", "admin")
+async def regenerate(
+    request: Request, message_id: str, data: RegenerateChatMessageRequest
+):
+    logger.debug(
+        f"'/chat_messages/{{message_id}}/regenerate' (POST) リクエスト受信: message_id={message_id}, model={data.model}"
+    )
+    try:
+        # 保存済みの情報源を使用し、回答生成のみを再実行する
+        response = await chat_message_controller.aregenerate_chat_message(
+            request, message_id, data
+        )
+        logger.info(
+            f"'/chat_messages/{{message_id}}/regenerate' (POST) 処理完了 (StreamingResponse開始): message_id={message_id}"
+        )
+        return response
+    except HTTPException as e:
+        logger.log(
+            logging.WARNING if e.status_code < 500 else logging.ERROR,
+            f"'/chat_messages/{{message_id}}/regenerate' (POST) HTTPException: message_id={message_id}, status_code={e.status_code}, detail='{e.detail}'",
+        )
+        raise e
+    except Exception as e:
+        log_exception(
+            logger,
+            e,
+            f"'/chat_messages/{{message_id}}/regenerate' (POST) 予期せぬエラー: message_id={message_id}",
+        )
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
 # メッセージ評価
 
 
@@ -31,9 +31,14 @@ class BaseTable(Base):
         nullable=False,
     )
 
+    # serialize() に含めないカラム
+    serialize_exclude: tuple[str, ...] = ()
+
     def serialize(self):
         data = {
-            column.name: getattr(self, column.name) for column in self.__table__.columns
+            column.name: getattr(self, column.name)
+            for column in self.__table__.columns
+            if column.name not in self.serialize_exclude
         }
         for key, value in data.items():
             if isinstance(value, datetime):
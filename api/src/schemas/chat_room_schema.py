@@ -1,6 +1,6 @@
 # chat_room_schema.py
 
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, String, Text
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Text
 
 from .base import BaseTable
 
@@ -20,4 +20,7 @@ class ChatRoomTable(BaseTable):
     name = Column(String(255), nullable=False)
     custom_prompt = Column(Text, nullable=True)
     is_active_custom_prompt = Column(Boolean, nullable=True)
+    # 会話の要約と、要約に取り込み済みのメッセージ数（作成日時の順で先頭から）
+    summary = Column(Text, nullable=True)
+    summary_message_count = Column(Integer, nullable=True)
     deleted_at = Column(DateTime, nullable=True)
@@ -1,6 +1,17 @@
 # message_schema.py
 
-from sqlalchemy import JSON, Column, DateTime, Enum, ForeignKey, Integer, String, Text
+from sqlalchemy import (
+    JSON,
+    Column,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+)
+from sqlalchemy.orm import deferred
 
 from .base import BaseTable
 
@@ -15,6 +26,8 @@ class MessageTable(BaseTable):
     """
 
     __tablename__ = "chat_messages"
+    # チャットルームごとの直近のメッセージの取得（会話履歴のウィンドウ）に使用する
+    __table_args__ = (Index("chat_room_id_created_at", "chat_room_id", "created_at"),)
 
     chat_room_id = Column(String(26), ForeignKey("chat_rooms.id"), nullable=False)
     role = Column(Enum("user", "assistant", name="role_enum"), nullable=False)
@@ -28,5 +41,12 @@ class MessageTable(BaseTable):
     assistant_prompt = Column(Text, nullable=True)
     model = Column(String(50), default="gpt-4o-mini", nullable=False)
     token_usage = Column(Integer, nullable=True)
+    token_count = Column(Integer, nullable=True)  # メッセージ本文のトークン数
     deleted_at = Column(DateTime, nullable=True)
     index_types = Column(JSON, nullable=True)  # JSON型として保存
+    # 回答生成に使用した情報源（チャンクのIDと本文など）。回答の再生成時に検索を省略するために使用する
+    # サイズが大きいため、明示的に参照した場合のみ読み込む
+    retrieval_context = deferred(Column(JSON, nullable=True))
+
+    # 情報源はクライアントに返さない
+    serialize_exclude = ("retrieval_context",)
@@ -0,0 +1,268 @@
+"""
+セマンティック回答キャッシュ
+
+同じインデックスの組み合わせ・同じカスタムプロンプトに対する意味的に同一の質問に、
+保存済みの回答と参照情報を再利用する。質問の同一性は質問文の埋め込みベクトルの
+コサイン類似度で判定する。
+
+エントリには保存時のインデックスごとのバージョンを記録し、参照時のバージョンと異なるエントリは使用しない。
+REDIS_HOST が設定されている場合、バージョンはRedisで管理し、ジョブや別のワーカーでのインデックスの更新も反映する。
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+import redis
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AnswerCacheEntry:
+    """キャッシュされた回答"""
+
+    query: str
+    vector: np.ndarray  # 正規化済みの質問ベクトル
+    answer: str
+    references: list[Any]
+    index_types: tuple[str, ...]
+    versions: tuple[int, ...]  # 保存時の index_types ごとのバージョン
+    expires_at: float
+
+
+class SemanticAnswerCache:
+    """
+    質問ベクトルの類似度で検索するスレッドセーフな回答キャッシュ
+
+    エントリは「インデックスの組み合わせ + カスタムプロンプトのハッシュ + モデル」の
+    スコープごとに保持し、スコープ内で類似度が閾値以上の最も近いエントリを返す。
+    """
+
+    KEY_PREFIX = "answer_cache"
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.97,
+        ttl_seconds: float = 3600,
+        max_entries_per_scope: int = 256,
+        redis_client: Any | None = None,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_scope = max_entries_per_scope
+        self.redis_client = redis_client
+        self._scopes: dict[tuple, list[AnswerCacheEntry]] = {}
+        self._versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.redis_errors = 0
+
+    @staticmethod
+    def make_scope(
+        index_types: list[str], custom_prompt: str = "", model: str = ""
+    ) -> tuple:
+        prompt_hash = hashlib.sha256((custom_prompt or "").encode("utf-8")).hexdigest()
+        return (tuple(sorted(set(index_types))), prompt_hash, model)
+
+    def index_versions(self, index_types: list[str]) -> tuple[int, ...]:
+        """インデックスの組み合わせ（ソート済み）のそれぞれの現在のバージョンを取得する"""
+        index_types = sorted(set(index_types))
+        if self.redis_client is not None:
+            try:
+                raws = self.redis_client.mget(
+                    [self._version_key(index_type) for index_type in index_types]
+                )
+                return tuple(int(raw) if raw is not None else 0 for raw in raws)
+            except Exception as e:
+                self._record_redis_error(e)
+        with self._lock:
+            return tuple(
+                self._versions.get(index_type, 0) for index_type in index_types
+            )
+
+    async def aindex_versions(self, index_types: list[str]) -> tuple[int, ...]:
+        """index_versions の非同期版（Redisの操作はスレッドプールで実行し、イベントループを止めない）"""
+        if self.redis_client is None:
+            return self.index_versions(index_types)
+        return await run_in_threadpool(self.index_versions, index_types)
+
+    def lookup(
+        self,
+        query_vector: list[float],
+        index_types: list[str],
+        custom_prompt: str = "",
+        model: str = "",
+        versions: tuple[int, ...] | None = None,
+    ) -> AnswerCacheEntry | None:
+        """
+        類似度が閾値以上のキャッシュ済み回答を検索する
+
+        versions（index_versions の戻り値）と異なるバージョンで保存されたエントリは使用しない。
+        未指定の場合は現在のバージョンを取得する。
+        """
+        scope = self.make_scope(index_types, custom_prompt, model)
+        if versions is None:
+            versions = self.index_versions(index_types)
+        vector = _normalize(query_vector)
+        now = time.monotonic()
+
+        with self._lock:
+            entries = [
+                e
+                for e in self._scopes.get(scope, [])
+                if e.expires_at > now and e.versions == versions
+            ]
+            if entries:
+                self._scopes[scope] = entries
+            else:
+                self._scopes.pop(scope, None)
+
+            best_entry = None
+            if entries:
+                similarities = np.stack([e.vector for e in entries]) @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    best_entry = entries[best]
+
+            if best_entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return best_entry
+
+    def store(
+        self,
+        query: str,
+        query_vector: list[float],
+        index_types: list[str],
+        answer: str,
+        references: list[Any],
+        custom_prompt: str = "",
+        model: str = "",
+        versions: tuple[int, ...] | None = None,
+    ):
+        """
+        回答をキャッシュに保存する
+
+        versions には回答の生成に使用した検索の前に取得したバージョンを指定する
+        （生成中にインデックスが更新された場合、その回答は参照されない）。
+        """
+        scope = self.make_scope(index_types, custom_prompt, model)
+        if versions is None:
+            versions = self.index_versions(index_types)
+        entry = AnswerCacheEntry(
+            query=query,
+            vector=_normalize(query_vector),
+            answer=answer,
+            references=list(references),
+            index_types=scope[0],
+            versions=versions,
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+        with self._lock:
+            entries = self._scopes.setdefault(scope, [])
+            entries.append(entry)
+            # 上限を超えた場合は古いものから削除する
+            del entries[: max(len(entries) - self.max_entries_per_scope, 0)]
+
+    def invalidate_index(self, index_type: str) -> int:
+        """
+        インデックスのバージョンを更新し、指定したインデックスを含むスコープのエントリを全て削除する
+
+        Redisのバージョンも更新するため、別のプロセスのキャッシュ済みの回答も参照されなくなる。
+        """
+        with self._lock:
+            self._versions[index_type] = self._versions.get(index_type, 0) + 1
+            scopes = [scope for scope in self._scopes if index_type in scope[0]]
+            removed = sum(len(self._scopes.pop(scope)) for scope in scopes)
+            self.invalidations += removed
+        if self.redis_client is not None:
+            try:
+                self.redis_client.incr(self._version_key(index_type))
+            except Exception as e:
+                self._record_redis_error(e)
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._scopes.clear()
+
+    def stats(self) -> dict[str, Any]:
+        """統計情報を取得する"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "invalidations": self.invalidations,
+                "scopes": len(self._scopes),
+                "size": sum(len(entries) for entries in self._scopes.values()),
+                "similarity_threshold": self.similarity_threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "redis_enabled": self.redis_client is not None,
+                "redis_errors": self.redis_errors,
+            }
+
+    def _version_key(self, index_type: str) -> str:
+        return f"{self.KEY_PREFIX}:version:{index_type}"
+
+    def _record_redis_error(self, error: Exception):
+        with self._lock:
+            self.redis_errors += 1
+        logger.warning(f"回答キャッシュ(Redis)の操作に失敗しました: {error}")
+
+
+def _normalize(vector: list[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+_answer_cache: SemanticAnswerCache | None = None
+_answer_cache_lock = threading.Lock()
+
+
+def is_answer_cache_enabled() -> bool:
+    return os.environ.get("ANSWER_CACHE_ENABLED", "false").lower() == "true"
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """プロセス共通の回答キャッシュを取得する"""
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                redis_client = None
+                # バージョンのRedis管理は REDIS_HOST が設定されている場合のみ有効にする
+                if os.environ.get("REDIS_HOST"):
+                    try:
+                        redis_client = redis.Redis(
+                            host=os.environ["REDIS_HOST"],
+                            port=int(os.environ.get("REDIS_PORT", 6379)),
+                            socket_timeout=0.5,
+                        )
+                    except Exception:
+                        logger.warning(
+                            "Redis接続に失敗しました。回答キャッシュのバージョンはローカルのみで管理します。"
+                        )
+                _answer_cache = SemanticAnswerCache(
+                    similarity_threshold=float(
+                        os.environ.get("ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.97)
+                    ),
+                    ttl_seconds=float(os.environ.get("ANSWER_CACHE_TTL_SECONDS", 3600)),
+                    max_entries_per_scope=int(
+                        os.environ.get("ANSWER_CACHE_MAX_ENTRIES_PER_SCOPE", 256)
+                    ),
+                    redis_client=redis_client,
+                )
+    return _answer_cache
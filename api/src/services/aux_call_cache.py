@@ -0,0 +1,129 @@
+"""
+補助的なLLM呼び出し（仮説回答・検索クエリの生成）の結果のメモ化
+
+「ルート名 + ルートの設定 + プロンプトのバージョン + メッセージ（会話履歴・質問）のハッシュ」をキーに、
+同一の入力に対する生成結果を再利用する。再生成や、多くのユーザーが同じ最初の質問をした場合の
+呼び出しを省略する。
+
+プロンプトのバージョンは config.toml のプロンプトなどのテンプレートのハッシュで、
+テンプレートを変更するとキーが変わるため、変更前の結果は参照されなくなる（古いエントリはLRUとTTLで削除される）。
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
+
+from src.services.cache import LRUCache
+
+T = TypeVar("T")
+
+
+def prompt_version(*templates: str) -> str:
+    """プロンプトのテンプレートからバージョン（ハッシュ）を作成する"""
+    digest = hashlib.sha256()
+    for template in templates:
+        digest.update((template or "").encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:12]
+
+
+class AuxCallCache:
+    """ルートごとのヒット・ミス件数を記録する補助的なLLM呼び出しのメモ化キャッシュ"""
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 600):
+        self.local = LRUCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self._routes: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def make_key(
+        self,
+        route_name: str,
+        version: str,
+        messages: list[dict[str, Any]],
+        **params: Any,
+    ) -> str:
+        """
+        キャッシュキーを作成する。
+
+        Args:
+            route_name (str): ルート名
+            version (str): プロンプトのバージョン
+            messages (list[dict]): LLMに渡すメッセージ（会話履歴・質問を含む）
+            **params: デプロイ名や max_tokens など、生成結果に影響するパラメータ
+        """
+        payload = json.dumps(
+            {"messages": messages, "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        digest = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        return f"{route_name}:{version}:{digest}"
+
+    def get_or_call(self, route_name: str, key: str, fn: Callable[[], T]) -> T:
+        """キャッシュ済みの結果を返す。未キャッシュの場合は fn を呼び出して保存する。"""
+        result = self.local.get(key)
+        self._record(route_name, key, result is not None)
+        if result is None:
+            result = fn()
+            self.local.set(key, result)
+        return copy.copy(result)
+
+    async def aget_or_call(
+        self, route_name: str, key: str, fn: Callable[[], Awaitable[T]]
+    ) -> T:
+        """get_or_call の非同期版（fn はコルーチン関数）"""
+        result = self.local.get(key)
+        self._record(route_name, key, result is not None)
+        if result is None:
+            result = await fn()
+            self.local.set(key, result)
+        return copy.copy(result)
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self) -> dict[str, Any]:
+        """統計情報を取得する"""
+        stats = self.local.stats()
+        stats["ttl_seconds"] = self.local.ttl_seconds
+        with self._lock:
+            stats["routes"] = {
+                name: dict(route) for name, route in self._routes.items()
+            }
+        return stats
+
+    def _record(self, route_name: str, key: str, hit: bool):
+        with self._lock:
+            route = self._routes.setdefault(
+                route_name, {"hits": 0, "misses": 0, "prompt_version": ""}
+            )
+            route["hits" if hit else "misses"] += 1
+            route["prompt_version"] = key.split(":")[1]
+
+
+_aux_call_cache: AuxCallCache | None = None
+_aux_call_cache_lock = threading.Lock()
+
+
+def is_aux_call_cache_enabled() -> bool:
+    return os.environ.get("AUX_CALL_CACHE_ENABLED", "false").lower() == "true"
+
+
+def get_aux_call_cache() -> AuxCallCache:
+    """プロセス共通の補助的なLLM呼び出しのキャッシュを取得する"""
+    global _aux_call_cache
+    if _aux_call_cache is None:
+        with _aux_call_cache_lock:
+            if _aux_call_cache is None:
+                _aux_call_cache = AuxCallCache(
+                    max_size=int(os.environ.get("AUX_CALL_CACHE_MAX_SIZE", 1024)),
+                    ttl_seconds=float(
+                        os.environ.get("AUX_CALL_CACHE_TTL_SECONDS", 600)
+                    ),
+                )
+    return _aux_call_cache
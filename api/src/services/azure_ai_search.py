@@ -6,9 +6,15 @@ from typing import Any
 from azure.core.credentials import AzureKeyCredential
 from azure.core.exceptions import HttpResponseError
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.search.documents.indexes import SearchIndexClient
 
 from src.config.azure_config import get_search_config
+from src.services.hedging import hedged_call
+from src.services.search_result_cache import (
+    get_search_result_cache,
+    is_search_result_cache_enabled,
+)
 
 # ロガーの設定
 logger = logging.getLogger(__name__)
@@ -147,6 +153,31 @@ class AzureAISearch:
             logger.error(f"APIキー詳細: {self.search_api_key[:10]}...")
             raise Exception(f"Search client initialization failed: {str(e)}")
 
+    def init_async_search_client(
+        self, index_name: str | None = None
+    ) -> AsyncSearchClient:
+        """
+        非同期の検索クライアントを初期化
+
+        Args:
+            index_name (Optional[str]): インデックス名（指定しない場合はデフォルト）
+
+        Returns:
+            AsyncSearchClient: 検索実行用の非同期クライアント（async with で使用すること）
+        """
+        target_index = index_name or self.default_index_name
+        try:
+            return AsyncSearchClient(
+                endpoint=self.search_endpoint,
+                index_name=target_index,
+                credential=AzureKeyCredential(self.search_api_key),
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to initialize async search client for index {target_index}: {str(e)}"
+            )
+            raise Exception(f"Async search client initialization failed: {str(e)}")
+
     def search_documents(
         self,
         query: str,
@@ -170,6 +201,56 @@ class AzureAISearch:
         Returns:
             Dict[str, Any]: 検索結果
         """
+        if is_search_result_cache_enabled():
+            target_index = index_name or self.default_index_name
+            search_params = {
+                "query": query,
+                "filters": filters,
+                "top": top,
+                "include_total_count": include_total_count,
+                **kwargs,
+            }
+            # 検索結果の dict を1件のエントリとしてキャッシュする
+            return get_search_result_cache().get_or_search(
+                target_index,
+                search_params,
+                lambda: [
+                    self._hedged_search_documents(
+                        query, filters, top, include_total_count, index_name, **kwargs
+                    )
+                ],
+            )[0]
+        return self._hedged_search_documents(
+            query, filters, top, include_total_count, index_name, **kwargs
+        )
+
+    def _hedged_search_documents(
+        self,
+        query: str,
+        filters: str | None,
+        top: int,
+        include_total_count: bool,
+        index_name: str | None,
+        **kwargs,
+    ) -> dict[str, Any]:
+        # 検索は冪等なため、応答が遅い場合はヘッジリクエストを送信する
+        target_index = index_name or self.default_index_name
+        return hedged_call(
+            f"search:{target_index}",
+            lambda: self._search_documents(
+                query, filters, top, include_total_count, index_name, **kwargs
+            ),
+        )
+
+    def _search_documents(
+        self,
+        query: str,
+        filters: str | None,
+        top: int,
+        include_total_count: bool,
+        index_name: str | None,
+        **kwargs,
+    ) -> dict[str, Any]:
         search_client = self.init_search_client(index_name)
 
         try:
@@ -243,6 +324,9 @@ class AzureAISearch:
             logger.info(
                 f"Document upload completed: {succeeded} succeeded, {failed} failed"
             )
+            get_search_result_cache().bump_version(
+                index_name or self.default_index_name
+            )
 
             return {
                 "status": "completed",
@@ -289,6 +373,9 @@ class AzureAISearch:
             logger.info(
                 f"Document deletion completed: {succeeded} succeeded, {failed} failed"
             )
+            get_search_result_cache().bump_version(
+                index_name or self.default_index_name
+            )
 
             return {
                 "status": "completed",
@@ -13,6 +13,9 @@ from openai import AzureOpenAI as AOAI
 from openai.types.chat import ChatCompletion
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+from src.services.embedding_cache import get_embedding_cache
+from src.services.hedging import hedged_call
+
 
 class StreamingMode(Enum):
     """ストリーミングモードの種類"""
@@ -424,8 +427,12 @@ class AzureOpenAI:
             self.logger.info(f"Creating embedding - model: {model}")
 
             client = self.init_client()
+            # 埋め込みの作成は冪等なため、応答が遅い場合はヘッジリクエストを送信する
+            # （ヘッジするのは1回のリクエストのみで、再試行の待機時間はレイテンシに含めない）
             response = self._make_request_with_retry(
-                client.embeddings.create, model=model, input=input_text
+                hedged_call,
+                f"embedding-service:{model}",
+                lambda: client.embeddings.create(model=model, input=input_text),
             )
 
             # Update metrics
@@ -489,4 +496,5 @@ class AzureOpenAI:
                 ),
             },
             "metrics": self.get_metrics(),
+            "embedding_cache": get_embedding_cache().stats(),
         }
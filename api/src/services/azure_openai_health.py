@@ -9,7 +9,16 @@ import time
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import JSONResponse
 
+from src.services.answer_cache import get_answer_cache, is_answer_cache_enabled
+from src.services.aux_call_cache import get_aux_call_cache, is_aux_call_cache_enabled
 from src.services.azure_openai import AzureOpenAI
+from src.services.embedding_cache import get_embedding_cache
+from src.services.hedging import get_hedging_policy, is_hedging_enabled
+from src.services.model_routing import get_model_routing_policy
+from src.services.search_result_cache import (
+    get_search_result_cache,
+    is_search_result_cache_enabled,
+)
 
 # Router setup
 router = APIRouter(prefix="/health/azure-openai", tags=["health", "monitoring"])
@@ -392,6 +401,91 @@ async def get_rate_limit_status(client: AzureOpenAI = Depends(get_production_cli
         )
 
 
+@router.get("/cache/status")
+async def get_cache_status():
+    """
+    Get hit/miss statistics of the embedding, answer, search result and auxiliary LLM call caches
+
+    Returns:
+        Dict containing statistics for each cache
+    """
+    try:
+        cache_info = {
+            "embedding_cache": get_embedding_cache().stats(),
+            "answer_cache": {
+                "enabled": is_answer_cache_enabled(),
+                **get_answer_cache().stats(),
+            },
+            "search_result_cache": {
+                "enabled": is_search_result_cache_enabled(),
+                **get_search_result_cache().stats(),
+            },
+            "aux_call_cache": {
+                "enabled": is_aux_call_cache_enabled(),
+                **get_aux_call_cache().stats(),
+            },
+            "timestamp": time.time(),
+            "service": "azure-openai",
+        }
+
+        return JSONResponse(content=cache_info, status_code=200)
+
+    except Exception as e:
+        logger.error(f"Cache status check failed: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Cache status check failed: {str(e)}"
+        )
+
+
+@router.get("/routing/status")
+async def get_routing_status():
+    """
+    Get per-route deployment and latency statistics of auxiliary LLM calls
+
+    Returns:
+        Dict containing statistics for each route
+    """
+    try:
+        routing_info = {
+            "routes": get_model_routing_policy().stats(),
+            "timestamp": time.time(),
+            "service": "azure-openai",
+        }
+
+        return JSONResponse(content=routing_info, status_code=200)
+
+    except Exception as e:
+        logger.error(f"Routing status check failed: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Routing status check failed: {str(e)}"
+        )
+
+
+@router.get("/hedging/status")
+async def get_hedging_status():
+    """
+    Get per-target latency and hedged request statistics of search and embedding calls
+
+    Returns:
+        Dict containing statistics for each target
+    """
+    try:
+        hedging_info = {
+            "enabled": is_hedging_enabled(),
+            **get_hedging_policy().stats(),
+            "timestamp": time.time(),
+            "service": "azure-openai",
+        }
+
+        return JSONResponse(content=hedging_info, status_code=200)
+
+    except Exception as e:
+        logger.error(f"Hedging status check failed: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Hedging status check failed: {str(e)}"
+        )
+
+
 # Prometheus metrics endpoint
 @router.get("/prometheus")
 async def get_prometheus_metrics():
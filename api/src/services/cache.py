@@ -0,0 +1,105 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable
+from dataclasses import asdict, dataclass
+from typing import Any
+
+
+@dataclass
+class CacheStats:
+    """キャッシュの統計情報"""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    size: int = 0
+    max_size: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        stats = asdict(self)
+        stats["hit_ratio"] = round(self.hit_ratio, 4)
+        return stats
+
+
+class LRUCache:
+    """
+    スレッドセーフなインプロセスLRUキャッシュ
+
+    主な機能:
+    - 最大件数によるLRU方式の追い出し
+    - エントリごとのTTL（ttl_seconds が None の場合は無期限）
+    - ヒット/ミス/追い出し件数の記録
+    """
+
+    def __init__(self, max_size: int = 1024, ttl_seconds: float | None = None):
+        if max_size <= 0:
+            raise ValueError("max_size は1以上を指定してください")
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: OrderedDict[Hashable, tuple[Any, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = CacheStats(max_size=max_size)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """キーに対応する値を取得する。存在しないか期限切れの場合は default を返す"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats.misses += 1
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self._stats.expirations += 1
+                self._stats.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self._stats.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: float | None = None):
+        """値を保存する。ttl_seconds を省略した場合はキャッシュ既定のTTLを使う"""
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._stats.evictions += 1
+
+    def delete(self, key: Hashable) -> bool:
+        """キーを削除する。削除した場合は True を返す"""
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        """全エントリを削除する"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and (
+                entry[1] is None or entry[1] > time.monotonic()
+            )
+
+    def stats(self) -> dict[str, Any]:
+        """統計情報を取得する"""
+        with self._lock:
+            self._stats.size = len(self._data)
+            return self._stats.to_dict()
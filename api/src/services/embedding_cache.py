@@ -0,0 +1,250 @@
+"""
+埋め込みベクトルのキャッシュ
+
+インプロセスのLRUキャッシュと、REDIS_HOST が設定されている場合に有効になる
+Redisキャッシュの2層構成で、同一テキストの埋め込みAPI呼び出しを省略する。
+
+検索時の質問（仮説回答など）の埋め込みを対象とする。インデックス作成時のチャンクの埋め込みは
+差分のインデックスで変更されたチャンクのみが対象となりキャッシュにヒットしないため、キャッシュを経由しない。
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import numpy as np
+import redis
+from fastapi.concurrency import run_in_threadpool
+
+from src.services.cache import LRUCache
+from src.services.hedging import ahedged_call, hedged_call
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """キャッシュキー用にテキストを正規化する（NFKC正規化・空白の圧縮）"""
+    return _WHITESPACE_PATTERN.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class EmbeddingCache:
+    """
+    埋め込みベクトルの2層キャッシュ
+
+    キーは「デプロイ名 + 正規化テキストのハッシュ」で、
+    ローカルLRU → Redis の順に参照し、Redisでヒットした場合はローカルにも保存する。
+    ローカルLRUにはベクトルを float32 の配列で保持し、メモリ使用量を抑える（取得時にリストに変換する）。
+    """
+
+    KEY_PREFIX = "embedding_cache"
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        redis_client: Any | None = None,
+        redis_ttl_seconds: int = 7 * 24 * 3600,
+    ):
+        self.local = LRUCache(max_size=max_size)
+        self.redis_client = redis_client
+        self.redis_ttl_seconds = redis_ttl_seconds
+        self._lock = threading.Lock()
+        self.redis_hits = 0
+        self.redis_errors = 0
+
+    def make_key(self, text: str, model: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.KEY_PREFIX}:{model}:{digest}"
+
+    def get(self, text: str, model: str) -> list[float] | None:
+        """キャッシュ済みの埋め込みベクトルを取得する"""
+        key = self.make_key(text, model)
+        vector = self.local.get(key)
+        if vector is not None:
+            return vector.tolist()
+
+        raw = self._redis_get(key)
+        if raw is None:
+            return None
+        with self._lock:
+            self.redis_hits += 1
+        vector = np.frombuffer(raw, dtype=np.float32)
+        self.local.set(key, vector)
+        return vector.tolist()
+
+    def set(self, text: str, model: str, vector: list[float]):
+        """埋め込みベクトルを保存する"""
+        key = self.make_key(text, model)
+        array_vector = np.asarray(vector, dtype=np.float32)
+        self.local.set(key, array_vector)
+        # float32のバイト列で保存し、JSONよりもサイズを抑える
+        self._redis_set(key, array_vector.tobytes())
+
+    def get_or_create(
+        self,
+        texts: list[str],
+        model: str,
+        embed_fn: Callable[[list[str]], list[list[float]]],
+    ) -> list[list[float]]:
+        """
+        キャッシュを参照し、未キャッシュのテキストのみ embed_fn でまとめて埋め込む。
+
+        Args:
+            texts (list[str]): 埋め込み対象のテキスト
+            model (str): 埋め込みモデルのデプロイ名
+            embed_fn: テキストのリストを受け取り、同じ順序でベクトルを返す関数
+
+        Returns:
+            list[list[float]]: texts と同じ順序の埋め込みベクトル
+        """
+        vectors, missing = self._lookup(texts, model)
+        if missing:
+            self._fill(vectors, missing, model, embed_fn(list(missing)))
+        return vectors
+
+    async def aget_or_create(
+        self,
+        texts: list[str],
+        model: str,
+        embed_fn: Callable[[list[str]], Awaitable[list[list[float]]]],
+    ) -> list[list[float]]:
+        """
+        get_or_create の非同期版（embed_fn はコルーチン関数）
+
+        Redisの操作はスレッドプールで実行し、Redisの応答が遅い場合もイベントループを止めない。
+        """
+        vectors, missing = await self._run_redis_io(self._lookup, texts, model)
+        if missing:
+            new_vectors = await embed_fn(list(missing))
+            await self._run_redis_io(self._fill, vectors, missing, model, new_vectors)
+        return vectors
+
+    async def _run_redis_io(self, fn: Callable, *args):
+        """Redis層が有効な場合はスレッドプールで、無効な場合（ローカルのみ）はそのまま実行する"""
+        if self.redis_client is None:
+            return fn(*args)
+        return await run_in_threadpool(fn, *args)
+
+    def _lookup(
+        self, texts: list[str], model: str
+    ) -> tuple[list[list[float] | None], dict[str, list[int]]]:
+        """キャッシュを参照し、ベクトルと未キャッシュのテキスト（→ 出現位置）を返す"""
+        vectors: list[list[float] | None] = [self.get(text, model) for text in texts]
+
+        # 同一テキストは1回だけ埋め込む
+        missing: dict[str, list[int]] = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(texts[i], []).append(i)
+        return vectors, missing
+
+    def _fill(
+        self,
+        vectors: list[list[float] | None],
+        missing: dict[str, list[int]],
+        model: str,
+        new_vectors: list[list[float]],
+    ):
+        for text, vector in zip(missing, new_vectors, strict=True):
+            self.set(text, model, vector)
+            for i in missing[text]:
+                vectors[i] = vector
+
+    def stats(self) -> dict[str, Any]:
+        """統計情報を取得する"""
+        stats = self.local.stats()
+        stats["redis_enabled"] = self.redis_client is not None
+        stats["redis_hits"] = self.redis_hits
+        stats["redis_errors"] = self.redis_errors
+        return stats
+
+    def _redis_get(self, key: str) -> bytes | None:
+        if self.redis_client is None:
+            return None
+        try:
+            return self.redis_client.get(key)
+        except Exception as e:
+            self._record_redis_error(e)
+            return None
+
+    def _redis_set(self, key: str, value: bytes):
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.setex(key, self.redis_ttl_seconds, value)
+        except Exception as e:
+            self._record_redis_error(e)
+
+    def _record_redis_error(self, error: Exception):
+        with self._lock:
+            self.redis_errors += 1
+        logger.warning(f"埋め込みキャッシュ(Redis)の操作に失敗しました: {error}")
+
+
+_embedding_cache: EmbeddingCache | None = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """プロセス共通の埋め込みキャッシュを取得する"""
+    global _embedding_cache
+    if _embedding_cache is None:
+        with _embedding_cache_lock:
+            if _embedding_cache is None:
+                redis_client = None
+                # Redis層は REDIS_HOST が設定されている場合のみ有効にする
+                if os.environ.get("REDIS_HOST"):
+                    try:
+                        redis_client = redis.Redis(
+                            host=os.environ["REDIS_HOST"],
+                            port=int(os.environ.get("REDIS_PORT", 6379)),
+                            socket_timeout=0.5,
+                        )
+                    except Exception:
+                        logger.warning(
+                            "Redis接続に失敗しました。埋め込みキャッシュはローカルのみで動作します。"
+                        )
+                _embedding_cache = EmbeddingCache(
+                    max_size=int(os.environ.get("EMBEDDING_CACHE_MAX_SIZE", 10000)),
+                    redis_client=redis_client,
+                    redis_ttl_seconds=int(
+                        os.environ.get("EMBEDDING_CACHE_TTL_SECONDS", 7 * 24 * 3600)
+                    ),
+                )
+    return _embedding_cache
+
+
+def create_embeddings_with_cache(
+    openai_client, texts: list[str], model: str
+) -> list[list[float]]:
+    """Azure OpenAIクライアントで埋め込みを作成する（キャッシュ経由）"""
+
+    def _embed(batch: list[str]) -> list[list[float]]:
+        response = hedged_call(
+            f"embedding-query:{model}",
+            lambda: openai_client.embeddings.create(input=batch, model=model),
+        )
+        return [item.embedding for item in response.data]
+
+    return get_embedding_cache().get_or_create(texts, model, _embed)
+
+
+async def acreate_embeddings_with_cache(
+    async_openai_client, texts: list[str], model: str
+) -> list[list[float]]:
+    """非同期のAzure OpenAIクライアントで埋め込みを作成する（キャッシュ経由）"""
+
+    async def _embed(batch: list[str]) -> list[list[float]]:
+        response = await ahedged_call(
+            f"embedding-query:{model}",
+            lambda: async_openai_client.embeddings.create(input=batch, model=model),
+        )
+        return [item.embedding for item in response.data]
+
+    return await get_embedding_cache().aget_or_create(texts, model, _embed)
@@ -0,0 +1,243 @@
+"""
+ヘッジリクエストによるテールレイテンシの削減
+
+冪等な読み取り専用の呼び出し（検索・埋め込み）について、最初のリクエストが対象ごとの
+直近のp95レイテンシを超えても完了しない場合に同じリクエストをもう1つ送信し、先に完了した方の
+結果を使用する。追加のリクエスト数は全リクエストの budget_ratio（既定5%）以内に制限する。
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, TypeVar
+
+import numpy as np
+
+T = TypeVar("T")
+
+
+class _TargetStats:
+    """対象ごとのレイテンシとヘッジの記録（レイテンシは直近 window 件）"""
+
+    def __init__(self, window: int):
+        self.samples: deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def p95_ms(self) -> float:
+        return float(np.percentile(np.fromiter(self.samples, dtype=np.float64), 95))
+
+    def to_dict(self) -> dict[str, Any]:
+        stats: dict[str, Any] = {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_ratio": round(self.hedges / self.requests, 4)
+            if self.requests
+            else 0.0,
+        }
+        if self.samples:
+            samples = np.fromiter(self.samples, dtype=np.float64)
+            stats.update(
+                {
+                    "p50_ms": round(float(np.percentile(samples, 50)), 1),
+                    "p95_ms": round(float(np.percentile(samples, 95)), 1),
+                }
+            )
+        return stats
+
+
+class HedgingPolicy:
+    """
+    対象（"search:インデックス名" など）ごとのレイテンシを記録し、ヘッジリクエストを送信するクラス
+
+    レイテンシのサンプルが min_samples 件に満たない対象はヘッジしない。
+    同期版の call はスレッドで実行するため、負けたリクエストは中断できず結果を破棄する。
+    非同期版の acall は負けたリクエストのタスクをキャンセルする。
+    """
+
+    def __init__(
+        self,
+        budget_ratio: float = 0.05,
+        min_samples: int = 20,
+        latency_window: int = 512,
+        max_workers: int = 16,
+    ):
+        self.budget_ratio = budget_ratio
+        self.min_samples = min_samples
+        self.latency_window = latency_window
+        self.max_workers = max_workers
+        self._targets: dict[str, _TargetStats] = {}
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+    def call(self, target: str, fn: Callable[[], T]) -> T:
+        """
+        fn を実行し、p95レイテンシを超えても完了しない場合はヘッジリクエストを送信する。
+
+        Args:
+            target (str): レイテンシを記録する対象の名前
+            fn: 冪等な呼び出し（結果を返すまでに通信が完了していること）
+        """
+        delay = self._begin(target)
+        if delay is None:
+            return self._timed(target, fn)
+
+        executor = self._get_executor()
+        primary = executor.submit(self._timed, target, fn)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._try_hedge(target):
+            return primary.result()
+
+        hedge = executor.submit(self._timed, target, fn)
+        return self._first_result(target, primary, hedge)
+
+    async def acall(self, target: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """call の非同期版（fn はコルーチン関数）"""
+        delay = self._begin(target)
+        if delay is None:
+            return await self._atimed(target, fn)
+
+        primary = asyncio.ensure_future(self._atimed(target, fn))
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done or not self._try_hedge(target):
+            return await primary
+
+        hedge = asyncio.ensure_future(self._atimed(target, fn))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._record_hedge_win(target)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict[str, Any]:
+        """対象ごとのレイテンシとヘッジの統計情報を取得する"""
+        with self._lock:
+            return {
+                "budget_ratio": self.budget_ratio,
+                "targets": {
+                    name: stats.to_dict() for name, stats in self._targets.items()
+                },
+            }
+
+    def _begin(self, target: str) -> float | None:
+        """リクエスト数を記録し、ヘッジまでの待ち時間（秒）を返す（ヘッジしない場合は None）"""
+        with self._lock:
+            stats = self._stats(target)
+            stats.requests += 1
+            if len(stats.samples) < self.min_samples:
+                return None
+            if stats.hedges + 1 > self.budget_ratio * stats.requests:
+                return None
+            return stats.p95_ms() / 1000
+
+    def _try_hedge(self, target: str) -> bool:
+        # 待機中に他のリクエストが予算を使用した場合はヘッジしない
+        with self._lock:
+            stats = self._stats(target)
+            if stats.hedges + 1 > self.budget_ratio * stats.requests:
+                return False
+            stats.hedges += 1
+            return True
+
+    def _first_result(self, target: str, primary: Future, hedge: Future):
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is hedge:
+                        self._record_hedge_win(target)
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _timed(self, target: str, fn: Callable[[], T]) -> T:
+        start = time.perf_counter()
+        result = fn()
+        self._record_latency(target, (time.perf_counter() - start) * 1000)
+        return result
+
+    async def _atimed(self, target: str, fn: Callable[[], Awaitable[T]]) -> T:
+        start = time.perf_counter()
+        result = await fn()
+        self._record_latency(target, (time.perf_counter() - start) * 1000)
+        return result
+
+    def _record_latency(self, target: str, elapsed_ms: float):
+        with self._lock:
+            self._stats(target).samples.append(elapsed_ms)
+
+    def _record_hedge_win(self, target: str):
+        with self._lock:
+            self._stats(target).hedge_wins += 1
+
+    def _stats(self, target: str) -> _TargetStats:
+        # 呼び出し元で self._lock を取得していること
+        stats = self._targets.get(target)
+        if stats is None:
+            stats = self._targets[target] = _TargetStats(self.latency_window)
+        return stats
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="hedging"
+                )
+            return self._executor
+
+
+_hedging_policy: HedgingPolicy | None = None
+_hedging_policy_lock = threading.Lock()
+
+
+def is_hedging_enabled() -> bool:
+    return os.environ.get("HEDGING_ENABLED", "false").lower() == "true"
+
+
+def get_hedging_policy() -> HedgingPolicy:
+    """プロセス共通のヘッジポリシーを取得する"""
+    global _hedging_policy
+    if _hedging_policy is None:
+        with _hedging_policy_lock:
+            if _hedging_policy is None:
+                _hedging_policy = HedgingPolicy(
+                    budget_ratio=float(os.environ.get("HEDGING_BUDGET_RATIO", 0.05)),
+                    min_samples=int(os.environ.get("HEDGING_MIN_SAMPLES", 20)),
+                )
+    return _hedging_policy
+
+
+def hedged_call(target: str, fn: Callable[[], T]) -> T:
+    """HEDGING_ENABLED が有効な場合はヘッジリクエスト付きで、無効な場合はそのまま fn を実行する"""
+    if not is_hedging_enabled():
+        return fn()
+    return get_hedging_policy().call(target, fn)
+
+
+async def ahedged_call(target: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """hedged_call の非同期版"""
+    if not is_hedging_enabled():
+        return await fn()
+    return await get_hedging_policy().acall(target, fn)
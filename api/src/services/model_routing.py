@@ -0,0 +1,153 @@
+"""
+補助的なLLM呼び出しのモデルルーティング
+
+仮説回答の生成や検索クエリの生成など、最終回答以外の補助的な呼び出しを
+ルートごとに設定されたデプロイ（小型・高速なモデルなど）と max_tokens で実行し、
+ルートごとのレイテンシを記録する。
+"""
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """ルートごとの呼び出し設定"""
+
+    deployment: str
+    max_tokens: int | None = None
+
+
+class _RouteLatency:
+    """ルートごとのレイテンシの記録（直近 window 件）"""
+
+    def __init__(self, window: int):
+        self.samples: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+
+    def to_dict(self) -> dict[str, Any]:
+        stats: dict[str, Any] = {"count": self.count, "errors": self.errors}
+        if self.samples:
+            samples = np.fromiter(self.samples, dtype=np.float64)
+            stats.update(
+                {
+                    "avg_ms": round(float(samples.mean()), 1),
+                    "p50_ms": round(float(np.percentile(samples, 50)), 1),
+                    "p95_ms": round(float(np.percentile(samples, 95)), 1),
+                }
+            )
+        return stats
+
+
+class ModelRoutingPolicy:
+    """
+    補助的なLLM呼び出しをルートごとのデプロイに振り分けるクラス
+
+    未登録のルートは default_deployment で max_tokens の制限なしに実行する。
+    """
+
+    def __init__(self, default_deployment: str = "", latency_window: int = 512):
+        self.default_deployment = default_deployment
+        self.latency_window = latency_window
+        self._routes: dict[str, ModelRoute] = {}
+        self._latencies: dict[str, _RouteLatency] = {}
+        self._lock = threading.Lock()
+
+    def register_route(self, name: str, route: ModelRoute):
+        """ルートを登録する（同名のルートは上書きする）"""
+        with self._lock:
+            self._routes[name] = route
+
+    def route(self, name: str) -> ModelRoute:
+        """ルートの設定を取得する"""
+        with self._lock:
+            return self._routes.get(name, ModelRoute(self.default_deployment))
+
+    def complete(self, openai_client, route_name: str, messages: list, **kwargs):
+        """
+        ルートの設定でチャット補完を実行し、レイテンシを記録する。
+
+        Args:
+            openai_client: Azure OpenAIクライアント
+            route_name (str): ルート名
+            messages (list): メッセージ
+            **kwargs: chat.completions.create に渡す追加のパラメータ
+        """
+        route = self.route(route_name)
+        if route.max_tokens is not None:
+            kwargs.setdefault("max_tokens", route.max_tokens)
+
+        start = time.perf_counter()
+        try:
+            response = openai_client.chat.completions.create(
+                model=route.deployment, messages=messages, **kwargs
+            )
+        except Exception:
+            self._record(route_name, None)
+            raise
+        self._record(route_name, (time.perf_counter() - start) * 1000)
+        return response
+
+    async def acomplete(
+        self, async_openai_client, route_name: str, messages: list, **kwargs
+    ):
+        """complete の非同期版（AsyncAzureOpenAIクライアントを使用する）"""
+        route = self.route(route_name)
+        if route.max_tokens is not None:
+            kwargs.setdefault("max_tokens", route.max_tokens)
+
+        start = time.perf_counter()
+        try:
+            response = await async_openai_client.chat.completions.create(
+                model=route.deployment, messages=messages, **kwargs
+            )
+        except Exception:
+            self._record(route_name, None)
+            raise
+        self._record(route_name, (time.perf_counter() - start) * 1000)
+        return response
+
+    def stats(self) -> dict[str, Any]:
+        """ルートごとの設定とレイテンシの統計情報を取得する"""
+        with self._lock:
+            stats = {}
+            for name in self._routes.keys() | self._latencies.keys():
+                route = self._routes.get(name, ModelRoute(self.default_deployment))
+                latency = self._latencies.get(name, _RouteLatency(0))
+                stats[name] = {
+                    "deployment": route.deployment,
+                    "max_tokens": route.max_tokens,
+                    **latency.to_dict(),
+                }
+            return stats
+
+    def _record(self, route_name: str, elapsed_ms: float | None):
+        with self._lock:
+            latency = self._latencies.setdefault(
+                route_name, _RouteLatency(self.latency_window)
+            )
+            latency.count += 1
+            if elapsed_ms is None:
+                latency.errors += 1
+            else:
+                latency.samples.append(elapsed_ms)
+
+
+_model_routing_policy: ModelRoutingPolicy | None = None
+_model_routing_policy_lock = threading.Lock()
+
+
+def get_model_routing_policy() -> ModelRoutingPolicy:
+    """プロセス共通のモデルルーティングポリシーを取得する"""
+    global _model_routing_policy
+    if _model_routing_policy is None:
+        with _model_routing_policy_lock:
+            if _model_routing_policy is None:
+                _model_routing_policy = ModelRoutingPolicy()
+    return _model_routing_policy
@@ -0,0 +1,216 @@
+"""
+Azure AI Searchの検索結果のキャッシュ
+
+「インデックス名 + インデックスのバージョン + 検索パラメータ（検索テキスト・ベクトルのハッシュ・
+select / top など）」をキーに、同一の検索リクエストの結果を再利用する。
+
+インデックスへのドキュメントの登録・削除時にインデックスのバージョンを更新することで、
+更新前の検索結果は参照されなくなる（古いエントリはLRUとTTLで削除される）。
+REDIS_HOST が設定されている場合、バージョンはRedisで管理し、ジョブなど別プロセスでの更新も反映する。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from array import array
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+import numpy as np
+import redis
+from fastapi.concurrency import run_in_threadpool
+
+from src.services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class SearchResultCache:
+    """
+    インデックスごとのバージョンで無効化する検索結果のキャッシュ
+
+    contentVector などのベクトルは float32 の配列として保持し、メモリ使用量を抑える。
+    """
+
+    KEY_PREFIX = "search_result_cache"
+
+    def __init__(
+        self,
+        max_size: int = 256,
+        ttl_seconds: float = 300,
+        redis_client: Any | None = None,
+    ):
+        self.local = LRUCache(max_size=max_size, ttl_seconds=ttl_seconds)
+        self.redis_client = redis_client
+        self._versions: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.invalidations = 0
+        self.redis_errors = 0
+
+    def version(self, index_name: str) -> int:
+        """インデックスの現在のバージョンを取得する"""
+        if self.redis_client is not None:
+            try:
+                raw = self.redis_client.get(self._version_key(index_name))
+                return int(raw) if raw is not None else 0
+            except Exception as e:
+                self._record_redis_error(e)
+        with self._lock:
+            return self._versions.get(index_name, 0)
+
+    def bump_version(self, index_name: str) -> int:
+        """インデックスのバージョンを更新し、そのインデックスのキャッシュ済みの検索結果を無効にする"""
+        with self._lock:
+            self.invalidations += 1
+            version = self._versions.get(index_name, 0) + 1
+            self._versions[index_name] = version
+        if self.redis_client is not None:
+            try:
+                return int(self.redis_client.incr(self._version_key(index_name)))
+            except Exception as e:
+                self._record_redis_error(e)
+        return version
+
+    def make_key(self, index_name: str, search_params: dict[str, Any]) -> str:
+        params = json.dumps(
+            _normalize_param(search_params), sort_keys=True, ensure_ascii=False
+        )
+        digest = hashlib.sha256(params.encode("utf-8")).hexdigest()
+        return f"{self.KEY_PREFIX}:{index_name}:{self.version(index_name)}:{digest}"
+
+    def get_or_search(
+        self,
+        index_name: str,
+        search_params: dict[str, Any],
+        search_fn: Callable[[], list[dict[str, Any]]],
+    ) -> list[dict[str, Any]]:
+        """
+        キャッシュ済みの検索結果を返す。未キャッシュの場合は search_fn で検索して保存する。
+
+        Args:
+            index_name (str): インデックス名
+            search_params (dict): 検索パラメータ（キャッシュキーに使用する）
+            search_fn: 検索結果（dictのリスト）を返す関数
+        """
+        key = self.make_key(index_name, search_params)
+        results = self.local.get(key)
+        if results is None:
+            results = _compact(search_fn())
+            self.local.set(key, results)
+        return [dict(result) for result in results]
+
+    async def aget_or_search(
+        self,
+        index_name: str,
+        search_params: dict[str, Any],
+        search_fn: Callable[[], Awaitable[list[dict[str, Any]]]],
+    ) -> list[dict[str, Any]]:
+        """
+        get_or_search の非同期版（search_fn はコルーチン関数）
+
+        Redisでのバージョンの取得はスレッドプールで実行し、Redisの応答が遅い場合もイベントループを止めない。
+        """
+        if self.redis_client is None:
+            key = self.make_key(index_name, search_params)
+        else:
+            key = await run_in_threadpool(self.make_key, index_name, search_params)
+        results = self.local.get(key)
+        if results is None:
+            results = _compact(await search_fn())
+            self.local.set(key, results)
+        return [dict(result) for result in results]
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self) -> dict[str, Any]:
+        """統計情報を取得する"""
+        stats = self.local.stats()
+        stats["ttl_seconds"] = self.local.ttl_seconds
+        stats["invalidations"] = self.invalidations
+        stats["redis_enabled"] = self.redis_client is not None
+        stats["redis_errors"] = self.redis_errors
+        with self._lock:
+            stats["index_versions"] = dict(self._versions)
+        return stats
+
+    def _version_key(self, index_name: str) -> str:
+        return f"{self.KEY_PREFIX}:version:{index_name}"
+
+    def _record_redis_error(self, error: Exception):
+        with self._lock:
+            self.redis_errors += 1
+        logger.warning(f"検索結果キャッシュ(Redis)の操作に失敗しました: {error}")
+
+
+def _normalize_param(value: Any) -> Any:
+    """検索パラメータをキャッシュキー用のJSONに変換できる形式にする（ベクトルはハッシュにする）"""
+    if hasattr(value, "as_dict"):
+        # VectorizedQuery などのSDKのモデル
+        value = value.as_dict()
+    if isinstance(value, dict):
+        return {
+            key: _vector_digest(item) if key == "vector" else _normalize_param(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list | tuple):
+        return [_normalize_param(item) for item in value]
+    if value is None or isinstance(value, str | int | float | bool):
+        return value
+    return str(value)
+
+
+def _vector_digest(vector: list[float]) -> str:
+    return hashlib.sha256(array("f", vector).tobytes()).hexdigest()
+
+
+def _compact(results: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    # ベクトル（floatのリスト）は float32 の配列で保持する
+    return [
+        {
+            key: np.asarray(value, dtype=np.float32)
+            if key == "contentVector" and value is not None
+            else value
+            for key, value in result.items()
+        }
+        for result in results
+    ]
+
+
+_search_result_cache: SearchResultCache | None = None
+_search_result_cache_lock = threading.Lock()
+
+
+def is_search_result_cache_enabled() -> bool:
+    return os.environ.get("SEARCH_RESULT_CACHE_ENABLED", "false").lower() == "true"
+
+
+def get_search_result_cache() -> SearchResultCache:
+    """プロセス共通の検索結果キャッシュを取得する"""
+    global _search_result_cache
+    if _search_result_cache is None:
+        with _search_result_cache_lock:
+            if _search_result_cache is None:
+                redis_client = None
+                # バージョンのRedis管理は REDIS_HOST が設定されている場合のみ有効にする
+                if os.environ.get("REDIS_HOST"):
+                    try:
+                        redis_client = redis.Redis(
+                            host=os.environ["REDIS_HOST"],
+                            port=int(os.environ.get("REDIS_PORT", 6379)),
+                            socket_timeout=0.5,
+                        )
+                    except Exception:
+                        logger.warning(
+                            "Redis接続に失敗しました。検索結果キャッシュのバージョンはローカルのみで管理します。"
+                        )
+                _search_result_cache = SearchResultCache(
+                    max_size=int(os.environ.get("SEARCH_RESULT_CACHE_MAX_SIZE", 256)),
+                    ttl_seconds=float(
+                        os.environ.get("SEARCH_RESULT_CACHE_TTL_SECONDS", 300)
+                    ),
+                    redis_client=redis_client,
+                )
+    return _search_result_cache
@@ -1,8 +1,27 @@
+import threading
+
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 
-from src.internal.searcher import semantic_hybrid_search
-from src.models import Message
+from src.internal.searcher import (
+    CONVERSATION_SUMMARY_ENABLED,
+    SERVER_HISTORY_ENABLED,
+    ChatHistoryItem,
+    aregenerate_answer,
+    asemantic_hybrid_search,
+    conversation_memory,
+    summarize_conversation,
+)
+from src.internal.stream_protocol import (
+    DONE,
+    ERROR,
+    StreamEncoder,
+    StreamEvent,
+    default_stream_format,
+)
+from src.internal.token_counter import get_token_accountant
 from src.repositories import (
     ChatRoomRepository,
     MessageRepository,
@@ -10,6 +29,10 @@ from src.repositories import (
 )
 from src.services.db import get_session
 
+# 要約を更新中のチャットルーム（同じチャットルームの要約を同時に更新しない）
+_summarizing_chat_room_ids: set[str] = set()
+_summarizing_lock = threading.Lock()
+
 
 class ManageChatMessageUsecase:
     def __init__(
@@ -19,7 +42,7 @@ class ManageChatMessageUsecase:
         self.chat_room_repository = ChatRoomRepository()
         self.search_index_type_repository = SearchIndexTypeRepository()
 
-    def create_chat_message(
+    async def acreate_chat_message(
         self,
         user_id,
         chat_room_id,
@@ -30,8 +53,258 @@ class ManageChatMessageUsecase:
         model,
         index_type,
         chat_history,
-    ) -> Message:
-        print("\033[31m" + "ユースケース実行" + "\033[0m")
+        stream_format=None,
+    ) -> StreamingResponse:
+        """
+        チャットメッセージを作成し、回答をストリーミングで返す。
+
+        検索・回答生成は非同期クライアントで行い、同期のDBアクセスのみスレッドプールで実行する。
+        ストリーミング中はスレッドを占有しない。
+
+        stream_format が "sse" の場合は delta / references / usage / error / done の
+        Server-Sent Eventsで、"legacy" の場合は従来のテキスト形式で返す。
+        """
+        encoder = StreamEncoder(stream_format or default_stream_format())
+        server_chat_history = await run_in_threadpool(
+            self._save_user_message,
+            user_id,
+            chat_room_id,
+            message,
+            references,
+            assistant_prompt,
+            is_active_assistant_prompt,
+            model,
+            index_type,
+        )
+        if server_chat_history is not None:
+            chat_history = server_chat_history
+        try:
+            (
+                stream_generator,
+                get_full_content,
+                references,
+                get_token_usage,
+                retrieval_context,
+            ) = await asemantic_hybrid_search(
+                query=message,
+                index_type_list=index_type,
+                custom_prompt=assistant_prompt,
+                is_active_custom_prompt=is_active_assistant_prompt,
+                model=model,
+                history=chat_history or [],
+            )
+        except RuntimeError as e:
+            await run_in_threadpool(
+                self._save_assistant_message,
+                {
+                    "chat_room_id": chat_room_id,
+                    "role": "assistant",
+                    "message": str(e),
+                    "assistant_prompt": assistant_prompt,
+                    "model": model,
+                    "references": [],
+                    "index_types": index_type,
+                },
+            )
+            raise HTTPException(status_code=500, detail=str(e))
+
+        # 完了したらassistantとしてメッセージ登録
+        def save_answer(full_content, token_usage):
+            return self._save_assistant_message(
+                {
+                    "chat_room_id": chat_room_id,
+                    "role": "assistant",
+                    "message": full_content,
+                    "assistant_prompt": assistant_prompt,
+                    "model": model,
+                    "references": references,
+                    "token_usage": token_usage["total_tokens"],
+                    "token_count": get_token_accountant().count(full_content),
+                    "retrieval_context": retrieval_context,
+                }
+            )
+
+        return StreamingResponse(
+            self._encode_answer_stream(
+                encoder,
+                stream_generator,
+                get_full_content,
+                get_token_usage,
+                save_answer,
+            ),
+            media_type=encoder.media_type,
+            background=self._summary_refresh_task(chat_room_id),
+        )
+
+    async def aregenerate_chat_message(
+        self, user_id, message_id, model=None, chat_history=None, stream_format=None
+    ) -> StreamingResponse:
+        """
+        アシスタントの回答を再生成し、同じメッセージを更新する。
+
+        回答の生成時に保存した情報源（retrieval_context）を使用し、回答生成のみを呼び出す。
+        情報源が保存されていないメッセージ（回答キャッシュからの回答や以前のメッセージ）は、
+        検索からやり直す。
+        """
+        encoder = StreamEncoder(stream_format or default_stream_format())
+        target = await run_in_threadpool(
+            self._load_regeneration_target, user_id, message_id
+        )
+        if target["chat_history"] is not None:
+            chat_history = target["chat_history"]
+        model = model or target["model"]
+        search_params = {
+            "query": target["query"],
+            "index_type_list": target["index_types"],
+            "custom_prompt": target["assistant_prompt"] or "",
+            "is_active_custom_prompt": target["assistant_prompt"] is not None,
+            "model": model,
+            "history": chat_history or [],
+        }
+        try:
+            if target["retrieval_context"]:
+                search_result = await aregenerate_answer(
+                    retrieval_context=target["retrieval_context"], **search_params
+                )
+            else:
+                search_result = await asemantic_hybrid_search(**search_params)
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        (
+            stream_generator,
+            get_full_content,
+            references,
+            get_token_usage,
+            retrieval_context,
+        ) = search_result
+
+        def save_answer(full_content, token_usage):
+            with get_session() as session:
+                self.chat_message_repository.update_one(
+                    session,
+                    message_id,
+                    {
+                        "message": full_content,
+                        "model": model,
+                        "references": references,
+                        "evaluation": "none",
+                        "token_usage": token_usage["total_tokens"],
+                        "token_count": get_token_accountant().count(full_content),
+                        "retrieval_context": retrieval_context,
+                    },
+                )
+            return message_id
+
+        return StreamingResponse(
+            self._encode_answer_stream(
+                encoder,
+                stream_generator,
+                get_full_content,
+                get_token_usage,
+                save_answer,
+            ),
+            media_type=encoder.media_type,
+        )
+
+    def _load_regeneration_target(self, user_id, message_id):
+        """
+        再生成するアシスタントのメッセージと、対応する質問（直前のユーザメッセージ）を読み込む。
+
+        サーバー側で会話履歴を読み込む場合は、質問より前のメッセージから会話履歴を組み立てる。
+        """
+        with get_session() as session:
+            message_doc = self.chat_message_repository.find_one_by_id(
+                session, message_id
+            )
+            if not message_doc or message_doc.deleted_at is not None:
+                raise HTTPException(status_code=404, detail="Not found ChatMessage.")
+            chat_room_doc = self.chat_room_repository.find_one_by_id(
+                session, message_doc.chat_room_id
+            )
+            if not chat_room_doc:
+                raise HTTPException(status_code=404, detail="Not found ChatRoom.")
+            if chat_room_doc.user_id != user_id:
+                raise HTTPException(
+                    status_code=403,
+                    detail="Forbidden: You do not have permission to access this resource.",
+                )
+            if message_doc.role != "assistant":
+                raise HTTPException(
+                    status_code=400,
+                    detail="Only assistant messages can be regenerated.",
+                )
+            question = self.chat_message_repository.find_previous_user_message(
+                session, chat_room_doc.id, message_doc.created_at
+            )
+            if not question:
+                raise HTTPException(status_code=404, detail="Not found question.")
+            chat_history = (
+                self._load_chat_history(session, chat_room_doc, before=question)
+                if SERVER_HISTORY_ENABLED
+                else None
+            )
+            return {
+                "query": question.message,
+                "index_types": question.index_types or [],
+                # カスタムプロンプトは有効な場合のみユーザメッセージに保存されている
+                "assistant_prompt": question.assistant_prompt,
+                "model": message_doc.model,
+                "retrieval_context": message_doc.retrieval_context,
+                "chat_history": chat_history,
+            }
+
+    async def _encode_answer_stream(
+        self, encoder, stream_generator, get_full_content, get_token_usage, save_answer
+    ):
+        """
+        回答のストリームをクライアントへの送信形式に変換し、完了後に save_answer で回答を保存する。
+
+        save_answer(full_content, token_usage) はスレッドプールで実行し、保存したメッセージのIDを返す。
+        """
+        # 参照情報は最初のイベントとして送られる（従来形式では本文の後に送信する）
+        try:
+            async for event in stream_generator():
+                for body in encoder.encode(event):
+                    yield body
+        except Exception as e:
+            if encoder.stream_format != "sse":
+                raise
+            # SSEの場合は、生成途中のエラーをイベントとしてクライアントに通知する
+            print(f"回答生成のストリーミング中にエラーが発生しました: {str(e)}")
+            error_event = StreamEvent(
+                ERROR, {"message": "回答生成においてエラーが発生しました。"}
+            )
+            for event in (error_event, StreamEvent(DONE, {"message_id": None})):
+                for body in encoder.encode(event):
+                    yield body
+            return
+        for body in encoder.close():
+            yield body
+
+        # ストリームが完全に終了した後にコールバックとしてDB登録
+        message_id = await run_in_threadpool(
+            save_answer, get_full_content(), get_token_usage()
+        )
+        for body in encoder.encode(StreamEvent(DONE, {"message_id": message_id})):
+            yield body
+
+    def _save_user_message(
+        self,
+        user_id,
+        chat_room_id,
+        message,
+        references,
+        assistant_prompt,
+        is_active_assistant_prompt,
+        model,
+        index_type,
+    ):
+        """
+        チャットルームの所有者を確認し、ユーザメッセージとカスタムプロンプトを保存する。
+
+        サーバー側で会話履歴を読み込む場合は、保存前のメッセージから組み立てた会話履歴を返す
+        （クライアントの会話履歴を使用する場合は None）。
+        """
         with get_session() as session:
             chat_room_doc = self.chat_room_repository.find_one_by_id(
                 session, chat_room_id
@@ -39,11 +312,20 @@ class ManageChatMessageUsecase:
             # チャットルームが存在するか？
             if not chat_room_doc:
                 raise HTTPException(status_code=404, detail="Not found ChatRoom.")
-            # チャットルーム所有者なら処理
-            if chat_room_doc.user_id == user_id:
-                # print('\033[31m'+ "index_type: " + index_type + '\033[0m')
-                print("index_type: ", index_type)
-                message_data_dict = {
+            # チャットルーム所有者でなければ処理しない
+            if chat_room_doc.user_id != user_id:
+                raise HTTPException(
+                    status_code=403,
+                    detail="Forbidden: You do not have permission to access this resource.",
+                )
+            chat_history = (
+                self._load_chat_history(session, chat_room_doc)
+                if SERVER_HISTORY_ENABLED
+                else None
+            )
+            self.chat_message_repository.insert_one(
+                session,
+                {
                     "chat_room_id": chat_room_id,
                     "role": "user",
                     "message": message,
@@ -53,77 +335,120 @@ class ManageChatMessageUsecase:
                     else None,
                     "model": model,
                     "index_types": index_type,
-                }
-                # ユーザメッセージ保存
-                self.chat_message_repository.insert_one(session, message_data_dict)
-                self.chat_room_repository.update_one(
-                    session,
-                    chat_room_doc.id,
-                    {
-                        "custom_prompt": assistant_prompt,
-                        "is_active_custom_prompt": is_active_assistant_prompt,
-                    },
-                )
-                try:
-                    (
-                        stream_generator,
-                        get_full_content,
-                        references,
-                        get_token_usage,
-                    ) = semantic_hybrid_search(
-                        query=message,
-                        index_type_list=index_type,
-                        custom_prompt=assistant_prompt,
-                        is_active_custom_prompt=is_active_assistant_prompt,
-                        model=model,
-                        history=chat_history,
-                    )
-                except RuntimeError as e:
-                    assistant_message_data = {
-                        "chat_room_id": chat_room_id,
-                        "role": "assistant",
-                        "message": str(e),
-                        "assistant_prompt": assistant_prompt,
-                        "model": model,
-                        "references": [],
-                        "index_types": index_type,
-                    }
-                    self.chat_message_repository.insert_one(
-                        session, assistant_message_data
-                    )
-                    raise HTTPException(status_code=500, detail=str(e))
+                    "token_count": get_token_accountant().count(message),
+                },
+            )
+            self.chat_room_repository.update_one(
+                session,
+                chat_room_doc.id,
+                {
+                    "custom_prompt": assistant_prompt,
+                    "is_active_custom_prompt": is_active_assistant_prompt,
+                },
+            )
+            return chat_history
 
-                # 完了したらassistantとしてメッセージ登録
-                def wrapped_stream():
-                    for item in stream_generator():
-                        if "<<TOKEN_INFO>>" not in item:
-                            yield item
+    def _load_chat_history(
+        self, session, chat_room_doc, before=None
+    ) -> list[ChatHistoryItem]:
+        """
+        DBから直近のメッセージを読み込み、会話履歴を組み立てる。
 
-                    # ストリームが完全に終了した後にコールバックとしてDB登録
-                    full_content = get_full_content()
-                    token_usage = get_token_usage()
+        会話の要約が有効な場合は、要約と、まだ要約されていないメッセージから組み立てる。
+        before（メッセージ）を指定した場合は、そのメッセージより前の会話のみを読み込む。
+        """
+        summary, summarized_count = (
+            (chat_room_doc.summary, chat_room_doc.summary_message_count)
+            if CONVERSATION_SUMMARY_ENABLED
+            else (None, None)
+        )
+        message_count = self.chat_message_repository.count_by_chat_room_id(
+            session,
+            chat_room_doc.id,
+            before.created_at if before is not None else None,
+        )
+        # 要約が before 以降の会話（再生成する回答など）を含む場合は、要約を使用せずにメッセージのみから組み立てる
+        if summarized_count and summarized_count > message_count:
+            summary, summarized_count = None, None
+        offset, limit = conversation_memory.history_window(
+            summarized_count, message_count
+        )
+        messages = self.chat_message_repository.find_history_window_by_chat_room_id(
+            session, chat_room_doc.id, offset, limit
+        )
+        return [
+            ChatHistoryItem(**item)
+            for item in conversation_memory.history(summary, messages)
+        ]
 
-                    assistant_message_data = {
-                        "chat_room_id": chat_room_id,
-                        "role": "assistant",
-                        "message": full_content,
-                        "assistant_prompt": assistant_prompt,
-                        "model": model,
-                        "references": references,
-                        "token_usage": token_usage["total_tokens"],
-                    }
-                    with get_session() as session:
-                        self.chat_message_repository.insert_one(
-                            session, assistant_message_data
-                        )
+    def _summary_refresh_task(self, chat_room_id) -> BackgroundTask | None:
+        """レスポンスの送信後に会話の要約を更新するタスクを返す"""
+        if not CONVERSATION_SUMMARY_ENABLED:
+            return None
+        return BackgroundTask(self.refresh_conversation_summary, chat_room_id)
 
-                return StreamingResponse(wrapped_stream(), media_type="text/plain")
+    def refresh_conversation_summary(self, chat_room_id):
+        """
+        直近のメッセージより古く、まだ要約されていないメッセージを会話の要約に取り込む。
 
-            else:
-                raise HTTPException(
-                    status_code=403,
-                    detail="Forbidden: You do not have permission to access this resource.",
+        回答の保存後にバックグラウンドで実行する。失敗した場合は次回の回答後に再度取り込む。
+        """
+        with _summarizing_lock:
+            if chat_room_id in _summarizing_chat_room_ids:
+                return
+            _summarizing_chat_room_ids.add(chat_room_id)
+        try:
+            with get_session() as session:
+                chat_room_doc = self.chat_room_repository.find_one_by_id(
+                    session, chat_room_id
                 )
+                if not chat_room_doc:
+                    return
+                summary = chat_room_doc.summary
+                summarized_count = chat_room_doc.summary_message_count or 0
+                window = conversation_memory.pending_window(
+                    summarized_count,
+                    self.chat_message_repository.count_by_chat_room_id(
+                        session, chat_room_id
+                    ),
+                )
+                if window is None:
+                    return
+                pending = conversation_memory.history(
+                    None,
+                    self.chat_message_repository.find_history_window_by_chat_room_id(
+                        session, chat_room_id, *window
+                    ),
+                )
+
+            # 要約の生成中はDBのセッションを保持しない
+            summary = summarize_conversation(summary, pending)
+
+            with get_session() as session:
+                self.chat_room_repository.update_one(
+                    session,
+                    chat_room_id,
+                    {
+                        "summary": summary,
+                        "summary_message_count": summarized_count + len(pending),
+                    },
+                )
+            print(
+                f"会話の要約を更新しました: {chat_room_id} "
+                f"({summarized_count + len(pending)}件のメッセージ)"
+            )
+        except Exception as e:
+            print(f"会話の要約の更新に失敗しました: {str(e)}")
+        finally:
+            with _summarizing_lock:
+                _summarizing_chat_room_ids.discard(chat_room_id)
+
+    def _save_assistant_message(self, assistant_message_data) -> str:
+        with get_session() as session:
+            record = self.chat_message_repository.insert_one(
+                session, assistant_message_data
+            )
+            return record.id
 
     def get_chat_messages(self, chat_room_id):
         with get_session() as session:
@@ -1,6 +1,7 @@
 import io
 import os
 import tempfile
+from collections.abc import Iterator
 from itertools import groupby
 
 import html2text
@@ -68,13 +69,11 @@ def extract_markdown_text_from_docx(file: bytes) -> list[dict[str, any]]:
     # ページごとにコンテンツをまとめる
     docs = []
     for page, group in groupby(paragraph_contents, key=lambda x: x["page"]):
-        combined_content = ""
-        for item in group:
-            combined_content += item["content"]
+        combined_content = "".join(item["content"] for item in group)
 
         docs.append(
             {
-                "page_content": combined_content + f"<PAGE_NUMBER>{page}</PAGE_NUMBER>",
+                "page_content": combined_content,
                 "metadata": {"page": page},
             }
         )
@@ -148,12 +147,6 @@ def extract_markdown_text_from_pptx(file: bytes) -> list[dict[str, any]]:
     # ページ番号順にソートする
     docs = sorted(docs, key=lambda x: x["metadata"]["page"])
 
-    # ページ番号をテキストに埋め込む
-    for doc in docs:
-        doc["page_content"] += (
-            "<PAGE_NUMBER>" + str(doc["metadata"]["page"]) + "</PAGE_NUMBER>"
-        )
-
     return docs
 
 
@@ -215,10 +208,6 @@ def extract_markdown_text_from_html(file: bytes) -> list[dict[str, any]]:
     # ページ番号順にソートする
     docs = sorted(docs, key=lambda x: x["metadata"]["page"])
 
-    # ページ番号をテキストに埋め込む
-    for doc in docs:
-        doc["page_content"] += f"<PAGE_NUMBER>{doc['metadata']['page']}</PAGE_NUMBER>"
-
     return docs
 
 
@@ -231,7 +220,21 @@ def extract_markdown_text_from_pdf(file: bytes) -> list[dict[str, any]]:
     Returns:
         list[dict[str, any]]: 各ページのテキストとメタデータを含む辞書のリスト
     """
-    docs = []
+    return list(iter_markdown_text_from_pdf(file))
+
+
+def iter_markdown_text_from_pdf(file: bytes) -> Iterator[dict[str, any]]:
+    """PDFファイル(.pdf)のbytes型データから、ページ順にマークダウン形式のテキストを抽出する
+
+    ページごとにテキストを抽出した時点で返すため、後続のチャンク分割・埋め込みを
+    全ページの抽出の完了を待たずに開始できる。
+
+    Args:
+        file (bytes): PDFファイル(.pdf)のbytes型データ
+
+    Yields:
+        dict[str, any]: ページのテキストとメタデータを含む辞書
+    """
 
     def process_page(i_page):
         i, page = i_page
@@ -317,23 +320,13 @@ def extract_markdown_text_from_pdf(file: bytes) -> list[dict[str, any]]:
         reader = PdfReader(temp_file.name)
 
         # NOTE: 非同期処理ではパフォーマンスが上がらず、並列・並行処理は上手く実装できなかった
+        # ページ番号順に処理するため、並べ替えは不要
         for i, page in enumerate(reader.pages):
-            docs.extend(process_page((i, page)))
+            yield from process_page((i, page))
 
     finally:
         os.unlink(temp_file.name)
 
-    # ページ番号順にソートする
-    docs = sorted(docs, key=lambda x: x["metadata"]["page"])
-
-    # ページ番号をテキストに埋め込む
-    for doc in docs:
-        doc["page_content"] += (
-            "<PAGE_NUMBER>" + str(doc["metadata"]["page"]) + "</PAGE_NUMBER>"
-        )
-
-    return docs
-
 
 def extract_markdown_text_from_image(file: bytes) -> list[dict[str, any]]:
     """画像データ(.png, .jpg, .jpeg)のbytes型データからマークダウン形式でテキストを抽出する
@@ -0,0 +1,99 @@
+"""
+補助的なLLM呼び出しのメモ化のテスト
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.services.aux_call_cache import AuxCallCache, prompt_version
+
+MESSAGES = [
+    {"role": "user", "content": "育児休暇について"},
+    {"role": "assistant", "content": "育児休暇とは…"},
+    {"role": "user", "content": "申請方法は？"},
+]
+
+
+class TestAuxCallCache:
+    """キャッシュキーの作成と結果の再利用のテスト"""
+
+    def test_reuses_result(self):
+        """同じキーの場合は保存済みの結果を返す"""
+        cache = AuxCallCache()
+        calls = []
+        key = cache.make_key("search_query", "v1", MESSAGES, deployment="gpt")
+
+        def fn():
+            calls.append(1)
+            return "申請方法"
+
+        assert cache.get_or_call("search_query", key, fn) == "申請方法"
+        assert cache.get_or_call("search_query", key, fn) == "申請方法"
+        assert len(calls) == 1
+        assert cache.stats()["routes"]["search_query"] == {
+            "hits": 1,
+            "misses": 1,
+            "prompt_version": "v1",
+        }
+
+    def test_key_depends_on_inputs(self):
+        """会話履歴・プロンプトのバージョン・ルートの設定が異なる場合は別のキーになる"""
+        cache = AuxCallCache()
+        key = cache.make_key("search_query", "v1", MESSAGES, deployment="gpt")
+        assert key == cache.make_key(
+            "search_query", "v1", [dict(m) for m in MESSAGES], deployment="gpt"
+        )
+        assert key != cache.make_key(
+            "search_query", "v1", MESSAGES[1:], deployment="gpt"
+        )
+        assert key != cache.make_key("search_query", "v2", MESSAGES, deployment="gpt")
+        assert key != cache.make_key("search_query", "v1", MESSAGES, deployment="mini")
+        assert key != cache.make_key(
+            "hypothetical_answer", "v1", MESSAGES, deployment="gpt"
+        )
+
+    def test_prompt_version(self):
+        """プロンプトを変更するとバージョンが変わる"""
+        assert prompt_version("a", "b") == prompt_version("a", "b")
+        assert prompt_version("a", "b") != prompt_version("a", "c")
+        assert prompt_version("ab", "") != prompt_version("a", "b")
+
+    def test_error_is_not_cached(self):
+        """失敗した呼び出しの結果はキャッシュしない"""
+        cache = AuxCallCache()
+        key = cache.make_key("query_plan", "v1", MESSAGES)
+
+        def fail():
+            raise ValueError("invalid json")
+
+        with pytest.raises(ValueError):
+            cache.get_or_call("query_plan", key, fail)
+        assert cache.get_or_call("query_plan", key, lambda: {"search_query": "q"}) == {
+            "search_query": "q"
+        }
+
+    def test_returns_copy(self):
+        """呼び出し元での変更がキャッシュ済みの結果に影響しない"""
+        cache = AuxCallCache()
+        key = cache.make_key("query_plan", "v1", MESSAGES)
+        cache.get_or_call("query_plan", key, lambda: {"search_query": "q"})["x"] = 1
+        assert cache.get_or_call("query_plan", key, lambda: {}) == {"search_query": "q"}
+
+    @pytest.mark.asyncio
+    async def test_async_reuses_result(self):
+        """非同期版でも保存済みの結果を返す"""
+        cache = AuxCallCache()
+        key = cache.make_key("hypothetical_answer", "v1", MESSAGES)
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            return "仮説回答"
+
+        assert await cache.aget_or_call("hypothetical_answer", key, fn) == "仮説回答"
+        assert await cache.aget_or_call("hypothetical_answer", key, fn) == "仮説回答"
+        assert len(calls) == 1
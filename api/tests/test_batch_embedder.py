@@ -0,0 +1,174 @@
+"""
+埋め込みAPIのバッチ呼び出しのテスト
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.internal.batch_embedder import BatchEmbedder
+
+
+class _StatusError(Exception):
+    """埋め込みAPIのエラーレスポンス（status_code と Retry-After を持つ）"""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"headers": headers or {}})()
+
+
+class _FakeEmbeddings:
+    """
+    too_large を含む複数件のリクエストと、invalid を含むリクエストを失敗させる（400）。
+    最初の rate_limited 回のリクエストはレート制限する（429）。
+    """
+
+    def __init__(self, too_large=None, invalid=None, rate_limited=0, headers=None):
+        self.requests = []
+        self.too_large = too_large
+        self.invalid = invalid
+        self.rate_limited = rate_limited
+        self.headers = headers
+
+    def __call__(self, texts):
+        self.requests.append(list(texts))
+        if len(self.requests) <= self.rate_limited:
+            raise _StatusError(429, self.headers)
+        if self.too_large in texts and len(texts) > 1:
+            raise _StatusError(413)
+        if self.invalid in texts:
+            raise _StatusError(400)
+        return [[float(len(text))] for text in texts]
+
+
+class TestBatchEmbedder:
+    """バッチの分割・順序・失敗時の再試行のテスト"""
+
+    def test_plan_batches_by_inputs_and_tokens(self):
+        """入力件数と合計トークン数の上限でバッチを区切る"""
+        embedder = BatchEmbedder(
+            _FakeEmbeddings(), max_inputs=3, max_tokens=10, count_tokens=len
+        )
+        assert embedder.plan_batches(["a"] * 7) == [[0, 1, 2], [3, 4, 5], [6]]
+        assert embedder.plan_batches(["aaaa", "aaaa", "aaaa", "a"]) == [
+            [0, 1],
+            [2, 3],
+        ]
+        # 上限を超えるテキストは単独のバッチにする
+        assert embedder.plan_batches(["a", "a" * 20, "a"]) == [[0], [1], [2]]
+
+    def test_embed_keeps_order(self):
+        """ベクトルは入力と同じ順序で返す"""
+        fake = _FakeEmbeddings()
+        embedder = BatchEmbedder(
+            fake, max_inputs=2, max_tokens=100, max_workers=3, count_tokens=len
+        )
+        texts = ["a" * n for n in range(1, 8)]
+        assert embedder.embed(texts) == [[float(n)] for n in range(1, 8)]
+        assert len(fake.requests) == 4
+        assert embedder.stats()["requests"] == 4
+
+    def test_split_failed_batch(self):
+        """失敗したバッチは分割して再試行する"""
+        fake = _FakeEmbeddings(too_large="bad")
+        embedder = BatchEmbedder(fake, max_inputs=4, max_tokens=100, count_tokens=len)
+        texts = ["a", "bb", "bad", "dddd"]
+        assert embedder.embed(texts) == [[1.0], [2.0], [3.0], [4.0]]
+        stats = embedder.stats()
+        assert stats["failed_requests"] == 2
+        assert stats["splits"] == 2
+
+    def test_single_failure_raises(self):
+        """1件でも埋め込めない場合は例外を送出する"""
+        embedder = BatchEmbedder(
+            _FakeEmbeddings(invalid="x"), max_inputs=4, count_tokens=len
+        )
+        with pytest.raises(_StatusError):
+            embedder.embed(["a", "x"])
+
+    def test_rate_limit_backs_off_without_split(self):
+        """レート制限の場合は分割せずに、待機して同じバッチを再試行する"""
+        fake = _FakeEmbeddings(rate_limited=2)
+        waits = []
+        embedder = BatchEmbedder(
+            fake,
+            max_inputs=4,
+            count_tokens=len,
+            backoff_seconds=1.0,
+            sleep=waits.append,
+        )
+        assert embedder.embed(["a", "bb", "ccc"]) == [[1.0], [2.0], [3.0]]
+        assert fake.requests == [["a", "bb", "ccc"]] * 3
+        assert len(waits) == 2 and 1.0 <= waits[0] < waits[1]
+        stats = embedder.stats()
+        assert stats["rate_limited"] == 2
+        assert stats["splits"] == 0
+
+    def test_rate_limit_uses_retry_after(self):
+        """Retry-After がある場合はその時間だけ待機する"""
+        waits = []
+        embedder = BatchEmbedder(
+            _FakeEmbeddings(rate_limited=1, headers={"retry-after-ms": "250"}),
+            count_tokens=len,
+            sleep=waits.append,
+        )
+        embedder.embed(["a"])
+        assert waits == [0.25]
+
+    def test_rate_limit_gives_up_after_max_retries(self):
+        embedder = BatchEmbedder(
+            _FakeEmbeddings(rate_limited=10),
+            count_tokens=len,
+            max_retries=2,
+            sleep=lambda _: None,
+        )
+        with pytest.raises(_StatusError):
+            embedder.embed(["a", "b"])
+
+    def test_transient_errors_are_retried(self):
+        """一時的なエラー（5xx）の場合は分割せずに、待機して同じバッチを再試行する"""
+        requests = []
+
+        def unavailable_once(texts):
+            requests.append(texts)
+            if len(requests) == 1:
+                raise _StatusError(503)
+            return [[float(len(text))] for text in texts]
+
+        waits = []
+        embedder = BatchEmbedder(unavailable_once, count_tokens=len, sleep=waits.append)
+        assert embedder.embed(["a", "bb"]) == [[1.0], [2.0]]
+        assert requests == [["a", "bb"]] * 2
+        assert len(waits) == 1
+        stats = embedder.stats()
+        assert stats["rate_limited"] == 0
+        assert stats["splits"] == 0
+
+    def test_other_errors_are_not_split(self):
+        """再試行・分割で成功しないエラーは、再試行も分割もせずに送出する"""
+        requests = []
+
+        def unauthorized(texts):
+            requests.append(texts)
+            raise _StatusError(401)
+
+        embedder = BatchEmbedder(unauthorized, count_tokens=len)
+        with pytest.raises(_StatusError):
+            embedder.embed(["a", "b", "c"])
+        assert len(requests) == 1
+        assert embedder.stats()["splits"] == 0
+
+    def test_group_size_covers_workers(self):
+        """呼び出し側でまとめる件数は、同時に送信するリクエスト数分のバッチの入力件数とする"""
+        embedder = BatchEmbedder(
+            _FakeEmbeddings(), max_inputs=16, max_workers=3, count_tokens=len
+        )
+        assert embedder.group_size == 48
+
+    def test_empty(self):
+        embedder = BatchEmbedder(_FakeEmbeddings(), count_tokens=len)
+        assert embedder.embed([]) == []
@@ -0,0 +1,318 @@
+"""
+キャッシュ層のテスト
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.services.answer_cache import SemanticAnswerCache
+from src.services.cache import LRUCache
+from src.services.embedding_cache import EmbeddingCache
+from src.services.search_result_cache import SearchResultCache
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.store = {}
+
+    def get(self, key):
+        return self.store.get(key)
+
+    def mget(self, keys):
+        return [self.store.get(key) for key in keys]
+
+    def setex(self, key, ttl, value):
+        self.store[key] = value
+
+    def incr(self, key):
+        self.store[key] = int(self.store.get(key, 0)) + 1
+        return self.store[key]
+
+
+class _ThreadRecordingRedis(_FakeRedis):
+    """操作を実行したスレッドを記録する"""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = []
+
+    def get(self, key):
+        self.threads.append(threading.get_ident())
+        return super().get(key)
+
+    def mget(self, keys):
+        self.threads.append(threading.get_ident())
+        return super().mget(keys)
+
+    def setex(self, key, ttl, value):
+        self.threads.append(threading.get_ident())
+        super().setex(key, ttl, value)
+
+
+class TestLRUCache:
+    """LRUCacheのテスト"""
+
+    def test_evicts_least_recently_used(self):
+        """最大件数を超えると最も古く参照されたエントリが追い出される"""
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert "a" in cache
+        assert "b" not in cache
+        assert cache.stats()["evictions"] == 1
+
+    def test_ttl_expiration(self):
+        """TTLを過ぎたエントリはミスとして扱われる"""
+        cache = LRUCache(max_size=10, ttl_seconds=0.05)
+        cache.set("a", 1)
+        time.sleep(0.06)
+
+        assert cache.get("a") is None
+        stats = cache.stats()
+        assert stats["misses"] == 1
+        assert stats["expirations"] == 1
+
+
+class TestEmbeddingCache:
+    """EmbeddingCacheのテスト"""
+
+    def test_only_missing_texts_are_embedded(self):
+        """未キャッシュのテキストのみがまとめて埋め込まれる"""
+        cache = EmbeddingCache(max_size=10)
+        calls = []
+
+        def embed(batch):
+            calls.append(list(batch))
+            return [[float(len(text))] for text in batch]
+
+        cache.get_or_create(["育児休暇", "有給"], "ada", embed)
+        vectors = cache.get_or_create(["有給", " 育児休暇 ", "残業"], "ada", embed)
+
+        assert calls == [["育児休暇", "有給"], ["残業"]]
+        assert vectors == [[2.0], [4.0], [2.0]]
+
+    def test_key_includes_deployment(self):
+        """デプロイ名が異なる場合は別のキーになる"""
+        cache = EmbeddingCache(max_size=10)
+        cache.set("テキスト", "ada", [1.0])
+
+        assert cache.get("テキスト", "text-embedding-3-large") is None
+
+    def test_local_tier_stores_float32(self):
+        """ローカルLRUには float32 の配列で保持し、リストで返す"""
+        cache = EmbeddingCache(max_size=10)
+        cache.set("テキスト", "ada", [0.5, 1.5])
+
+        assert (
+            cache.local.get(cache.make_key("テキスト", "ada")).dtype.name == "float32"
+        )
+        assert cache.get("テキスト", "ada") == [0.5, 1.5]
+
+    def test_redis_tier_populates_local(self):
+        """Redisでヒットした場合はローカルにも保存される"""
+        fake_redis = _FakeRedis()
+        EmbeddingCache(redis_client=fake_redis).set("テキスト", "ada", [0.5, 1.5])
+        cache = EmbeddingCache(redis_client=fake_redis)
+
+        assert cache.get("テキスト", "ada") == [0.5, 1.5]
+        assert cache.stats()["redis_hits"] == 1
+        assert cache.get("テキスト", "ada") == [0.5, 1.5]
+        assert cache.stats()["redis_hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_async_only_missing_texts_are_embedded(self):
+        """非同期版でも未キャッシュのテキストのみがまとめて埋め込まれる"""
+        cache = EmbeddingCache(max_size=10)
+        cache.set("有給", "ada", [9.0])
+        calls = []
+
+        async def embed(batch):
+            calls.append(list(batch))
+            return [[float(len(text))] for text in batch]
+
+        vectors = await cache.aget_or_create(["有給", "残業", "残業"], "ada", embed)
+
+        assert calls == [["残業"]]
+        assert vectors == [[9.0], [2.0], [2.0]]
+
+    @pytest.mark.asyncio
+    async def test_async_redis_io_runs_outside_event_loop(self):
+        """非同期版ではRedisの操作をイベントループのスレッドで実行しない"""
+        fake_redis = _ThreadRecordingRedis()
+        cache = EmbeddingCache(redis_client=fake_redis)
+
+        async def embed(batch):
+            return [[1.0] for _ in batch]
+
+        await cache.aget_or_create(["有給", "残業"], "ada", embed)
+
+        assert fake_redis.threads
+        assert threading.get_ident() not in fake_redis.threads
+
+
+class TestSemanticAnswerCache:
+    """SemanticAnswerCacheのテスト"""
+
+    def test_similar_query_hits_within_same_scope(self):
+        """同じスコープ内で類似度が閾値以上の質問はヒットする"""
+        cache = SemanticAnswerCache(similarity_threshold=0.95)
+        cache.store("育児休暇とは", [1.0, 0.0], ["index-b", "index-a"], "回答", [])
+
+        hit = cache.lookup([0.99, 0.01], ["index-a", "index-b"])
+        miss = cache.lookup([0.0, 1.0], ["index-a", "index-b"])
+        other_scope = cache.lookup([1.0, 0.0], ["index-a"])
+
+        assert hit is not None and hit.answer == "回答"
+        assert miss is None
+        assert other_scope is None
+        assert cache.stats()["hits"] == 1
+
+    def test_invalidate_index(self):
+        """インデックス単位でエントリを破棄できる"""
+        cache = SemanticAnswerCache()
+        cache.store("質問", [1.0, 0.0], ["index-a", "index-b"], "回答", [])
+        cache.store("質問", [1.0, 0.0], ["index-c"], "回答", [])
+
+        assert cache.invalidate_index("index-a") == 1
+        assert cache.lookup([1.0, 0.0], ["index-a", "index-b"]) is None
+        assert cache.lookup([1.0, 0.0], ["index-c"]) is not None
+
+    def test_invalidation_is_shared_through_redis(self):
+        """別のプロセスでのインデックスの更新後は、更新前に保存した回答を使用しない"""
+        redis_client = _FakeRedis()
+        api_cache = SemanticAnswerCache(redis_client=redis_client)
+        job_cache = SemanticAnswerCache(redis_client=redis_client)
+        api_cache.store("質問", [1.0, 0.0], ["index-a", "index-b"], "回答", [])
+
+        job_cache.invalidate_index("index-b")
+
+        assert api_cache.lookup([1.0, 0.0], ["index-a", "index-b"]) is None
+
+    def test_answer_generated_before_update_is_not_used(self):
+        """検索の前のバージョンで保存した回答は、生成中にインデックスが更新された場合は使用しない"""
+        cache = SemanticAnswerCache()
+        versions = cache.index_versions(["index-a"])
+        cache.invalidate_index("index-a")
+        cache.store("質問", [1.0, 0.0], ["index-a"], "回答", [], versions=versions)
+
+        assert cache.lookup([1.0, 0.0], ["index-a"]) is None
+
+    @pytest.mark.asyncio
+    async def test_async_versions_run_outside_event_loop(self):
+        """非同期版ではRedisからのバージョンの取得をイベントループのスレッドで実行しない"""
+        fake_redis = _ThreadRecordingRedis()
+        cache = SemanticAnswerCache(redis_client=fake_redis)
+
+        assert await cache.aindex_versions(["index-a"]) == (0,)
+        assert fake_redis.threads
+        assert threading.get_ident() not in fake_redis.threads
+
+
+class TestSearchResultCache:
+    """SearchResultCacheのテスト"""
+
+    def _search(self, calls, docs):
+        def _fn():
+            calls.append(1)
+            return [dict(doc) for doc in docs]
+
+        return _fn
+
+    def test_same_params_hit(self):
+        """同じインデックス・同じ検索パラメータの検索結果は再利用される"""
+        from azure.search.documents.models import VectorizedQuery
+
+        cache = SearchResultCache()
+        calls = []
+        docs = [{"id": "1", "content": "内容"}]
+
+        def params(vector, top=20):
+            return {
+                "search_text": "育児休暇",
+                "top": top,
+                "vector_queries": [
+                    VectorizedQuery(
+                        vector=vector, k_nearest_neighbors=20, fields="contentVector"
+                    )
+                ],
+                "select": ["id", "content"],
+            }
+
+        first = cache.get_or_search(
+            "index-a", params([1.0, 0.5]), self._search(calls, docs)
+        )
+        second = cache.get_or_search(
+            "index-a", params([1.0, 0.5]), self._search(calls, docs)
+        )
+        cache.get_or_search("index-a", params([1.0, 0.6]), self._search(calls, docs))
+        cache.get_or_search(
+            "index-a", params([1.0, 0.5], top=5), self._search(calls, docs)
+        )
+        cache.get_or_search("index-b", params([1.0, 0.5]), self._search(calls, docs))
+
+        assert first == second == docs
+        assert len(calls) == 4
+        assert cache.stats()["hits"] == 1
+        # 返された結果を変更してもキャッシュには影響しない
+        second[0]["content"] = "変更"
+        assert cache.get_or_search("index-a", params([1.0, 0.5]), None) == docs
+
+    def test_bump_version_invalidates_index(self):
+        """インデックスのバージョンを更新すると、そのインデックスの検索結果のみ無効になる"""
+        cache = SearchResultCache()
+        calls = []
+        params = {"search_text": "残業"}
+        for index_name in ["index-a", "index-b"]:
+            cache.get_or_search(index_name, params, self._search(calls, [{"id": "1"}]))
+
+        cache.bump_version("index-a")
+        cache.get_or_search("index-a", params, self._search(calls, [{"id": "2"}]))
+        cache.get_or_search("index-b", params, self._search(calls, [{"id": "3"}]))
+
+        assert len(calls) == 3
+        assert cache.stats()["invalidations"] == 1
+
+    def test_version_is_shared_through_redis(self):
+        """Redisを使用する場合、別プロセスでのバージョンの更新も反映される"""
+        redis_client = _FakeRedis()
+        api_cache = SearchResultCache(redis_client=redis_client)
+        job_cache = SearchResultCache(redis_client=redis_client)
+        calls = []
+
+        api_cache.get_or_search("index-a", {}, self._search(calls, []))
+        job_cache.bump_version("index-a")
+        api_cache.get_or_search("index-a", {}, self._search(calls, []))
+
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_async_version_runs_outside_event_loop(self):
+        """非同期版ではRedisからのバージョンの取得をイベントループのスレッドで実行しない"""
+        fake_redis = _ThreadRecordingRedis()
+        cache = SearchResultCache(redis_client=fake_redis)
+
+        async def search():
+            return [{"id": "1"}]
+
+        assert await cache.aget_or_search("index-a", {}, search) == [{"id": "1"}]
+        assert fake_redis.threads
+        assert threading.get_ident() not in fake_redis.threads
+
+    def test_content_vector_is_compacted(self):
+        """contentVector は float32 の配列として保持される"""
+        cache = SearchResultCache()
+        results = cache.get_or_search(
+            "index-a", {}, lambda: [{"id": "1", "contentVector": [0.25, 0.5]}]
+        )
+
+        assert results[0]["contentVector"].dtype.name == "float32"
+        assert results[0]["contentVector"].tolist() == [0.25, 0.5]
@@ -0,0 +1,222 @@
+"""
+マークダウンのテキストの見出しごとのチャンク分割のテスト
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from langchain.text_splitter import MarkdownHeaderTextSplitter
+
+from src.internal.chunker import (
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    TokenSplitter,
+    create_section_splitter,
+    iter_semantic_chunks,
+    split_by_characters,
+)
+
+
+def _page(content, page):
+    return {"page_content": content, "metadata": {"page": page}}
+
+
+class TestIterSemanticChunks:
+    """見出しによる分割・ページ番号・長いチャンクの分割のテスト"""
+
+    def test_same_sections_as_markdown_header_text_splitter(self):
+        """1ページのテキストは MarkdownHeaderTextSplitter と同じ単位・同じ内容で分割する"""
+        text = "\n".join(
+            [
+                "前書き",
+                "# 就業規則",
+                "## 第1章 総則",
+                "この規則は",
+                "",
+                "従業員に適用する。",
+                "### 第1条",
+                "#### 細目",
+                "目的",
+                "```",
+                "# コードブロック内の見出しではない行",
+                "```",
+                "# 就業規則",
+                "追記",
+                "#見出しではない行",
+                "## 第2章",
+                "​本文",
+            ]
+        )
+        splitter = MarkdownHeaderTextSplitter(
+            headers_to_split_on=[
+                ("#", "Header 1"),
+                ("##", "Header 2"),
+                ("###", "Header 3"),
+            ]
+        )
+        expected = [
+            (
+                document.page_content,
+                " ".join(document.metadata.values())
+                if "Header 1" in document.metadata
+                else "",
+            )
+            for document in splitter.split_text(text)
+        ]
+
+        chunks = list(iter_semantic_chunks([_page(text, 1)]))
+        assert [(chunk["content"], chunk["keywords"]) for chunk in chunks] == expected
+
+    def test_page_numbers(self):
+        """チャンクの先頭の行のページ番号を付与する"""
+        pages = [
+            _page("# 第1章\n本文1\n", 1),
+            _page("本文1の続き\n# 第2章\n", 2),
+            _page("本文2\n## 第2節\n本文3", 3),
+        ]
+        chunks = list(iter_semantic_chunks(pages))
+        assert [
+            (chunk["content"], chunk["page_number"], chunk["keywords"])
+            for chunk in chunks
+        ] == [
+            ("本文1  \n本文1の続き", 1, "第1章"),
+            ("本文2", 3, "第2章"),
+            ("本文3", 3, "第2章 第2節"),
+        ]
+
+    def test_page_start_is_line_start(self):
+        """ページの先頭の行の見出しは見出しとして扱う"""
+        chunks = list(
+            iter_semantic_chunks([_page("本文1", 1), _page("# 第2章\n本文2", 2)])
+        )
+        assert [(chunk["content"], chunk["keywords"]) for chunk in chunks] == [
+            ("本文1", ""),
+            ("本文2", "第2章"),
+        ]
+
+    def test_long_section_page_numbers(self):
+        """長いチャンクは分割し、分割後の先頭の文字のページ番号を付与する"""
+        pages = [_page("# 見出し\n" + "あ" * 300, 1)] + [
+            _page("い" * 300, page) for page in range(2, 5)
+        ]
+        chunks = list(iter_semantic_chunks(pages))
+        content = "\n".join(["あ" * 300] + ["い" * 300] * 3)
+
+        assert [chunk["content"] for chunk in chunks] == [
+            content[max(i - CHUNK_OVERLAP, 0) : i + CHUNK_SIZE]
+            for i in range(0, len(content), CHUNK_SIZE)
+        ]
+        # 分割後の先頭の位置: 0, 412, 924（各ページの先頭: 0, 301, 602, 903）
+        assert [chunk["page_number"] for chunk in chunks] == [1, 2, 4]
+
+    def test_removes_page_number_comments(self):
+        """Document Intelligence のページ番号のコメントを削除する"""
+        chunks = list(
+            iter_semantic_chunks(
+                [
+                    _page(
+                        "# 見出し\n本文<!-- PageNumber=1 -->\n<!-- PageNumber=2 -->\n続き",
+                        1,
+                    )
+                ]
+            )
+        )
+        assert [chunk["content"] for chunk in chunks] == ["本文\n続き"]
+
+    def test_consumes_pages_lazily(self):
+        """ページを読み込みながらチャンクを作成する"""
+        consumed = []
+
+        def pages():
+            for page in range(1, 1000):
+                consumed.append(page)
+                yield _page(f"# 第{page}章\n本文{page}\n", page)
+
+        chunks = iter_semantic_chunks(pages())
+        assert next(chunks)["page_number"] == 1
+        assert len(consumed) <= 2
+
+
+class TestTokenSplitter:
+    """トークン数を上限とした区切り文字の位置での分割のテスト（1文字を1トークンとして数える）"""
+
+    def _split(self, text, **kwargs):
+        splitter = TokenSplitter(len, **kwargs)
+        return [text[start:end] for start, end in splitter.split_ranges(text)]
+
+    def test_short_text(self):
+        """上限以内の場合は分割しない"""
+        assert self._split("短い本文。", max_tokens=10, overlap_tokens=0) == [
+            "短い本文。"
+        ]
+
+    def test_split_at_sentence_end(self):
+        """文の途中ではなく文末で区切る"""
+        sentences = ["あ" * 29 + "。", "い" * 29 + "。", "う" * 29 + "。"]
+        assert self._split("".join(sentences), max_tokens=70, overlap_tokens=0) == [
+            sentences[0] + sentences[1],
+            sentences[2],
+        ]
+
+    def test_prefers_paragraph_break(self):
+        """段落の区切りを文末より優先する"""
+        text = "一文目。二文目。  \n" + "三文目。" * 3
+        assert self._split(text, max_tokens=12, overlap_tokens=0) == [
+            "一文目。二文目。  \n",
+            "三文目。三文目。三文目。",
+        ]
+
+    def test_overlap_in_tokens(self):
+        """前のチャンクの末尾の overlap_tokens 以内の文を次のチャンクの先頭に含める"""
+        sentences = [f"{i}" * 9 + "。" for i in range(6)]
+        chunks = self._split("".join(sentences), max_tokens=30, overlap_tokens=10)
+        assert chunks == [
+            "".join(sentences[0:3]),
+            "".join(sentences[2:5]),
+            "".join(sentences[4:6]),
+        ]
+
+    def test_split_without_separator(self):
+        """区切り文字がない場合は上限の位置で区切る"""
+        assert self._split("あ" * 25, max_tokens=10, overlap_tokens=2) == [
+            "あ" * 10,
+            "あ" * 10,
+            "あ" * 5,
+        ]
+
+    def test_no_whitespace_only_chunks(self):
+        """上限の位置で区切った末尾の改行などの空白のみの範囲はチャンクにしない"""
+        assert self._split("x" * 150 + "\n", max_tokens=75, overlap_tokens=0) == [
+            "x" * 75,
+            "x" * 75 + "\n",
+        ]
+        text = ("あ" * 70 + "\n" + " " * 3 + "\n\n" + "い" * 50 + "。\n") * 5
+        for max_tokens in range(60, 201, 10):
+            chunks = self._split(text, max_tokens=max_tokens, overlap_tokens=10)
+            assert all(chunk.strip() for chunk in chunks), max_tokens
+
+    def test_page_numbers(self):
+        """分割後のチャンクの先頭の文字のページ番号を付与する"""
+        pages = [
+            _page("# 見出し\n" + "あ" * 19 + "。", 1),
+            _page("い" * 19 + "。" + "う" * 19 + "。", 2),
+        ]
+        splitter = TokenSplitter(len, max_tokens=25, overlap_tokens=0)
+        chunks = list(iter_semantic_chunks(pages, splitter.split_ranges))
+        assert [(chunk["content"], chunk["page_number"]) for chunk in chunks] == [
+            ("あ" * 19 + "。", 1),
+            ("い" * 19 + "。", 2),
+            ("う" * 19 + "。", 2),
+        ]
+
+    def test_invalid_settings(self):
+        with pytest.raises(ValueError):
+            TokenSplitter(len, max_tokens=10, overlap_tokens=10)
+
+    def test_default_mode_is_characters(self, monkeypatch):
+        monkeypatch.delenv("CHUNK_SPLIT_MODE", raising=False)
+        assert create_section_splitter() is split_by_characters
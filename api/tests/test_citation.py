@@ -0,0 +1,86 @@
+"""
+出典タグの展開のテスト
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.internal.citation import (
+    CitationExpander,
+    build_citation_map,
+    expand_citations,
+)
+
+RESULTS = [
+    {
+        "blobUrl": "https://example.blob.core.windows.net/docs/規程.pdf",
+        "pageNumber": 3,
+        "sourceFileName": "就業 規程.pdf",
+    },
+    {
+        "blobUrl": "https://example.blob.core.windows.net/docs/manual.pdf",
+        "pageNumber": 12,
+        "sourceFileName": "manual.pdf",
+    },
+]
+CITATIONS = build_citation_map(RESULTS)
+S1 = "<source-doc:https://example.blob.core.windows.net/docs/規程.pdf(p.3)---就業 規程.pdf>"
+S2 = "<source-doc:https://example.blob.core.windows.net/docs/manual.pdf(p.12)---manual.pdf>"
+
+
+class TestExpandCitations:
+    """出典タグの展開のテスト"""
+
+    def test_build_citation_map(self):
+        """ラベルは情報源の順に S1 から振られ、従来の形式に展開される"""
+        assert CITATIONS == {"S1": S1, "S2": S2}
+
+    def test_expand(self):
+        """単一・連続・カンマ区切りのタグを展開する"""
+        assert (
+            expand_citations("A。[S1]B。[S1][S2]", CITATIONS) == f"A。{S1}B。{S1}{S2}"
+        )
+        assert expand_citations("C。[S2, S1]", CITATIONS) == f"C。{S2}{S1}"
+        assert expand_citations("D。[S1、S2]", CITATIONS) == f"D。{S1}{S2}"
+
+    def test_unknown_label_is_kept(self):
+        """未知のラベルやタグ以外の角括弧はそのまま残す"""
+        text = "[S3]と[S1, S9]と[注1]と[S]"
+        assert expand_citations(text, CITATIONS) == text
+
+
+class TestCitationExpander:
+    """ストリーミング中の出典タグの展開のテスト"""
+
+    def _stream(self, chunks):
+        expander = CitationExpander(CITATIONS)
+        outputs = [expander.feed(chunk) for chunk in chunks]
+        outputs.append(expander.flush())
+        return outputs
+
+    def test_tag_split_across_chunks(self):
+        """チャンクの境界で分割されたタグを展開する"""
+        outputs = self._stream(["回答です。[", "S", "1", "]次の", "文。[S2", "]"])
+        assert "".join(outputs) == f"回答です。{S1}次の文。{S2}"
+        # 分割されたタグは完成するまで出力されない
+        assert outputs[:3] == ["回答です。", "", ""]
+
+    def test_every_split_point(self):
+        """どの位置で分割されても結果は一括で展開した場合と同じになる"""
+        text = "箇条書き:\n- 項目A [S1][S2]\n- 項目B [S2, S1]。[参考] [S9]"
+        expected = expand_citations(text, CITATIONS)
+        for i in range(len(text) + 1):
+            for j in range(i, len(text) + 1):
+                chunks = [text[:i], text[i:j], text[j:]]
+                assert "".join(self._stream(chunks)) == expected
+
+    def test_non_tag_brackets_are_not_held(self):
+        """タグになり得ない角括弧は保留せずに出力する"""
+        expander = CitationExpander(CITATIONS)
+        assert expander.feed("配列 [0] と [x") == "配列 [0] と [x"
+
+    def test_flush_incomplete_tag(self):
+        """ストリームの終了時に未完成のタグはそのまま出力する"""
+        assert "".join(self._stream(["終わり。[S1"])) == "終わり。[S1"
@@ -0,0 +1,72 @@
+"""
+会話履歴の読み込みと会話の要約（ローリングサマリー）のテスト
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.internal.conversation_memory import SUMMARY, ConversationMemory
+
+
+def _messages(n):
+    return [
+        SimpleNamespace(
+            role="user" if i % 2 == 0 else "assistant",
+            message=f"メッセージ{i}",
+            token_count=i,
+        )
+        for i in range(n)
+    ]
+
+
+class TestConversationMemory:
+    """会話履歴の読み込み範囲と要約の対象の選択のテスト"""
+
+    def test_history(self):
+        """要約がある場合は先頭に置き、読み込んだメッセージを続ける"""
+        assert ConversationMemory().history(None, _messages(2)) == [
+            {"type": "user", "content": "メッセージ0", "token_count": 0},
+            {"type": "assistant", "content": "メッセージ1", "token_count": 1},
+        ]
+        history = ConversationMemory().history("要約", _messages(1))
+        assert history[0] == {"type": SUMMARY, "content": "要約"}
+        assert [h["content"] for h in history[1:]] == ["メッセージ0"]
+
+    def test_history_window(self):
+        """直近の max_history_messages 件のうち、まだ要約されていないメッセージを読み込む"""
+        memory = ConversationMemory(max_history_messages=10)
+        assert memory.history_window(None, 4) == (0, 4)
+        assert memory.history_window(None, 25) == (15, 10)
+        # 要約済みのメッセージは読み込まない
+        assert memory.history_window(20, 25) == (20, 5)
+        # 要約の更新が遅れている場合も上限までとする
+        assert memory.history_window(4, 25) == (15, 10)
+
+    def test_pending_window_keeps_recent_messages(self):
+        """直近のメッセージは要約せず、それより古いメッセージを要約の対象とする"""
+        memory = ConversationMemory(recent_messages=4)
+        assert memory.pending_window(0, 4) is None
+        assert memory.pending_window(None, 8) == (0, 4)
+        # 要約済みのメッセージは対象外
+        assert memory.pending_window(2, 8) == (2, 2)
+
+    def test_pending_window_waits_for_min_messages(self):
+        """要約の対象が少ない場合は更新しない"""
+        memory = ConversationMemory(recent_messages=4, min_fold_messages=2)
+        assert memory.pending_window(0, 5) is None
+        assert memory.pending_window(0, 6) == (0, 2)
+
+    def test_summary_messages(self):
+        """これまでの要約と新しい会話を含むプロンプトを作成する"""
+        memory = ConversationMemory()
+        messages = memory.summary_messages(
+            "以前の要約", memory.history(None, _messages(2))
+        )
+        assert messages[0]["role"] == "user"
+        content = messages[0]["content"]
+        assert "以前の要約" in content
+        assert "ユーザー: メッセージ0" in content
+        assert "アシスタント: メッセージ1" in content
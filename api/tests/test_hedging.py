@@ -0,0 +1,117 @@
+"""
+ヘッジリクエストのテスト
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.services.hedging import HedgingPolicy
+
+
+def _warm_up(policy, target, n, value="ok"):
+    for _ in range(n):
+        policy.call(target, lambda: value)
+
+
+class TestHedgingPolicy:
+    """ヘッジリクエストの送信条件と結果の選択のテスト"""
+
+    def test_no_hedge_before_min_samples(self):
+        """レイテンシのサンプルが少ない場合はヘッジしない"""
+        policy = HedgingPolicy(budget_ratio=1.0, min_samples=5)
+        _warm_up(policy, "search:a", 4)
+        stats = policy.stats()["targets"]["search:a"]
+        assert stats["requests"] == 4
+        assert stats["hedges"] == 0
+
+    def test_hedge_on_slow_primary(self):
+        """p95を超えても完了しない場合はヘッジし、先に完了した結果を返す"""
+        policy = HedgingPolicy(budget_ratio=1.0, min_samples=5)
+        _warm_up(policy, "search:a", 20)
+        calls = []
+        lock = threading.Lock()
+
+        def fn():
+            with lock:
+                calls.append(len(calls))
+                attempt = len(calls)
+            if attempt == 1:
+                time.sleep(0.5)
+                return "primary"
+            return "hedge"
+
+        assert policy.call("search:a", fn) == "hedge"
+        stats = policy.stats()["targets"]["search:a"]
+        assert stats["hedges"] == 1
+        assert stats["hedge_wins"] == 1
+
+    def test_budget_limits_hedges(self):
+        """ヘッジリクエスト数は全リクエスト数の budget_ratio 以内に制限する"""
+        policy = HedgingPolicy(budget_ratio=0.05, min_samples=5)
+        _warm_up(policy, "search:a", 10)
+
+        def slow():
+            time.sleep(0.01)
+            return "ok"
+
+        for _ in range(10):
+            policy.call("search:a", slow)
+        stats = policy.stats()["targets"]["search:a"]
+        assert stats["requests"] == 20
+        assert stats["hedges"] <= 1
+
+    def test_hedge_recovers_from_error(self):
+        """一方が失敗した場合はもう一方の結果を返す"""
+        policy = HedgingPolicy(budget_ratio=1.0, min_samples=5)
+        _warm_up(policy, "embedding:a", 20)
+        calls = []
+        lock = threading.Lock()
+
+        def fn():
+            with lock:
+                calls.append(len(calls))
+                attempt = len(calls)
+            if attempt == 1:
+                time.sleep(0.05)
+                raise RuntimeError("primary failed")
+            time.sleep(0.1)
+            return "hedge"
+
+        assert policy.call("embedding:a", fn) == "hedge"
+
+    @pytest.mark.asyncio
+    async def test_async_hedge_cancels_loser(self):
+        """非同期版では負けたリクエストをキャンセルする"""
+        policy = HedgingPolicy(budget_ratio=1.0, min_samples=5)
+
+        async def fast():
+            return "ok"
+
+        for _ in range(20):
+            await policy.acall("search:a", fast)
+
+        cancelled = []
+        calls = []
+
+        async def fn():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                try:
+                    await asyncio.sleep(1)
+                except asyncio.CancelledError:
+                    cancelled.append(True)
+                    raise
+                return "primary"
+            return "hedge"
+
+        assert await policy.acall("search:a", fn) == "hedge"
+        await asyncio.sleep(0)
+        assert cancelled == [True]
+        assert policy.stats()["targets"]["search:a"]["hedge_wins"] == 1
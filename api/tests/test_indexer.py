@@ -0,0 +1,333 @@
+"""
+インデックス作成の差分の判定（変更されていないチャンクの省略・ページ番号の更新・なくなったチャンクの削除）のテスト
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("EMBEDDING_MODEL_NAME", "text-embedding-3-small")
+
+from azure.core.exceptions import HttpResponseError
+
+from src.internal import batch_embedder, indexer
+
+SOURCE_FILE_NAME = "就業規則's.pdf"
+
+
+class _FakeSearchClient:
+    """ドキュメントをメモリに保持し、検索・アップロード・更新・削除を記録する"""
+
+    def __init__(self, filterable=True):
+        self.filterable = filterable
+        self.documents = {}
+        self.events = []
+
+    def search(self, search_text, filter, select):
+        if not self.filterable:
+            error = HttpResponseError(
+                message="Field 'sourceFileName' is not filterable"
+            )
+            error.status_code = 400
+            raise error
+        self.events.append(("search", filter))
+        return [
+            {key: document.get(key) for key in select}
+            for document in self.documents.values()
+            if filter == _source_filter(document["sourceFileName"])
+        ]
+
+    def upload_documents(self, documents):
+        self.events.append(("upload", [document["id"] for document in documents]))
+        for document in documents:
+            self.documents[document["id"]] = dict(document)
+
+    def merge_documents(self, documents):
+        self.events.append(("merge", [dict(document) for document in documents]))
+        for document in documents:
+            self.documents[document["id"]].update(document)
+
+    def delete_documents(self, documents):
+        self.events.append(("delete", [document["id"] for document in documents]))
+        for document in documents:
+            del self.documents[document["id"]]
+
+    def calls(self, name):
+        return [args for event, args in self.events if event == name]
+
+
+class _FakeOpenAIClient:
+    """埋め込みを作成したテキストを記録する"""
+
+    def __init__(self):
+        self.inputs = []
+        self.embeddings = self
+
+    def with_options(self, **kwargs):
+        return self
+
+    def create(self, input, model):
+        self.inputs.extend(input)
+        data = [
+            type("Embedding", (), {"embedding": [float(len(text))]}) for text in input
+        ]
+        return type("Response", (), {"data": data})
+
+
+class _FakeTokenAccountant:
+    def count(self, text):
+        return len(text)
+
+
+def _source_filter(source_file_name):
+    escaped_name = source_file_name.replace("'", "''")
+    return f"sourceFileName eq '{escaped_name}'"
+
+
+def _chunk(content, page_number=1, keywords=""):
+    return {"content": content, "keywords": keywords, "page_number": page_number}
+
+
+@pytest.fixture
+def search_client():
+    return _FakeSearchClient()
+
+
+@pytest.fixture
+def openai_client():
+    return _FakeOpenAIClient()
+
+
+@pytest.fixture(autouse=True)
+def _azure_services(monkeypatch, search_client, openai_client):
+    class _AzureAISearch:
+        def get_index_name(self, index_type):
+            return f"index-{index_type}"
+
+        def init_search_client(self, index_name):
+            return search_client
+
+    class _AzureOpenAI:
+        def init_client(self):
+            return openai_client
+
+    class _AzureBlobStorage:
+        def get_blob_url(self, name):
+            return f"https://blob.example/{name}"
+
+    monkeypatch.setattr(indexer, "AzureAISearch", _AzureAISearch)
+    monkeypatch.setattr(indexer, "AzureOpenAI", _AzureOpenAI)
+    monkeypatch.setattr(indexer, "AzureBlobStorage", _AzureBlobStorage)
+    monkeypatch.setattr(indexer, "get_token_accountant", _FakeTokenAccountant)
+    monkeypatch.setattr(batch_embedder, "get_token_accountant", _FakeTokenAccountant)
+
+
+def _index(chunks):
+    return indexer._run_indexing_pipeline(
+        chunks, "chunk", [], SOURCE_FILE_NAME, "hr", batch_size=10
+    )
+
+
+def _hashed_id(chunk, occurrence=0):
+    return indexer._chunk_id(SOURCE_FILE_NAME, indexer._chunk_digest(chunk), occurrence)
+
+
+class TestChunkId:
+    """チャンクのIDのテスト"""
+
+    def test_digest_ignores_page_number(self):
+        """ページ番号のみが違うチャンクは同じIDにする"""
+        assert indexer._chunk_digest(_chunk("本文", 1)) == indexer._chunk_digest(
+            _chunk("本文", 5)
+        )
+
+    def test_digest_depends_on_content_and_keywords(self):
+        digest = indexer._chunk_digest(_chunk("本文", keywords="第1章"))
+        assert digest != indexer._chunk_digest(_chunk("本文", keywords="第2章"))
+        assert digest != indexer._chunk_digest(_chunk("本文2", keywords="第1章"))
+
+    def test_occurrence_suffix(self):
+        """同じ内容の2件目以降のチャンクには出現順の番号を付ける"""
+        digest = indexer._chunk_digest(_chunk("本文"))
+        first = indexer._chunk_id(SOURCE_FILE_NAME, digest)
+        assert indexer._decode_data(first) == f"{SOURCE_FILE_NAME}_{digest}"
+        assert indexer._decode_data(indexer._chunk_id(SOURCE_FILE_NAME, digest, 1)) == (
+            f"{SOURCE_FILE_NAME}_{digest}_1"
+        )
+
+
+class TestFindIndexedChunkIds:
+    """登録済みのチャンクの取得のテスト"""
+
+    def test_returns_page_numbers_of_the_file(self, search_client):
+        search_client.documents = {
+            "a": {"id": "a", "pageNumber": 1, "sourceFileName": SOURCE_FILE_NAME},
+            "b": {"id": "b", "pageNumber": 2, "sourceFileName": "other.pdf"},
+        }
+        assert indexer._find_indexed_chunk_ids(search_client, SOURCE_FILE_NAME) == {
+            "a": 1
+        }
+        # ファイル名のシングルクォートはエスケープする
+        assert search_client.calls("search") == [_source_filter(SOURCE_FILE_NAME)]
+
+    def test_not_filterable(self):
+        """sourceFileName でフィルタできないインデックスの場合は None を返す"""
+        client = _FakeSearchClient(filterable=False)
+        assert indexer._find_indexed_chunk_ids(client, SOURCE_FILE_NAME) is None
+
+    def test_other_errors_are_raised(self):
+        class _UnavailableClient:
+            def search(self, **kwargs):
+                error = HttpResponseError(message="Service Unavailable")
+                error.status_code = 503
+                raise error
+
+        with pytest.raises(HttpResponseError):
+            indexer._find_indexed_chunk_ids(_UnavailableClient(), SOURCE_FILE_NAME)
+
+
+class TestRunIndexingPipeline:
+    """差分の判定・埋め込み・アップロード・削除のテスト"""
+
+    def test_first_indexing_uploads_all_chunks(self, search_client, openai_client):
+        chunks = [_chunk("第1条", 1), _chunk("第2条", 2)]
+        stats, changed = _index(chunks)
+        assert changed
+        assert openai_client.inputs == ["第1条", "第2条"]
+        assert set(search_client.documents) == {_hashed_id(c) for c in chunks}
+        document = search_client.documents[_hashed_id(chunks[1])]
+        assert document["pageNumber"] == 2
+        assert document["sourceFileName"] == SOURCE_FILE_NAME
+        assert document["contentVector"] == [3.0]
+        assert stats["upload"]["items_out"] == 2
+        assert search_client.calls("delete") == []
+
+    def test_unchanged_chunks_are_skipped(self, search_client, openai_client):
+        """変更されていないチャンクは埋め込み・アップロードしない"""
+        chunks = [_chunk("第1条", 1), _chunk("第2条", 2)]
+        _index(chunks)
+        search_client.events.clear()
+        openai_client.inputs.clear()
+
+        stats, changed = _index(chunks)
+        assert not changed
+        assert openai_client.inputs == []
+        assert search_client.calls("upload") == []
+        assert search_client.calls("merge") == []
+        assert search_client.calls("delete") == []
+        assert stats["upload"]["items_out"] == 0
+
+    def test_new_and_changed_chunks_are_uploaded(self, search_client, openai_client):
+        """新しいチャンク・変更されたチャンクのみを埋め込んでアップロードする"""
+        _index([_chunk("第1条", 1), _chunk("第2条", 2)])
+        search_client.events.clear()
+        openai_client.inputs.clear()
+
+        revised = [_chunk("第1条", 1), _chunk("第2条（改定）", 2), _chunk("第3条", 3)]
+        _, changed = _index(revised)
+        assert changed
+        assert openai_client.inputs == ["第2条（改定）", "第3条"]
+        assert search_client.calls("upload") == [
+            [_hashed_id(revised[1]), _hashed_id(revised[2])]
+        ]
+        assert set(search_client.documents) == {_hashed_id(c) for c in revised}
+
+    def test_stale_chunks_are_deleted_after_uploads(self, search_client):
+        """なくなったチャンクは、新しいチャンクのアップロードが終わった後に削除する"""
+        old = [_chunk(f"第{i}条", i) for i in range(1, 13)]
+        _index(old)
+        search_client.events.clear()
+
+        revised = [_chunk(f"第{i}条（改定）", i) for i in range(1, 13)]
+        _index(revised)
+        events = [event for event, _ in search_client.events if event != "search"]
+        assert events == ["upload", "upload", "delete"]
+        assert sorted(search_client.calls("delete")[0]) == sorted(
+            _hashed_id(c) for c in old
+        )
+        assert set(search_client.documents) == {_hashed_id(c) for c in revised}
+
+    def test_legacy_positional_ids_are_deleted(self, search_client):
+        """以前の連番のIDのチャンクは、内容のハッシュのIDでアップロードした後に削除する"""
+        legacy_id = indexer._encode_data(f"{SOURCE_FILE_NAME}_0")
+        search_client.documents[legacy_id] = {
+            "id": legacy_id,
+            "pageNumber": 1,
+            "sourceFileName": SOURCE_FILE_NAME,
+        }
+        chunk = _chunk("第1条", 1)
+        _index([chunk])
+        assert search_client.calls("delete") == [[legacy_id]]
+        assert set(search_client.documents) == {_hashed_id(chunk)}
+
+    def test_duplicate_content_gets_occurrence_suffix(
+        self, search_client, openai_client
+    ):
+        """同じ内容のチャンクは出現順の番号を付けて別のチャンクとして登録する"""
+        chunks = [_chunk("以下同じ", 1), _chunk("以下同じ", 2), _chunk("以下同じ", 3)]
+        _index(chunks)
+        assert set(search_client.documents) == {
+            _hashed_id(chunks[0], occurrence) for occurrence in range(3)
+        }
+        assert len(openai_client.inputs) == 3
+
+        # 1件減った場合は、最後の番号のチャンクのみを削除する
+        search_client.events.clear()
+        _index(chunks[:2])
+        assert search_client.calls("upload") == []
+        assert search_client.calls("delete") == [[_hashed_id(chunks[0], 2)]]
+
+    def test_page_only_change_is_merged(self, search_client, openai_client):
+        """ページ番号のみが変わったチャンクは埋め込み直さずに、ページ番号のみを更新する"""
+        chunks = [_chunk("第1条", 1), _chunk("第2条", 2)]
+        _index(chunks)
+        search_client.events.clear()
+        openai_client.inputs.clear()
+
+        # 先頭にページが追加され、既存のチャンクのページ番号が1つずつずれる
+        shifted = [_chunk("表紙", 1), _chunk("第1条", 2), _chunk("第2条", 3)]
+        _, changed = _index(shifted)
+        assert changed
+        assert openai_client.inputs == ["表紙"]
+        assert search_client.calls("upload") == [[_hashed_id(shifted[0])]]
+        assert search_client.calls("merge") == [
+            [
+                {"id": _hashed_id(chunks[0]), "pageNumber": 2},
+                {"id": _hashed_id(chunks[1]), "pageNumber": 3},
+            ]
+        ]
+        assert search_client.calls("delete") == []
+        assert search_client.documents[_hashed_id(chunks[1])]["contentVector"] == [3.0]
+
+    def test_no_chunks_does_not_delete(self, search_client):
+        """チャンクが作成されなかった場合（抽出の失敗の可能性）は既存のチャンクを削除しない"""
+        chunks = [_chunk("第1条", 1)]
+        _index(chunks)
+        search_client.events.clear()
+
+        stats, changed = _index([])
+        assert not changed
+        assert search_client.calls("delete") == []
+        assert set(search_client.documents) == {_hashed_id(chunks[0])}
+        assert stats["upload"]["items_out"] == 0
+
+    def test_not_filterable_index_uploads_all_with_positional_ids(
+        self, search_client, openai_client
+    ):
+        """sourceFileName でフィルタできないインデックスでは、連番のIDで全てのチャンクをアップロードする"""
+        search_client.filterable = False
+        chunks = [_chunk("第1条", 1), _chunk("第2条", 2)]
+
+        for _ in range(2):
+            _, changed = _index(chunks)
+            assert changed
+
+        positional_ids = [
+            indexer._encode_data(f"{SOURCE_FILE_NAME}_{i}") for i in range(2)
+        ]
+        assert search_client.calls("upload") == [positional_ids, positional_ids]
+        assert search_client.calls("merge") == []
+        assert search_client.calls("delete") == []
+        assert openai_client.inputs == ["第1条", "第2条"] * 2
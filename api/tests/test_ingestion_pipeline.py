@@ -0,0 +1,109 @@
+"""
+インデックス作成のストリーミングパイプラインのテスト
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.internal.ingestion_pipeline import IngestionPipeline, batched
+
+
+class TestIngestionPipeline:
+    """ステージの並行実行・バックプレッシャー・エラー処理のテスト"""
+
+    def test_stages_keep_order(self):
+        """各ステージの出力を順に後段のステージに渡す"""
+        results = []
+
+        def collect(items):
+            for item in items:
+                results.append(item)
+                yield item
+
+        pipeline = IngestionPipeline(queue_size=2)
+        pipeline.add_stage("double", lambda items: (item * 2 for item in items))
+        pipeline.add_stage("batch", lambda items: batched(items, 3))
+        pipeline.add_stage("collect", collect)
+        stats = pipeline.run(range(7))
+
+        assert results == [[0, 2, 4], [6, 8, 10], [12]]
+        assert stats["extract"]["items_out"] == 7
+        assert stats["double"]["items_in"] == 7
+        assert stats["batch"]["items_out"] == 3
+        assert stats["collect"]["items_in"] == 3
+
+    def test_stages_run_concurrently(self):
+        """前段のステージが終了する前に後段のステージが処理を開始する"""
+        events = []
+
+        def source():
+            for i in range(3):
+                events.append(("extract", i))
+                time.sleep(0.05)
+                yield i
+
+        def consume(items):
+            for item in items:
+                events.append(("consume", item))
+                yield item
+
+        IngestionPipeline(queue_size=4).add_stage("consume", consume).run(source())
+        assert events.index(("consume", 0)) < events.index(("extract", 2))
+
+    def test_backpressure(self):
+        """後段のステージが遅い場合、前段のステージはキューのサイズ以上に先行しない"""
+        produced = []
+        consumed = []
+        lock = threading.Lock()
+        max_ahead = []
+
+        def source():
+            for i in range(20):
+                with lock:
+                    produced.append(i)
+                    max_ahead.append(len(produced) - len(consumed))
+                yield i
+
+        def slow(items):
+            for item in items:
+                time.sleep(0.005)
+                with lock:
+                    consumed.append(item)
+                yield item
+
+        stats = IngestionPipeline(queue_size=2).add_stage("slow", slow).run(source())
+        assert consumed == list(range(20))
+        # キューのサイズ + 処理中の1件 + 取り出し待ちの1件 まで
+        assert max(max_ahead) <= 4
+        assert stats["extract"]["output_wait_ms"] > 0
+
+    def test_error_stops_pipeline(self):
+        """いずれかのステージで例外が発生した場合は全ステージを停止して送出する"""
+        produced = []
+
+        def source():
+            for i in range(1000):
+                produced.append(i)
+                yield i
+
+        def fail(items):
+            for item in items:
+                if item == 3:
+                    raise RuntimeError("upload failed")
+                yield item
+
+        pipeline = IngestionPipeline(queue_size=2, poll_interval=0.01)
+        pipeline.add_stage("upload", fail)
+        with pytest.raises(RuntimeError, match="upload failed"):
+            pipeline.run(source())
+        assert len(produced) < 1000
+
+    def test_invalid_queue_size(self):
+        with pytest.raises(ValueError):
+            IngestionPipeline(queue_size=0)
@@ -0,0 +1,60 @@
+"""
+モデルルーティングのテスト
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.services.model_routing import ModelRoute, ModelRoutingPolicy
+
+
+class _FakeCompletions:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        if self.fail:
+            raise RuntimeError("API error")
+        return SimpleNamespace(choices=[])
+
+
+def _client(fail=False):
+    return SimpleNamespace(chat=SimpleNamespace(completions=_FakeCompletions(fail)))
+
+
+class TestModelRoutingPolicy:
+    """ModelRoutingPolicyのテスト"""
+
+    def test_routes_to_registered_deployment(self):
+        """登録されたルートのデプロイと max_tokens で呼び出す"""
+        policy = ModelRoutingPolicy(default_deployment="gpt-large")
+        policy.register_route("search_query", ModelRoute("gpt-small", 100))
+        client = _client()
+
+        policy.complete(client, "search_query", [{"role": "user", "content": "q"}])
+        policy.complete(client, "other", [])
+
+        first, second = client.chat.completions.calls
+        assert first["model"] == "gpt-small"
+        assert first["max_tokens"] == 100
+        assert second["model"] == "gpt-large"
+        assert "max_tokens" not in second
+
+    def test_records_latency_per_route(self):
+        """ルートごとに呼び出し回数・エラー数・レイテンシを記録する"""
+        policy = ModelRoutingPolicy(default_deployment="gpt")
+        policy.complete(_client(), "hypothetical_answer", [])
+        with pytest.raises(RuntimeError):
+            policy.complete(_client(fail=True), "hypothetical_answer", [])
+
+        stats = policy.stats()["hypothetical_answer"]
+        assert stats["count"] == 2
+        assert stats["errors"] == 1
+        assert stats["p95_ms"] >= 0
@@ -0,0 +1,63 @@
+"""
+ローカル再ランキングのテスト
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.internal.reranker import LocalReranker
+
+
+def _result(doc_id, vector, reranker_score=None):
+    result = {"id": doc_id, "contentVector": vector}
+    if reranker_score is not None:
+        result["@search.reranker_score"] = reranker_score
+    return result
+
+
+class TestLocalReranker:
+    """LocalRerankerのテスト"""
+
+    def test_orders_by_vector_similarity(self):
+        """コサイン類似度の高い順に並べ替える"""
+        results = [
+            _result("far", [0.0, 1.0]),
+            _result("near", [1.0, 0.1]),
+        ]
+
+        reranked = LocalReranker(top_k=2).rerank([1.0, 0.0], results)
+
+        assert [r["id"] for r in reranked] == ["near", "far"]
+        assert "@search.local_score" in reranked[0]
+
+    def test_blends_reranker_score(self):
+        """セマンティックランカーのスコアを加味する"""
+        results = [
+            _result("a", [1.0, 0.2], reranker_score=0.5),
+            _result("b", [1.0, 0.3], reranker_score=4.0),
+        ]
+
+        reranked = LocalReranker(top_k=2).rerank([1.0, 0.0], results)
+
+        assert reranked[0]["id"] == "b"
+
+    def test_drops_near_duplicates(self):
+        """ほぼ同じ内容のチャンクは除外する"""
+        results = [
+            _result("a", [1.0, 0.0, 0.0]),
+            _result("a-overlap", [0.99, 0.01, 0.0]),
+            _result("b", [0.6, 0.8, 0.0]),
+        ]
+
+        reranked = LocalReranker(top_k=3).rerank([1.0, 0.0, 0.0], results)
+
+        assert [r["id"] for r in reranked] == ["a", "b"]
+
+    def test_limits_to_top_k(self):
+        """上位 top_k 件のみを返す"""
+        results = [_result(str(i), [1.0, i]) for i in range(5)]
+
+        assert len(LocalReranker(top_k=2).rerank([1.0, 0.0], results)) == 2
+        assert LocalReranker().rerank([1.0, 0.0], []) == []
@@ -0,0 +1,124 @@
+"""
+FanOutRetrieverのテスト
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.internal.retriever import FanOutRetriever, reciprocal_rank_fusion
+from src.services.search_result_cache import SearchResultCache
+
+
+class _FakeSearchClient:
+    def __init__(self, docs):
+        self.docs = docs
+        self.call_count = 0
+
+    def search(self, top, **kwargs):
+        self.call_count += 1
+        return iter(self.docs[:top])
+
+
+class _FakeAsyncSearchClient:
+    def __init__(self, docs):
+        self.docs = docs
+        self.call_count = 0
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.closed = True
+
+    async def search(self, top, **kwargs):
+        self.call_count += 1
+
+        async def _results():
+            for doc in self.docs[:top]:
+                yield doc
+
+        return _results()
+
+
+class TestReciprocalRankFusion:
+    """reciprocal_rank_fusionのテスト"""
+
+    def test_deduplicates_by_id(self):
+        """同じidのドキュメントは1件にまとめられる"""
+        fused = reciprocal_rank_fusion(
+            [[{"id": "a"}, {"id": "b"}], [{"id": "b"}, {"id": "c"}]]
+        )
+
+        assert [doc["id"] for doc in fused] == ["b", "a", "c"]
+
+    def test_single_list_keeps_order(self):
+        """単一リストの場合は元の順位を維持する"""
+        fused = reciprocal_rank_fusion([[{"id": "x"}, {"id": "y"}, {"id": "z"}]])
+
+        assert [doc["id"] for doc in fused] == ["x", "y", "z"]
+        assert fused[0]["@search.fused_score"] > fused[1]["@search.fused_score"]
+
+
+class TestFanOutRetriever:
+    """FanOutRetrieverのテスト"""
+
+    def test_searches_each_index_once(self):
+        """同じインデックス名は1回だけ検索される"""
+        clients = {
+            "index-a": _FakeSearchClient([{"id": "1"}, {"id": "2"}]),
+            "index-b": _FakeSearchClient([{"id": "2"}, {"id": "3"}]),
+        }
+        retriever = FanOutRetriever(search_client_factory=clients.__getitem__)
+
+        results = retriever.retrieve(["index-a", "index-b", "index-a"], top=20)
+
+        assert clients["index-a"].call_count == 1
+        assert clients["index-b"].call_count == 1
+        assert sorted(doc["id"] for doc in results) == ["1", "2", "3"]
+
+    def test_limits_to_top(self):
+        """統合後の件数はtop件に制限される"""
+        client = _FakeSearchClient([{"id": str(i)} for i in range(10)])
+        retriever = FanOutRetriever(
+            search_client_factory={"index-a": client}.__getitem__
+        )
+
+        assert len(retriever.retrieve(["index-a"], top=3)) == 3
+
+    @pytest.mark.asyncio
+    async def test_aretrieve_searches_each_index_once(self):
+        """非同期版でも同じインデックス名は1回だけ検索され、クライアントは閉じられる"""
+        clients = {
+            "index-a": _FakeAsyncSearchClient([{"id": "1"}, {"id": "2"}]),
+            "index-b": _FakeAsyncSearchClient([{"id": "2"}, {"id": "3"}]),
+        }
+        retriever = FanOutRetriever(async_search_client_factory=clients.__getitem__)
+
+        results = await retriever.aretrieve(["index-a", "index-b", "index-a"], top=2)
+
+        assert [doc["id"] for doc in results] == ["2", "1"]
+        assert all(c.call_count == 1 and c.closed for c in clients.values())
+
+    def test_result_cache(self):
+        """検索結果キャッシュを指定した場合、同じ検索はインデックスごとに再利用される"""
+        clients = {
+            "index-a": _FakeSearchClient([{"id": "1"}]),
+            "index-b": _FakeSearchClient([{"id": "2"}]),
+        }
+        cache = SearchResultCache()
+        retriever = FanOutRetriever(
+            search_client_factory=clients.__getitem__, result_cache=cache
+        )
+
+        first = retriever.retrieve(["index-a", "index-b"], search_text="残業")
+        cache.bump_version("index-b")
+        second = retriever.retrieve(["index-a", "index-b"], search_text="残業")
+
+        assert first == second
+        assert clients["index-a"].call_count == 1
+        assert clients["index-b"].call_count == 2
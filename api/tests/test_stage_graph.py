@@ -0,0 +1,59 @@
+"""
+StageGraphのテスト
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.internal.stage_graph import StageGraph
+
+
+class TestStageGraph:
+    """StageGraphのテスト"""
+
+    def test_dependency_results_are_passed(self):
+        """依存先ステージの結果がキーワード引数で渡される"""
+        graph = StageGraph()
+        graph.add_stage("answer", lambda: "仮説回答")
+        graph.add_stage("vector", lambda answer: len(answer), depends_on=["answer"])
+
+        results = graph.run()
+
+        assert results == {"answer": "仮説回答", "vector": 4}
+        assert set(graph.timings) == {"answer", "vector"}
+
+    def test_independent_stages_run_concurrently(self):
+        """依存関係のないステージは並行実行される"""
+        graph = StageGraph()
+        graph.add_stage("a", lambda: time.sleep(0.2))
+        graph.add_stage("b", lambda: time.sleep(0.2))
+
+        start = time.perf_counter()
+        graph.run()
+
+        assert time.perf_counter() - start < 0.35
+
+    def test_stage_error_is_propagated(self):
+        """ステージの例外はそのまま送出される"""
+        graph = StageGraph()
+
+        def _fail():
+            raise RuntimeError("埋め込み取得においてエラーが発生しました")
+
+        graph.add_stage("embedding", _fail)
+        graph.add_stage("after", lambda embedding: embedding, depends_on=["embedding"])
+
+        with pytest.raises(RuntimeError):
+            graph.run()
+
+    def test_unknown_dependency_is_rejected(self):
+        """未定義のステージへの依存はエラーになる"""
+        graph = StageGraph()
+
+        with pytest.raises(ValueError):
+            graph.add_stage("vector", lambda answer: answer, depends_on=["answer"])
@@ -0,0 +1,68 @@
+"""
+ストリーミングプロトコルのテスト
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.internal.stream_protocol import (
+    DELTA,
+    DONE,
+    REFERENCES,
+    USAGE,
+    StreamEncoder,
+    StreamEvent,
+    default_stream_format,
+    format_legacy,
+    format_sse,
+)
+
+
+class TestStreamProtocol:
+    """ストリーミング形式の変換のテスト"""
+
+    def test_legacy_format(self):
+        """従来形式では本文と参照情報のみを送信する"""
+        assert format_legacy(StreamEvent(DELTA, "こんにちは")) == "こんにちは"
+        assert (
+            format_legacy(StreamEvent(REFERENCES, [["a.pdf(p.1)", "https://b/a.pdf"]]))
+            == '\n<<REFERENCES_START>>\n[["a.pdf(p.1)", "https://b/a.pdf"]]\n'
+        )
+        assert format_legacy(StreamEvent(USAGE, {"total_tokens": 1})) is None
+        assert format_legacy(StreamEvent(DONE, {"message_id": "x"})) is None
+
+    def test_sse_format(self):
+        """SSEではイベント名とJSONのデータを送信する"""
+        assert format_sse(StreamEvent(DELTA, "改行\nを含む")) == (
+            'event: delta\ndata: "改行\\nを含む"\n\n'
+        )
+        assert format_sse(StreamEvent(DONE, {"message_id": "x"})) == (
+            'event: done\ndata: {"message_id": "x"}\n\n'
+        )
+
+    def test_default_stream_format(self, monkeypatch):
+        """環境変数で既定の形式を切り替える（不正な値は従来形式）"""
+        monkeypatch.setenv("CHAT_STREAM_FORMAT", "SSE")
+        assert default_stream_format() == "sse"
+        monkeypatch.setenv("CHAT_STREAM_FORMAT", "xml")
+        assert default_stream_format() == "legacy"
+
+    def test_encoder_defers_references_in_legacy_format(self):
+        """従来形式では最初に届いた参照情報を本文の後に送信する"""
+        events = [
+            StreamEvent(REFERENCES, []),
+            StreamEvent(DELTA, "回答"),
+            StreamEvent(USAGE, {"total_tokens": 1}),
+        ]
+        legacy = StreamEncoder("legacy")
+        sse = StreamEncoder("sse")
+
+        legacy_bodies = [body for event in events for body in legacy.encode(event)]
+        sse_bodies = [body for event in events for body in sse.encode(event)]
+
+        assert legacy_bodies == ["回答"]
+        assert legacy.close() == ["\n<<REFERENCES_START>>\n[]\n"]
+        assert sse_bodies[0].startswith("event: references\n")
+        assert sse.close() == []
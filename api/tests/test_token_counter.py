@@ -0,0 +1,67 @@
+"""
+トークン数管理のテスト
+"""
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from src.internal.token_counter import TokenAccountant
+
+
+class _CharEncoding:
+    """1文字を1トークンとして数えるエンコーディング"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text):
+        self.calls += 1
+        return list(text)
+
+
+def _message(role, length):
+    return {"role": role, "content": "あ" * length}
+
+
+class TestTokenAccountant:
+    """TokenAccountantのテスト"""
+
+    def test_count_is_memoized(self):
+        """同じテキストは再トークン化しない"""
+        encoding = _CharEncoding()
+        accountant = TokenAccountant(encoding=encoding)
+
+        assert accountant.count("こんにちは") == 5
+        assert accountant.count("こんにちは") == 5
+        assert accountant.count("") == 0
+        assert encoding.calls == 1
+
+    def test_build_window_keeps_system_and_latest(self):
+        """予算超過時はsystemと最後のメッセージを残し、古い履歴から除外する"""
+        accountant = TokenAccountant(encoding=_CharEncoding())
+        messages = [
+            _message("user", 30),
+            _message("assistant", 30),
+            _message("user", 20),
+            _message("system", 10),
+            _message("user", 10),
+        ]
+
+        window = accountant.build_window(messages, max_tokens=50)
+
+        assert window == [messages[2], messages[3], messages[4]]
+
+    def test_build_window_uses_known_counts(self):
+        """計算済みのトークン数があればエンコードしない"""
+        encoding = _CharEncoding()
+        accountant = TokenAccountant(encoding=encoding)
+        messages = [_message("user", 5), _message("assistant", 5), _message("user", 5)]
+
+        window = accountant.build_window(
+            messages, max_tokens=100, token_counts=[5, 5, None]
+        )
+
+        assert window == messages
+        assert encoding.calls == 1
@@ -268,6 +268,21 @@ setup_database_schema() {
         log_error "データベーススキーマの投入に失敗しました"
         return 1
     fi
+
+    # 既存のテーブルへの列の追加（追加済みの場合はスキップされる）
+    local migration_file
+    for migration_file in scripts/migrations/*.sql; do
+        [ -f "$migration_file" ] || continue
+        log_info "マイグレーションを実行しています: $migration_file"
+        if ! mysql -h "$mysql_host" \
+                   -u "$MYSQL_ADMIN_USER" \
+                   -p"$MYSQL_ADMIN_PASSWORD" \
+                   -P 3306 \
+                   -D "$MYSQL_DATABASE_NAME" < "$migration_file"; then
+            log_error "マイグレーションに失敗しました: $migration_file"
+            return 1
+        fi
+    done
 }
 
 # データ確認
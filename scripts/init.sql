@@ -10,6 +10,7 @@ SET CHARACTER_SET_CONNECTION = utf8mb4;
 USE yuyama;
 
 -- テーブルが存在しない場合の作成（SQLAlchemyが実行される前に備えて）
+-- 既存のテーブルは変更しないため、列を追加した場合は scripts/migrations 配下のマイグレーションを既存のデータベースに実行する
 CREATE TABLE IF NOT EXISTS `users` (
   `email` varchar(255) NOT NULL,
   `azure_id` varchar(255) NOT NULL,
@@ -29,6 +30,8 @@ CREATE TABLE IF NOT EXISTS `chat_rooms` (
   `name` varchar(255) NOT NULL,
   `custom_prompt` text,
   `is_active_custom_prompt` tinyint(1) DEFAULT NULL,
+  `summary` text,
+  `summary_message_count` int DEFAULT NULL,
   `deleted_at` datetime DEFAULT NULL,
   `id` varchar(26) NOT NULL,
   `created_at` datetime NOT NULL DEFAULT (now()),
@@ -47,13 +50,16 @@ CREATE TABLE IF NOT EXISTS `chat_messages` (
   `assistant_prompt` text,
   `model` varchar(50) NOT NULL,
   `token_usage` int DEFAULT NULL,
+  `token_count` int DEFAULT NULL,
   `deleted_at` datetime DEFAULT NULL,
   `index_types` json DEFAULT NULL,
+  `retrieval_context` json DEFAULT NULL,
   `id` varchar(26) NOT NULL,
   `created_at` datetime NOT NULL DEFAULT (now()),
   `updated_at` datetime NOT NULL DEFAULT (now()),
   PRIMARY KEY (`id`),
   KEY `chat_room_id` (`chat_room_id`),
+  KEY `chat_room_id_created_at` (`chat_room_id`,`created_at`),
   CONSTRAINT `chat_messages_ibfk_1` FOREIGN KEY (`chat_room_id`) REFERENCES `chat_rooms` (`id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
@@ -0,0 +1,67 @@
+-- 既存のデータベースに、チャット履歴のトークン数・会話の要約・検索結果の保存に必要な列とインデックスを追加する
+-- init.sql の CREATE TABLE IF NOT EXISTS は既存のテーブルを変更しないため、デプロイ前に既存のデータベースに対して実行する
+-- 追加済みの列・インデックスはスキップするため、複数回実行してもよい
+--
+-- 実行例:
+--   mysql -h <ホスト> -u <ユーザー> -p -D yuyama < scripts/migrations/20261016_add_chat_history_columns.sql
+
+SET NAMES utf8mb4;
+
+DROP PROCEDURE IF EXISTS add_column_if_not_exists;
+DROP PROCEDURE IF EXISTS add_index_if_not_exists;
+
+DELIMITER //
+
+CREATE PROCEDURE add_column_if_not_exists(
+  IN target_table varchar(64),
+  IN target_column varchar(64),
+  IN column_definition varchar(255)
+)
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME = target_table
+      AND COLUMN_NAME = target_column
+  ) THEN
+    SET @ddl = CONCAT('ALTER TABLE `', target_table, '` ADD COLUMN `', target_column, '` ', column_definition);
+    PREPARE statement FROM @ddl;
+    EXECUTE statement;
+    DEALLOCATE PREPARE statement;
+  END IF;
+END //
+
+CREATE PROCEDURE add_index_if_not_exists(
+  IN target_table varchar(64),
+  IN target_index varchar(64),
+  IN index_columns varchar(255)
+)
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND TABLE_NAME = target_table
+      AND INDEX_NAME = target_index
+  ) THEN
+    SET @ddl = CONCAT('ALTER TABLE `', target_table, '` ADD KEY `', target_index, '` (', index_columns, ')');
+    PREPARE statement FROM @ddl;
+    EXECUTE statement;
+    DEALLOCATE PREPARE statement;
+  END IF;
+END //
+
+DELIMITER ;
+
+-- 会話の要約（要約済みのメッセージ数）
+CALL add_column_if_not_exists('chat_rooms', 'summary', 'text AFTER `is_active_custom_prompt`');
+CALL add_column_if_not_exists('chat_rooms', 'summary_message_count', 'int DEFAULT NULL AFTER `summary`');
+
+-- メッセージのトークン数と、回答の生成に使用した検索結果
+CALL add_column_if_not_exists('chat_messages', 'token_count', 'int DEFAULT NULL AFTER `token_usage`');
+CALL add_column_if_not_exists('chat_messages', 'retrieval_context', 'json DEFAULT NULL AFTER `index_types`');
+
+-- チャットルームごとの直近のメッセージの取得
+CALL add_index_if_not_exists('chat_messages', 'chat_room_id_created_at', '`chat_room_id`, `created_at`');
+
+DROP PROCEDURE add_column_if_not_exists;
+DROP PROCEDURE add_index_if_not_exists;